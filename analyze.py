@@ -0,0 +1,290 @@
+import argparse
+import csv
+import glob
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from replay import find_run_csv
+from segments import iter_lines, is_segment
+
+# --- Run analyzer ---
+# Replaces the per-device awk acceptance checks in baseline.sh / loss.sh /
+# delay.sh. Every logs/<scenario>_runN directory is analysed in its own
+# worker process; each CSV and log is streamed exactly once.
+#
+#   python3 analyze.py                 # all runs under logs/
+#   python3 analyze.py logs/loss_run*  # selected runs
+
+REPORT_HEADERS = [
+    "scenario", "run", "device_id", "data_sent", "data_received", "delivery_rate",
+    "duplicates", "duplicate_rate", "gaps", "missing", "delay_p50_ms", "delay_p95_ms",
+    "delay_p99_ms", "delay_max_ms", "intervals", "interval_sufficiency",
+    "client_seq_in_order", "reorder_ok", "server_errors"
+]
+SUFFICIENT_PERCENT = 99.0
+
+_RUN_DIR_RE = re.compile(r"^(?P<scenario>.+)_run(?P<run>\d+)$")
+_DEVICE_RE = re.compile(r"dev(?:ice)?(\d+)\.log$")
+_INTERVAL_RE = re.compile(r"Running (\d+)s interval for (\d+) seconds")
+_SENT_DATA_RE = re.compile(r"Sent DATA \(ID=(\d+), seq=(\d+)")
+_SUPPRESSED_RE = re.compile(r"Suppressed DATA \(ID=(\d+)")
+# Only unhandled exceptions count: the server logs handled ones (" Error parsing
+# smart payload", " Error writing to ... sink") and carries on.
+_SERVER_ERROR_RE = re.compile(r"^Traceback \(most recent call last\)")
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def _device_ts_key(text):
+    """' 25/12/2025 06:41:51.619' -> sortable tuple (year, month, day, time)."""
+    text = text.strip()
+    try:
+        date, clock = text.split(" ", 1)
+        day, month, year = date.split("/")
+        return (int(year), int(month), int(day), clock)
+    except ValueError:
+        return None
+
+
+def analyze_client_log(path):
+    """
+    Per-interval report counts and sequence ordering from one client log.
+    Reports held back under a deadband (udpclnt ECHOP_DEADBAND) count as made.
+    """
+    intervals = []  # [interval_s, duration_s, reports, in_order]
+    sent_seqs = set()
+    prev_seq = None
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            m = _INTERVAL_RE.search(line)
+            if m:
+                intervals.append([int(m.group(1)), int(m.group(2)), 0, True])
+                prev_seq = None
+                continue
+            m = _SENT_DATA_RE.search(line)
+            if m:
+                seq = int(m.group(2))
+                sent_seqs.add(seq)
+                if intervals:
+                    cur = intervals[-1]
+                    cur[2] += 1
+                    if prev_seq is not None and seq != prev_seq + 1:
+                        cur[3] = False
+                prev_seq = seq
+                continue
+            if intervals and _SUPPRESSED_RE.search(line):
+                intervals[-1][2] += 1
+    return intervals, sent_seqs
+
+
+def analyze_server_csv(path):
+    """Per-device counts and delay samples from the raw reception CSV (all of its segments)."""
+    devices = {}
+    for row in csv.DictReader(iter_lines(path)):
+        message_type = row.get("message_type", "").strip()
+        if message_type not in ("DATA", "DUPLICATE"):
+            continue
+        d = devices.setdefault(row["device_id"].strip(), {
+            "seqs": set(), "dups": 0, "gaps": 0, "delays": []
+        })
+        if message_type == "DUPLICATE":
+            # One row per duplicate packet (csv sink); the DATA row itself stays unflagged
+            d["dups"] += 1
+            continue
+        if row.get("duplicate_flag", "0").strip() == "1":
+            d["dups"] += 1
+        else:
+            d["seqs"].add(int(row["sequence_number"]))
+        if row.get("gap_flag", "0").strip() == "1":
+            d["gaps"] += 1
+        try:
+            d["delays"].append(float(row["delay_seconds"]) * 1000.0)
+        except (KeyError, ValueError):
+            pass
+    return devices
+
+
+def reordered_in_order(path):
+    """True if device timestamps in the reordered CSV never go backwards (None if absent)."""
+    if not path:
+        return None
+    last = None
+    reader = csv.reader(iter_lines(path))
+    next(reader, None)
+    for row in reader:
+        if len(row) < 5:
+            continue
+        key = _device_ts_key(row[4])
+        if key is None:
+            continue
+        if last is not None and key < last:
+            return False
+        last = key
+    return True
+
+
+def count_server_errors(run_dir):
+    errors = 0
+    for path in glob.glob(os.path.join(run_dir, "server*.log")):
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if _SERVER_ERROR_RE.search(line):
+                    errors += 1
+    return errors
+
+
+def analyze_run(run_dir):
+    """Analyse one run directory; returns a list of report rows (one per device)."""
+    name = os.path.basename(os.path.normpath(run_dir))
+    m = _RUN_DIR_RE.match(name)
+    scenario, run = (m.group("scenario"), int(m.group("run"))) if m else (name, 0)
+
+    server_csv = find_run_csv(run_dir, name)
+    server = analyze_server_csv(server_csv) if server_csv else {}
+    reordered = sorted(p for p in glob.glob(os.path.join(run_dir, "*reordered*.csv")) if not is_segment(p))
+    reorder_ok = reordered_in_order(reordered[0]) if reordered else None
+    server_errors = count_server_errors(run_dir)
+
+    clients = {}
+    for path in sorted(glob.glob(os.path.join(run_dir, "client*.log"))):
+        dm = _DEVICE_RE.search(os.path.basename(path))
+        if dm:
+            clients[dm.group(1)] = analyze_client_log(path)
+
+    rows = []
+    for device_id in sorted(set(server) | set(clients), key=int):
+        intervals, sent_seqs = clients.get(device_id, ([], set()))
+        dev = server.get(device_id, {"seqs": set(), "dups": 0, "gaps": 0, "delays": []})
+        received = len(dev["seqs"] & sent_seqs) if sent_seqs else len(dev["seqs"])
+        sent = len(sent_seqs)
+        delays = sorted(dev["delays"])
+        interval_cells = []
+        sufficient = []
+        in_order = []
+        for interval, duration, count, ordered in intervals:
+            expected = duration // interval if interval else 0
+            perc = (count / expected * 100.0) if expected else 0.0
+            interval_cells.append(f"{interval}s:{count}/{expected}")
+            sufficient.append(perc >= SUFFICIENT_PERCENT)
+            in_order.append(ordered)
+        rows.append({
+            "scenario": scenario,
+            "run": run,
+            "device_id": device_id,
+            "data_sent": sent,
+            "data_received": received,
+            "delivery_rate": round(received / sent * 100.0, 2) if sent else "",
+            "duplicates": dev["dups"],
+            "duplicate_rate": round(dev["dups"] / max(1, len(dev["seqs"])) * 100.0, 2),
+            "gaps": dev["gaps"],
+            "missing": len(sent_seqs - dev["seqs"]) if sent_seqs else "",
+            "delay_p50_ms": round(percentile(delays, 50), 1),
+            "delay_p95_ms": round(percentile(delays, 95), 1),
+            "delay_p99_ms": round(percentile(delays, 99), 1),
+            "delay_max_ms": round(delays[-1], 1) if delays else 0.0,
+            "intervals": " ".join(interval_cells),
+            "interval_sufficiency": ("ok" if all(sufficient) else "insufficient") if sufficient else "",
+            "client_seq_in_order": ("ok" if all(in_order) else "out of order") if in_order else "",
+            "reorder_ok": "" if reorder_ok is None else ("ok" if reorder_ok else "out of order"),
+            "server_errors": server_errors,
+            "_intervals": [(i, c, d // i if i else 0, o) for i, d, c, o in intervals],
+        })
+    return rows
+
+
+def find_run_dirs(root="logs"):
+    return sorted(d for d in glob.glob(os.path.join(root, "*_run*")) if os.path.isdir(d))
+
+
+def print_summary(rows):
+    by_scenario = {}
+    for r in rows:
+        by_scenario.setdefault(r["scenario"], []).append(r)
+    print(f"{'scenario':<10} {'runs':>4} {'devices':>7} {'delivery%':>9} {'dup%':>6} {'gaps':>5} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'intervals':>10} {'reorder':>8} {'errors':>6}")
+    for scenario, srows in sorted(by_scenario.items()):
+        rates = [r["delivery_rate"] for r in srows if r["delivery_rate"] != ""]
+        runs = {r["run"] for r in srows}
+        suff = [r["interval_sufficiency"] for r in srows if r["interval_sufficiency"]]
+        reorder = [r["reorder_ok"] for r in srows if r["reorder_ok"]]
+        print(f"{scenario:<10} {len(runs):>4} {len(srows):>7} "
+              f"{(sum(rates) / len(rates)) if rates else 0:>9.2f} "
+              f"{sum(r['duplicate_rate'] for r in srows) / len(srows):>6.2f} "
+              f"{sum(r['gaps'] for r in srows):>5} "
+              f"{sum(r['delay_p50_ms'] for r in srows) / len(srows):>8.1f} "
+              f"{max(r['delay_p99_ms'] for r in srows):>8.1f} "
+              f"{suff.count('ok'):>4}/{len(suff):<5} "
+              f"{('ok' if all(x == 'ok' for x in reorder) else 'FAIL') if reorder else '-':>8} "
+              f"{sum({r['run']: r['server_errors'] for r in srows}.values()):>6}")
+
+
+def print_details(rows):
+    """Per-run, per-device acceptance lines (what the awk checks used to print)."""
+    runs = {}
+    for r in rows:
+        runs.setdefault((r["scenario"], r["run"]), []).append(r)
+    for (scenario, run), rrows in sorted(runs.items()):
+        print(f"--- {scenario} run {run} ---")
+        for r in rrows:
+            for interval, count, expected, ordered in r["_intervals"]:
+                perc = (count / expected * 100.0) if expected else 0.0
+                status = "sufficient packets" if perc >= SUFFICIENT_PERCENT else "insufficient packets"
+                seq_status = "sequence numbers OK" if ordered else "sequence numbers OUT OF ORDER"
+                print(f"Device {r['device_id']}: Interval {interval}s: {count}/{expected} packets sent "
+                      f"({perc:.2f}%) {status}, {seq_status}")
+            print(f"Device {r['device_id']}: delivered {r['data_received']}/{r['data_sent']} "
+                  f"({r['delivery_rate']}%), {r['duplicates']} duplicates ({r['duplicate_rate']}%), "
+                  f"{r['gaps']} gaps, delay p50 {r['delay_p50_ms']} ms / p99 {r['delay_p99_ms']} ms")
+        reorder = rrows[0]["reorder_ok"]
+        if reorder:
+            print("✔ timestamps correctly reordered" if reorder == "ok" else "✘ timestamps OUT OF ORDER")
+        print("✔ no server crash detected" if rrows[0]["server_errors"] == 0 else "✘ server crash or exception detected")
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse ECHOP scenario run directories in parallel.")
+    parser.add_argument("runs", nargs="*", help="run directories (default: logs/*_run*)")
+    parser.add_argument("--logs", default="logs", help="root searched when no runs are given")
+    parser.add_argument("--report", default=None, help="consolidated CSV report (default: <logs>/analysis_report.csv)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--details", action="store_true", help="also print per-device acceptance lines")
+    args = parser.parse_args()
+
+    run_dirs = [d for d in args.runs if os.path.isdir(d)] or find_run_dirs(args.logs)
+    if not run_dirs:
+        print(f"No run directories found under {args.logs}/")
+        return 1
+
+    start = time.perf_counter()
+    rows = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for run_rows in pool.map(analyze_run, run_dirs):
+            rows.extend(run_rows)
+    elapsed = time.perf_counter() - start
+
+    report = args.report or os.path.join(args.logs, "analysis_report.csv")
+    with open(report, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=REPORT_HEADERS, extrasaction="ignore")
+        w.writeheader()
+        w.writerows(rows)
+
+    if args.details:
+        print_details(rows)
+    print_summary(rows)
+    print(f"\nAnalysed {len(run_dirs)} runs ({len(rows)} device rows) in {elapsed:.2f}s -> {report}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
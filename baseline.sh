@@ -61,7 +61,8 @@ for run in {1..5}; do
     SERVER_LOG="$RUN_DIR/server_baseline_run${run}.log"
     touch "$SERVER_LOG"
     chmod 666 "$SERVER_LOG"
-    $PYTHON udpsrv.py > "$SERVER_LOG" 2>&1 &
+    # Each run is an independent experiment: do not resume sessions from the previous run
+    ECHOP_CHECKPOINT=0 $PYTHON udpsrv.py > "$SERVER_LOG" 2>&1 &
     SERVER_PID=$!
     sleep 1
 
@@ -117,55 +118,12 @@ for run in {1..5}; do
         echo "Warning: logs/metrics.csv not found, skipping metrics copy."
     fi
 
-    # Acceptance Criteria Check per interval per device
-    for DEVICE_ID in "${DEVICE_IDS[@]}"; do
-        CLIENT_LOG="$RUN_DIR/client_baseline_run${run}_dev${DEVICE_ID}.log"
-        echo "Device $DEVICE_ID: Checking packets per interval for run $run"
-
-       awk -v duration="$DURATION" -v intervals="$INTERVALS" '
-        BEGIN {
-            split(intervals, intv_arr, ",")
-            for (i in intv_arr) {
-                count[intv_arr[i]] = 0
-                prev_seq[intv_arr[i]] = -1
-                in_order[intv_arr[i]] = 1
-            }
-            current_interval = -1
-        }
-
-        /Running [0-9]+s interval/ {
-            match($0, /Running ([0-9]+)s interval/, m)
-            current_interval = m[1]
-        }
-
-        /Sent DATA/ && current_interval != -1 {
-            match($0, /seq=([0-9]+)/, s)
-            seq = s[1] + 0
-            count[current_interval]++
-
-            if (prev_seq[current_interval] != -1 && seq != prev_seq[current_interval] + 1)
-                in_order[current_interval] = 0
-
-            prev_seq[current_interval] = seq
-        }
-
-        END {
-            for (i in intv_arr) {
-                interval = intv_arr[i]
-                expected = int(duration / interval)
-                received = count[interval] + 0
-                perc = (received / expected) * 100
-                status = (perc >= 99 ? "sufficient packets" : "insufficient packets")
-                seq_status = (in_order[interval] ? "sequence numbers OK" : "sequence numbers OUT OF ORDER")
-
-                printf "Interval %ds: %d/%d packets received (%.2f%%) %s, %s\n",
-                    interval, received, expected, perc, status, seq_status
-            }
-        }
-        ' "$CLIENT_LOG"
-
-    done
+    # Acceptance Criteria Check per interval per device (see analyze.py)
+    $PYTHON analyze.py "$RUN_DIR" --details --report "$RUN_DIR/analysis_baseline_run${run}.csv"
 
 done
 
+# Consolidated report across all baseline runs
+$PYTHON analyze.py logs/baseline_run* --report logs/analysis_baseline.csv
+
 echo "Baseline test complete (5 runs for ${#DEVICE_IDS[@]} devices)."
\ No newline at end of file
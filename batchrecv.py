@@ -0,0 +1,189 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import socket
+import struct
+
+# --- Batched UDP receive for the collector ---
+# Instead of one blocking recvfrom() per datagram, the server waits for the
+# socket to become readable and then drains everything the kernel has queued
+# into a fixed set of preallocated slots. On Linux a single recvmmsg() call
+# fills the whole batch; elsewhere a recvfrom_into() loop (MSG_DONTWAIT, or a
+# zero-timeout select() per datagram) is used. The socket itself stays blocking.
+
+MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+_SOCKADDR_SIZE = 28  # large enough for sockaddr_in6
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+def _load_recvmmsg():
+    if not os.path.exists("/proc/net/udp"):  # Linux only
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fn = libc.recvmmsg
+    except (OSError, AttributeError):
+        return None
+    fn.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    fn.restype = ctypes.c_int
+    return fn
+
+
+def _decode_sockaddr(raw):
+    """Turn a raw sockaddr_in / sockaddr_in6 into the (host, port) tuple recvfrom() returns."""
+    family = struct.unpack_from("=H", raw, 0)[0]
+    port = struct.unpack_from("!H", raw, 2)[0]
+    if family == socket.AF_INET6:
+        return (socket.inet_ntop(socket.AF_INET6, bytes(raw[8:24])), port)
+    return (socket.inet_ntop(socket.AF_INET, bytes(raw[4:8])), port)
+
+
+class BatchReceiver:
+    """
+    Receives up to `slots` datagrams per wakeup into preallocated buffers.
+    `wait_and_drain()` returns a list of (bytes, addr) pairs; the bytes are
+    copied out of the slots so callers may keep them.
+    """
+
+    def __init__(self, sock, slots=64, slot_size=200, use_recvmmsg=True):
+        self.sock = sock
+        self.slots = slots
+        self.slot_size = slot_size
+        self.buffer = bytearray(slots * slot_size)
+        self.view = memoryview(self.buffer)
+        self.batches = 0
+        self.datagrams = 0
+        self.max_batch = 0
+        self._recvmmsg = _load_recvmmsg() if use_recvmmsg else None
+        if self._recvmmsg is not None:
+            self._setup_mmsg()
+        # The socket stays blocking: the server also sends NACKs on it, and a
+        # non-blocking sendto() would fail with EAGAIN whenever the buffer fills.
+
+    @property
+    def mode(self):
+        return "recvmmsg" if self._recvmmsg is not None else "recvfrom_into"
+
+    def _setup_mmsg(self):
+        base = ctypes.addressof((ctypes.c_char * len(self.buffer)).from_buffer(self.buffer))
+        self._names = ctypes.create_string_buffer(self.slots * _SOCKADDR_SIZE)
+        names_base = ctypes.addressof(self._names)
+        self._iovecs = (_IOVec * self.slots)()
+        self._msgs = (_MMsgHdr * self.slots)()
+        for i in range(self.slots):
+            self._iovecs[i].iov_base = base + i * self.slot_size
+            self._iovecs[i].iov_len = self.slot_size
+            hdr = self._msgs[i].msg_hdr
+            hdr.msg_name = names_base + i * _SOCKADDR_SIZE
+            hdr.msg_iov = ctypes.pointer(self._iovecs[i])
+            hdr.msg_iovlen = 1
+
+    def _drain_mmsg(self):
+        for i in range(self.slots):
+            self._msgs[i].msg_hdr.msg_namelen = _SOCKADDR_SIZE
+        n = self._recvmmsg(self.sock.fileno(), self._msgs, self.slots, MSG_DONTWAIT, None)
+        if n < 0:
+            err = ctypes.get_errno()
+            if err in (11, 35):  # EAGAIN / EWOULDBLOCK
+                return []
+            raise OSError(err, os.strerror(err))
+        names = memoryview(self._names.raw)
+        out = []
+        for i in range(n):
+            length = self._msgs[i].msg_len
+            off = i * self.slot_size
+            addr = _decode_sockaddr(names[i * _SOCKADDR_SIZE:(i + 1) * _SOCKADDR_SIZE])
+            out.append((bytes(self.view[off:off + length]), addr))
+        return out
+
+    def _drain_loop(self):
+        out = []
+        for i in range(self.slots):
+            off = i * self.slot_size
+            try:
+                if MSG_DONTWAIT:
+                    n, addr = self.sock.recvfrom_into(self.view[off:off + self.slot_size], self.slot_size, MSG_DONTWAIT)
+                else:
+                    # No per-call non-blocking flag here: only read what select() says is queued.
+                    if not select.select([self.sock], [], [], 0)[0]:
+                        break
+                    n, addr = self.sock.recvfrom_into(self.view[off:off + self.slot_size], self.slot_size)
+            except (BlockingIOError, InterruptedError):
+                break
+            out.append((bytes(self.view[off:off + n]), addr))
+        return out
+
+    def wait(self, timeout=None):
+        """Block until the socket is readable (or `timeout` passes)."""
+        select.select([self.sock], [], [], timeout)
+
+    def drain(self):
+        """Return every queued datagram (up to `slots`) without blocking."""
+        batch = self._drain_mmsg() if self._recvmmsg is not None else self._drain_loop()
+        if batch:
+            self.batches += 1
+            self.datagrams += len(batch)
+            if len(batch) > self.max_batch:
+                self.max_batch = len(batch)
+        return batch
+
+    def wait_and_drain(self, timeout=None):
+        """Block until the socket is readable, then return every queued datagram (up to `slots`)."""
+        self.wait(timeout)
+        return self.drain()
+
+
+def set_rcvbuf(sock, size):
+    """Request a kernel receive buffer of `size` bytes and return what the kernel granted."""
+    if size:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+        except OSError as e:
+            print(f"Could not set SO_RCVBUF={size}: {e}")
+    return sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+
+def read_udp_drops(sock):
+    """
+    Kernel-side drop counter for `sock` from /proc/net/udp{,6}.
+    Returns None when the counter is not available (non-Linux).
+    """
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+    except OSError:
+        return None
+    found = False
+    drops = 0
+    for path in ("/proc/net/udp", "/proc/net/udp6"):
+        try:
+            with open(path, "r") as f:
+                next(f, None)  # column header
+                for line in f:
+                    fields = line.split()
+                    # sl local rem st tx:rx tr tm->when retrnsmt uid timeout inode ref pointer drops
+                    if len(fields) >= 13 and fields[9] == inode:
+                        drops += int(fields[-1])
+                        found = True
+        except OSError:
+            continue
+    return drops if found else None
@@ -0,0 +1,205 @@
+import json
+import os
+import threading
+import time
+
+# --- Crash-safe session checkpoints ---
+# Device sessions are saved as a periodic snapshot (written to a temp file,
+# fsynced and atomically renamed) plus a small append-only journal of the
+# changes made since. Journal entries carry absolute values, so replaying an
+# entry that is already part of the snapshot is harmless. On restart the
+# collector reloads both and carries on without re-INITing every device.
+#
+# The receive loop only appends to the journal's buffer. flush() and
+# maybe_snapshot() run on a background thread: a snapshot captures the
+# sessions and starts a new journal under the lock, keeping the old one as
+# <journal>.prev until the fsynced snapshot that covers it is in place.
+
+SNAPSHOT_VERSION = 1
+
+
+class SessionCheckpoint:
+    def __init__(self, path, snapshot_seconds=5.0):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.prev_journal_path = self.journal_path + ".prev"
+        self.snapshot_seconds = snapshot_seconds
+        self.lock = threading.Lock()           # journal file
+        self.snapshot_lock = threading.Lock()  # one snapshot at a time
+        self._journal = None
+        self._next_snapshot = time.monotonic() + snapshot_seconds
+        self.journal_entries = 0
+
+    # --- restore ---
+    def age(self):
+        """Seconds since the checkpoint files were last written (None if there are none)."""
+        mtimes = []
+        for path in (self.path, self.prev_journal_path, self.journal_path):
+            try:
+                mtimes.append(os.path.getmtime(path))
+            except OSError:
+                pass
+        return time.time() - max(mtimes) if mtimes else None
+
+    def load(self, max_age=None):
+        """
+        Return {device_id: state dict} from the snapshot plus journal (empty if
+        none). A checkpoint last written more than `max_age` seconds ago belongs
+        to sessions that have timed out since, and is ignored.
+        """
+        sessions = {}
+        age = self.age()
+        if max_age is not None and age is not None and age > max_age:
+            print(f"[checkpoint] ignoring {self.path}: last written {age:.0f}s ago (limit {max_age:g}s)")
+            return sessions
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                snap = json.load(f)
+            if snap.get("version") == SNAPSHOT_VERSION:
+                for device_id, state in snap.get("sessions", {}).items():
+                    sessions[int(device_id)] = {
+                        "h": state["h"], "t": state.get("t"), "u": state.get("u"),
+                        "m": set(state.get("m", [])),
+                    }
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            print(f"[checkpoint] ignoring unreadable snapshot {self.path}: {e}")
+
+        # A .prev journal is left when the server stopped between starting a new
+        # journal and renaming the snapshot that covers the old one.
+        for path in (self.prev_journal_path, self.journal_path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            break  # torn last line after a crash
+                        self._apply(sessions, entry)
+            except FileNotFoundError:
+                pass
+        return sessions
+
+    @staticmethod
+    def _apply(sessions, entry):
+        device_id = entry["d"]
+        if entry.get("x"):
+            sessions.pop(device_id, None)
+            return
+        state = sessions.setdefault(device_id, {"h": 0, "t": None, "u": None, "m": set()})
+        if entry.get("i"):
+            state["m"].clear()
+        state["h"] = entry["h"]
+        if entry.get("t") is not None:
+            state["t"] = entry["t"]
+        if entry.get("u") is not None:
+            state["u"] = entry["u"]
+        state["m"].update(entry.get("a", ()))
+        state["m"].difference_update(entry.get("r", ()))
+
+    # --- journal ---
+    def _open_journal(self, mode="a"):
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+        self._journal = open(self.journal_path, mode, encoding="utf-8")
+
+    def record(self, device_id, tracker, added=(), removed=(), reset=False):
+        """Append one session change. `reset` marks an INIT (missing set cleared)."""
+        entry = {"d": device_id, "h": tracker.highest_seq}
+        if tracker.last_data_ts_ms is not None:
+            entry["t"] = tracker.last_data_ts_ms
+        if reset:
+            entry["i"] = 1
+            entry["u"] = tracker.unit
+        if added:
+            entry["a"] = list(added)
+        if removed:
+            entry["r"] = list(removed)
+        self._write(entry)
+
+    def record_eviction(self, device_id):
+        self._write({"d": device_id, "x": 1})
+
+    def _write(self, entry):
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self.lock:
+            try:
+                if self._journal is None:
+                    self._open_journal()
+                self._journal.write(line)
+                self.journal_entries += 1
+            except OSError as e:
+                print(f"[checkpoint] journal write failed: {e}")
+
+    def flush(self):
+        """Push buffered journal entries to the file (called periodically, off the receive loop)."""
+        with self.lock:
+            try:
+                if self._journal is not None:
+                    self._journal.flush()
+            except OSError as e:
+                print(f"[checkpoint] journal flush failed: {e}")
+
+    # --- snapshot ---
+    def maybe_snapshot(self, trackers):
+        if time.monotonic() >= self._next_snapshot:
+            self.snapshot(trackers)
+
+    def snapshot(self, trackers):
+        """Atomically write every session to the snapshot file and start a fresh journal."""
+        with self.snapshot_lock:
+            self._snapshot(trackers)
+
+    def _snapshot(self, trackers):
+        self._next_snapshot = time.monotonic() + self.snapshot_seconds
+        with self.lock:
+            # Capture and switch journals together: every change after the
+            # capture lands in the new journal.
+            sessions = {
+                str(device_id): {
+                    "h": t.highest_seq, "t": t.last_data_ts_ms, "u": t.unit,
+                    "m": sorted(t.missing_set),
+                }
+                for device_id, t in trackers.items()
+            }
+            try:
+                self._rotate_journal()
+            except OSError as e:
+                print(f"[checkpoint] snapshot failed: {e}")
+                return
+        snap = {"version": SNAPSHOT_VERSION, "saved_at": time.time(), "sessions": sessions}
+        tmp_path = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snap, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            # Everything in the old journal is now covered by the snapshot.
+            if os.path.exists(self.prev_journal_path):
+                os.remove(self.prev_journal_path)
+        except OSError as e:
+            print(f"[checkpoint] snapshot failed: {e}")
+
+    def _rotate_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self.journal_path):
+            if os.path.exists(self.prev_journal_path):
+                # The last snapshot failed: keep its changes until one succeeds.
+                with open(self.journal_path, "r", encoding="utf-8") as src, \
+                        open(self.prev_journal_path, "a", encoding="utf-8") as dst:
+                    dst.write(src.read())
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, self.prev_journal_path)
+        self._open_journal("w")
+        self.journal_entries = 0
+
+    def close(self):
+        with self.lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
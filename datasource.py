@@ -0,0 +1,245 @@
+import math
+import mmap
+import os
+import random
+from array import array
+from collections import OrderedDict
+
+# --- Sensor data sources for udpclnt.py ---
+# A client replays its batch file as an endless stream of readings. Instead of
+# parsing the whole file into a list of floats up front, readings come from:
+#   - MmapSource:      a flat float64 cache (<batch_file>.f64) built once by
+#                      streaming the text file, then mmapped on every launch
+#   - TextSource:      the text file itself, parsed lazily as it is read
+#   - SyntheticSource: generated values, e.g. "synthetic:sine,base=20,amp=5"
+# Every source reads `n` values starting at a stream position and wraps around
+# at the end of the data, like the old `data[(i) % len(data)]` indexing.
+
+CACHE_SUFFIX = ".f64"
+CACHE_BUILD_CHUNK = 65536  # values buffered per write while building a cache
+
+
+def iter_text_values(path):
+    """Yield every float in a batch file (comma-separated, '#' comments), one line at a time."""
+    with open(path, "r") as f:
+        for raw in f:
+            line = raw.strip()
+            if not line or line.startswith("#"):
+                continue
+            for t in line.split(","):
+                t = t.strip()
+                if not t:
+                    continue
+                try:
+                    yield float(t)
+                except ValueError:
+                    pass
+
+
+class TextSource:
+    """Parses the batch file lazily; its length is learned at the end of the first pass."""
+
+    def __init__(self, path):
+        self.path = path
+        self.length = None
+        self._values = None
+        self._pos = 0
+        self._rewind()
+        if next(iter_text_values(path), None) is None:
+            raise ValueError(f"no valid data in {path}")
+
+    def _rewind(self):
+        self._values = iter_text_values(self.path)
+        self._pos = 0
+
+    def read(self, position, n):
+        if self.length:
+            position %= self.length
+        if position != self._pos:
+            # Non-sequential read (e.g. stream reset on re-INIT): rescan from the start.
+            self._rewind()
+            for _ in range(position):
+                next(self._values)
+            self._pos = position
+        out = []
+        while len(out) < n:
+            value = next(self._values, None)
+            if value is None:
+                self.length = self._pos
+                self._rewind()
+                continue
+            out.append(value)
+            self._pos += 1
+        if self.length and self._pos >= self.length:
+            self._pos %= self.length
+        return out
+
+    def next_position(self, position, n):
+        position += n
+        return position % self.length if self.length else position
+
+    def close(self):
+        self._values = None
+
+
+class MmapSource:
+    """Random access into a memory-mapped float64 cache of the batch file."""
+
+    def __init__(self, path, cache_path=None):
+        self.path = path
+        self.cache_path = cache_path or path + CACHE_SUFFIX
+        if not self._cache_fresh():
+            build_cache(path, self.cache_path)
+        self._file = open(self.cache_path, "rb")
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.close()
+            raise ValueError(f"no valid data in {path}")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._values = memoryview(self._map).cast("d")
+        self.length = len(self._values)
+
+    def _cache_fresh(self):
+        try:
+            return os.stat(self.cache_path).st_mtime_ns >= os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+
+    def read(self, position, n):
+        start = position % self.length
+        end = start + n
+        if end <= self.length:
+            return self._values[start:end].tolist()
+        out = self._values[start:].tolist()
+        while len(out) < n:
+            out.extend(self._values[:min(n - len(out), self.length)].tolist())
+        return out
+
+    def next_position(self, position, n):
+        return (position + n) % self.length
+
+    def close(self):
+        self._values.release()
+        self._map.close()
+        self._file.close()
+
+
+def build_cache(path, cache_path):
+    """Stream a text batch file into a native-endian float64 file (atomically replaced)."""
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    buf = array("d")
+    with open(tmp_path, "wb") as out:
+        for value in iter_text_values(path):
+            buf.append(value)
+            if len(buf) >= CACHE_BUILD_CHUNK:
+                buf.tofile(out)
+                buf = array("d")
+        buf.tofile(out)
+    os.replace(tmp_path, cache_path)
+
+
+class SyntheticSource:
+    """
+    Endless generated readings: "synthetic:<shape>[,key=value...]".
+    Shapes: sine, ramp, walk, constant. Keys: base, amp, period (readings),
+    noise (std dev), seed. Values depend only on the position, so re-reading
+    a position (after a re-INIT) yields the same readings.
+    """
+
+    SHAPES = ("sine", "ramp", "walk", "constant")
+
+    def __init__(self, spec):
+        parts = [p.strip() for p in spec.split(":", 1)[1].split(",") if p.strip()]
+        self.shape = parts[0] if parts and "=" not in parts[0] else "sine"
+        if self.shape not in self.SHAPES:
+            raise ValueError(f"unknown synthetic shape {self.shape!r} (expected one of {', '.join(self.SHAPES)})")
+        opts = dict(p.split("=", 1) for p in parts if "=" in p)
+        self.base = float(opts.get("base", 20.0))
+        self.amp = float(opts.get("amp", 5.0))
+        self.period = max(1, int(opts.get("period", 600)))
+        self.noise = float(opts.get("noise", 0.0))
+        self.seed = int(opts.get("seed", 0))
+        self.length = None
+
+    def _value(self, i):
+        phase = (i % self.period) / self.period
+        if self.shape == "sine":
+            value = self.base + self.amp * math.sin(2 * math.pi * phase)
+        elif self.shape == "ramp":
+            value = self.base + self.amp * phase
+        elif self.shape == "walk":
+            # Smooth pseudo-random drift: interpolate between seeded knots one period apart.
+            k, frac = divmod(i, self.period)
+            lo = random.Random(self.seed * 1000003 + k).uniform(-1, 1)
+            hi = random.Random(self.seed * 1000003 + k + 1).uniform(-1, 1)
+            value = self.base + self.amp * (lo + (hi - lo) * frac / self.period)
+        else:
+            value = self.base
+        if self.noise:
+            value += random.Random(self.seed * 7919 + i).gauss(0.0, self.noise)
+        return round(value, 6)
+
+    def read(self, position, n):
+        return [self._value(i) for i in range(position, position + n)]
+
+    def next_position(self, position, n):
+        return position + n
+
+    def close(self):
+        pass
+
+
+def open_data_source(batch_file, kind=None):
+    """
+    Open the reading stream for a device_config.txt batch_file entry.
+    `kind` is "mmap" (default) or "text"; "synthetic:..." entries ignore it.
+    Raises ValueError if the file holds no readings, FileNotFoundError if missing.
+    """
+    if batch_file.startswith("synthetic:"):
+        return SyntheticSource(batch_file)
+    if not os.path.exists(batch_file):
+        raise FileNotFoundError(batch_file)
+    kind = kind or os.environ.get("ECHOP_DATA_SOURCE", "mmap")
+    if kind == "text":
+        return TextSource(batch_file)
+    if kind == "mmap":
+        return MmapSource(batch_file)
+    raise ValueError(f"unknown data source {kind!r} (expected mmap or text)")
+
+
+class EncodedChunkCache:
+    """
+    Bounded LRU of encoded (not yet encrypted) payloads keyed by stream position.
+    A finite source is replayed cyclically, so the same chunks recur and only
+    the seq-dependent cipher and checksum need to run per send. Generated
+    sources never repeat a position and bypass the cache.
+    """
+
+    def __init__(self, source, encode, max_entries=4096):
+        self.source = source
+        self.encode = encode   # list of floats -> plaintext payload bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, position, n, values=None):
+        """
+        Return (value_count, plaintext payload) for the n readings at `position`.
+        Pass `values` when the caller already read them, so a miss does not read
+        the source a second time (a TextSource would rescan from the start).
+        """
+        key = (position, n)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        if values is None:
+            values = self.source.read(position, n)
+        entry = (len(values), self.encode(values))
+        self.misses += 1
+        if self.max_entries and self.source.length:
+            self.entries[key] = entry
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
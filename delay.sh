@@ -3,6 +3,8 @@
 # Delay + jitter scenario
 # NetEm: 100ms ±10ms with reordering
 # Goal: Simulate one packet being significantly delayed
+# Delay is applied by netem_proxy.py (no root needed); run N uses seed NETEM_SEED+N,
+# so every run sees the same per-packet delays on any host.
 
 set -euo pipefail
 
@@ -12,18 +14,17 @@ cleanup() {
     # Kill background jobs
     jobs -p | xargs -r kill 2>/dev/null || true
     
-    # Reset network
-    sudo tc qdisc del dev lo root 2>/dev/null || true
-    
     # Kill any stray udpsrv.py processes
     # We use || true because pkill might return 1 (no process) or 127 (not found)
     pkill -f udpsrv.py 2>/dev/null || true
+    pkill -f netem_proxy.py 2>/dev/null || true
 }
 trap cleanup EXIT
 
 # Kill any existing server instances before starting
 echo "Killing stale server instances..."
 pkill -f udpsrv.py 2>/dev/null || true
+pkill -f netem_proxy.py 2>/dev/null || true
 
 
 mkdir -p logs
@@ -66,15 +67,24 @@ echo "Duration=${DURATION}s, Intervals=${INTERVALS}"
 DELAY_MS=100
 JITTER_MS=10
 
-# Reset network first
-sudo tc qdisc del dev lo root 2>/dev/null || true
-
-# Apply NetEm delay + jitter + reordering
-sudo tc qdisc add dev lo root netem delay ${DELAY_MS}ms ${JITTER_MS}ms
-echo "Applied network conditions:"
+# Delay + jitter in both directions, applied by the impairment proxy
+NETEM_SPEC="delay=${DELAY_MS},jitter=${JITTER_MS}"
+NETEM_SEED=${NETEM_SEED:-0}
+PROXY_PORT=12003
+echo "Network conditions (netem_proxy.py on port ${PROXY_PORT}):"
 echo "  Base delay: ${DELAY_MS}ms"
 echo "  Jitter: ±${JITTER_MS}ms"
 
+# PCAP capture needs tcpdump and root; runs without it still produce CSVs and logs
+CAPTURE=0
+SUDO=""
+[ "$(id -u)" -eq 0 ] || SUDO="sudo"
+if command -v tcpdump >/dev/null 2>&1 && { [ -z "$SUDO" ] || sudo -n true 2>/dev/null; }; then
+    CAPTURE=1
+else
+    echo "tcpdump/sudo unavailable: skipping PCAP capture"
+fi
+
 # -----------------------------
 # Run 5 delay tests
 # -----------------------------
@@ -101,17 +111,30 @@ for run in {1..5}; do
     # Start PCAP capture
     # -------------------------
     PCAP_FILE="$RUN_DIR/delay_run${run}.pcap"
-    sudo tcpdump -i lo udp port 12001 -w "$PCAP_FILE" &>/dev/null &
-    PCAP_PID=$!
-    sleep 0.5
+    PCAP_PID=""
+    if [ "$CAPTURE" -eq 1 ]; then
+        $SUDO tcpdump -i lo udp port 12001 -w "$PCAP_FILE" &>/dev/null &
+        PCAP_PID=$!
+        sleep 0.5
+    fi
 
     # -------------------------
     # Start server
     # -------------------------
     SERVER_LOG="$RUN_DIR/server.log"
-    $PYTHON udpsrv.py > "$SERVER_LOG" 2>&1 &
+    # Each run is an independent experiment: do not resume sessions from the previous run
+    ECHOP_CHECKPOINT=0 $PYTHON udpsrv.py > "$SERVER_LOG" 2>&1 &
     SERVER_PID=$!
-    sleep 1  # Give server time to start
+
+    # -------------------------
+    # Start impairment proxy between clients and server
+    # -------------------------
+    SEED=$((NETEM_SEED + run))
+    PROXY_LOG="$RUN_DIR/proxy.log"
+    $PYTHON netem_proxy.py --listen "0.0.0.0:${PROXY_PORT}" --server localhost:12001 \
+        --both "$NETEM_SPEC" --seed "$SEED" > "$PROXY_LOG" 2>&1 &
+    PROXY_PID=$!
+    sleep 1  # Give server and proxy time to start
 
     # -------------------------
     # Run clients for all devices
@@ -123,7 +146,7 @@ for run in {1..5}; do
     for DEVICE_ID in "${DEVICE_IDS[@]}"; do
         CLIENT_LOG="$RUN_DIR/client_device${DEVICE_ID}.log"
         echo "  Starting client for Device $DEVICE_ID..."
-        $PYTHON udpclnt.py "$DEVICE_ID" "$DURATION" "$INTERVALS" > "$CLIENT_LOG" 2>&1 &
+        ECHOP_SERVER="localhost:${PROXY_PORT}" $PYTHON udpclnt.py "$DEVICE_ID" "$DURATION" "$INTERVALS" > "$CLIENT_LOG" 2>&1 &
         CLIENT_PIDS+=($!)
         CLIENT_LOGS+=("$CLIENT_LOG")
     done
@@ -143,13 +166,18 @@ for run in {1..5}; do
         wait "$SERVER_PID" 2>/dev/null || true
     fi
 
+    # Stop impairment proxy (prints its counters to the proxy log)
+    if kill -0 "$PROXY_PID" 2>/dev/null; then
+        kill "$PROXY_PID" 2>/dev/null || true
+        wait "$PROXY_PID" 2>/dev/null || true
+    fi
+
     # Stop PCAP capture
-    if kill -0 "$PCAP_PID" 2>/dev/null; then
-        sudo kill "$PCAP_PID" 2>/dev/null || true
+    if [ -n "$PCAP_PID" ] && kill -0 "$PCAP_PID" 2>/dev/null; then
+        $SUDO kill "$PCAP_PID" 2>/dev/null || true
         wait "$PCAP_PID" 2>/dev/null || true
+        echo "PCAP saved: $PCAP_FILE"
     fi
-    
-    echo "PCAP saved: $PCAP_FILE"
 
     # -------------------------
     # Move CSV files to run directory
@@ -184,12 +212,14 @@ for run in {1..5}; do
     NETEM_LOG="$RUN_DIR/netem_config.txt"
     {
         echo "Network configuration for delay test run ${run}:"
-        echo "  sudo tc qdisc add dev lo root netem delay ${DELAY_MS}ms ${JITTER_MS}ms"
+        echo "  netem_proxy.py --both ${NETEM_SPEC} --seed ${SEED}"
         echo "  Base delay: ${DELAY_MS}ms"
         echo "  Jitter: ±${JITTER_MS}ms"
         echo ""
         echo "Goal: Simulate one packet being significantly delayed"
         echo "Expected behavior: Packets may arrive out of order (e.g., 1,3,4,2)"
+        echo ""
+        tail -n 2 "$PROXY_LOG"
     } > "$NETEM_LOG"
 
     # -------------------------
@@ -200,43 +230,15 @@ for run in {1..5}; do
     
     echo "Checking acceptance criteria for run ${run}"
 
-    # 1) Timestamp reordering check (DEVICE timestamp column = 5)
-    if [ -f "$RUN_DIR/delay_run${run}_reordered.csv" ]; then
-        awk -F, '
-        BEGIN { in_order = 1 }
-        NR == 1 { next }
-        {
-            ts = $5
-            if (last_ts != "" && ts < last_ts)
-                in_order = 0
-            last_ts = ts
-        }
-        END {
-            if (in_order)
-                print "✔ timestamps correctly reordered"
-            else
-                print "✘ timestamps OUT OF ORDER"
-        }
-        ' "$RUN_DIR/delay_run${run}_reordered.csv"
-    else
-        echo "✘ reordered CSV missing — cannot verify ordering"
-    fi
-
-    # 2) Server crash check
-    if grep -qiE "ERROR|Traceback|Exception" "$SERVER_LOG"; then
-        echo "✘ server crash or exception detected"
-    else
-        echo "✔ no server crash detected"
-    fi
+    # Timestamp reordering, per-interval packets and server crash check (see analyze.py)
+    $PYTHON analyze.py "$RUN_DIR" --details --report "$RUN_DIR/analysis_delay_run${run}.csv"
 
     echo ""
 done
 
-# -----------------------------
-# Reset network
-# -----------------------------
-sudo tc qdisc del dev lo root 2>/dev/null || true
 echo ""
+# Consolidated report across all delay runs
+$PYTHON analyze.py logs/delay_run* --report logs/analysis_delay.csv
 echo "========================================"
 echo "Delay+jitter test complete!"
 echo "Summary:"
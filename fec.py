@@ -0,0 +1,194 @@
+import struct
+import threading
+from collections import OrderedDict
+
+from protocol import *
+
+# --- Forward error correction (XOR parity) ---
+# With ECHOP_FEC_K=k the client groups its DATA packets by seq into aligned
+# blocks of k (seqs 2..k+1, k+2..2k+1, ... - seq 1 is the INIT) and sends one
+# parity packet per block: the XOR of the block's whole packets (header and
+# encrypted payload, zero-padded to the longest), the XOR of their lengths and
+# a bitmap of the seqs it covers. The server keeps each device's recent
+# packets and rebuilds any single missing one as soon as the parity arrives,
+# so an isolated loss costs no NACK round trip. Overhead is one packet per k.
+#
+# Parity packet: protocol version 2, msg_type EXT_FEC_PARITY, batch_count = k,
+# seq = first seq of the block; payload = bitmap (u16) + length XOR (u8) + XOR body.
+
+FIRST_DATA_SEQ = 2
+PARITY_PREFIX = struct.Struct('!HB')
+MAX_FEC_K = 15  # k travels in the 4-bit batch_count field
+
+
+def block_base(seq, k):
+    """First seq of the aligned block of k that `seq` belongs to."""
+    return FIRST_DATA_SEQ + ((seq - FIRST_DATA_SEQ) // k) * k
+
+
+def xor_packets(packets, width):
+    """XOR byte strings, each zero-padded to `width`."""
+    acc = 0
+    for packet in packets:
+        acc ^= int.from_bytes(packet.ljust(width, b"\0"), "big")
+    return acc.to_bytes(width, "big")
+
+
+def pack_fec_parity(device_id, k, base_seq, packets):
+    """Build the parity packet for {seq: packet} of one block."""
+    bitmap = 0
+    length_xor = 0
+    for seq, packet in packets.items():
+        bitmap |= 1 << (seq - base_seq)
+        length_xor ^= len(packet)
+    width = max(len(p) for p in packets.values())
+    payload = PARITY_PREFIX.pack(bitmap, length_xor) + xor_packets(packets.values(), width)
+    header = build_checksum_header(device_id, k, base_seq & 0xFFFF, EXT_FEC_PARITY, payload,
+                                   proto_version=EXT_PROTO_VERSION)
+    return header + payload
+
+
+def unpack_fec_parity(payload):
+    """Return (bitmap, length XOR, XOR body) of a parity packet's payload."""
+    if len(payload) <= PARITY_PREFIX.size:
+        raise ValueError("Invalid FEC parity: too short")
+    bitmap, length_xor = PARITY_PREFIX.unpack_from(payload)
+    return bitmap, length_xor, payload[PARITY_PREFIX.size:]
+
+
+class FecEncoder:
+    """Client side: collects each block's packets and emits its parity packet."""
+
+    def __init__(self, device_id, k):
+        self.device_id = device_id
+        self.k = min(k, MAX_FEC_K)
+        self.base = None
+        self.packets = {}
+        self.parity_total = 0
+
+    def add(self, seq, packet):
+        """Add a first transmission; returns the block's parity packet once it is complete, else None."""
+        base = block_base(seq, self.k)
+        parity = None
+        if base != self.base:
+            parity = self.flush()
+            self.base = base
+        self.packets[seq] = packet
+        if seq == base + self.k - 1:
+            parity = self.flush()
+        return parity
+
+    def flush(self):
+        """Parity for the packets of a partially sent block (end of run), or None."""
+        if not self.packets:
+            return None
+        parity = pack_fec_parity(self.device_id, self.k, self.base, self.packets)
+        self.packets = {}
+        if len(parity) > MAX_BYTES:
+            return None
+        self.parity_total += 1
+        return parity
+
+    def reset(self):
+        """Forget the open block (the device re-INITs and restarts at seq 2)."""
+        self.base = None
+        self.packets = {}
+
+
+class _DeviceFec:
+    __slots__ = ("k", "ring", "highest_seq", "last_arrival", "interval")
+
+    def __init__(self):
+        self.k = None                # block size, learned from the device's parity packets
+        self.ring = OrderedDict()    # seq -> raw packet, most recent last
+        self.highest_seq = 0
+        self.last_arrival = None
+        self.interval = None         # smoothed seconds between consecutive seqs
+
+
+class FecReceiver:
+    """Server side: recent packets per device, block repair and the parity wait for NACKs."""
+
+    def __init__(self, ring_size=64, max_wait=1.0):
+        self.ring_size = ring_size
+        self.max_wait = max_wait
+        self.devices = {}
+        self.lock = threading.Lock()
+        self.parity_total = 0
+        self.repaired_total = 0
+        self.unrecoverable_total = 0
+
+    def _state(self, device_id):
+        state = self.devices.get(device_id)
+        if state is None:
+            state = self.devices[device_id] = _DeviceFec()
+        return state
+
+    def record(self, device_id, seq, packet, now):
+        """Keep a valid DATA packet and update the device's packet-interval estimate."""
+        with self.lock:
+            state = self._state(device_id)
+            state.ring[seq] = packet
+            state.ring.move_to_end(seq)
+            while len(state.ring) > self.ring_size:
+                state.ring.popitem(last=False)
+            if seq > state.highest_seq:
+                if state.last_arrival is not None and state.highest_seq:
+                    sample = (now - state.last_arrival) / (seq - state.highest_seq)
+                    state.interval = sample if state.interval is None else state.interval + (sample - state.interval) / 8
+                state.highest_seq = seq
+                state.last_arrival = now
+
+    def parity_wait(self, device_id, missing_seq):
+        """
+        Extra seconds to hold a NACK for `missing_seq` until its block's parity
+        is due; 0 if the device sends no parity or it is more than max_wait away.
+        """
+        with self.lock:
+            state = self.devices.get(device_id)
+            if state is None or state.k is None or state.interval is None:
+                return 0.0
+            block_end = block_base(missing_seq, state.k) + state.k - 1
+            wait = max(0, block_end - state.highest_seq) * state.interval
+            return wait if wait <= self.max_wait else 0.0
+
+    def repair(self, device_id, header, payload, wanted):
+        """
+        Handle a parity packet. Returns (seq, packet) for the one packet of the
+        block it rebuilt, or None if nothing (or more than one packet) was
+        missing or the server no longer wants it (`wanted(seq)` is false).
+        """
+        bitmap, length_xor, body = unpack_fec_parity(payload)
+        base = header['seq']
+        with self.lock:
+            self.parity_total += 1
+            state = self._state(device_id)
+            state.k = header['batch_count']
+            covered = [base + i for i in range(16) if bitmap >> i & 1]
+            missing = [seq for seq in covered if seq not in state.ring]
+            if len(missing) != 1:
+                if len(missing) > 1:
+                    self.unrecoverable_total += 1
+                return None
+            others = [state.ring[seq] for seq in covered if seq != missing[0]]
+        if not wanted(missing[0]):
+            return None
+        for packet in others:
+            length_xor ^= len(packet)
+        if not HEADER_SIZE <= length_xor <= len(body):
+            return None
+        self.repaired_total += 1
+        return missing[0], xor_packets([body, *others], len(body))[:length_xor]
+
+    def reset(self, device_id):
+        """Drop a device's packets (re-INIT: its seqs start over)."""
+        with self.lock:
+            state = self.devices.get(device_id)
+            if state is not None:
+                state.ring.clear()
+                state.highest_seq = 0
+                state.last_arrival = None
+
+    def forget(self, device_id):
+        with self.lock:
+            self.devices.pop(device_id, None)
@@ -0,0 +1,67 @@
+import threading
+
+# --- Device liveness tracking ---
+# A hashed timing wheel of expiry deadlines: touching a device is O(1) and
+# expiry only visits the slots whose tick has passed, so heartbeats from a
+# large fleet cost a dict update instead of a CSV row each.
+
+
+class LivenessWheel:
+    """Tracks when each device was last heard from and reports those that went silent."""
+
+    def __init__(self, timeout, tick=1.0, slots=64):
+        self.timeout = timeout
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.deadline = {}   # device_id -> expiry time (seconds)
+        self.last_tick = None
+        self.lock = threading.Lock()
+
+    def _slot(self, when):
+        return int(when // self.tick) % len(self.slots)
+
+    def touch(self, device_id, now):
+        deadline = now + self.timeout
+        with self.lock:
+            old = self.deadline.get(device_id)
+            if old is not None:
+                self.slots[self._slot(old)].discard(device_id)
+            self.deadline[device_id] = deadline
+            self.slots[self._slot(deadline)].add(device_id)
+            if self.last_tick is None:
+                self.last_tick = int(now // self.tick)
+
+    def forget(self, device_id):
+        with self.lock:
+            old = self.deadline.pop(device_id, None)
+            if old is not None:
+                self.slots[self._slot(old)].discard(device_id)
+
+    def expire(self, now):
+        """Remove and return the devices whose deadline has passed."""
+        expired = []
+        with self.lock:
+            if self.last_tick is None:
+                return expired
+            current = int(now // self.tick)
+            # A full revolution visits every slot once; no need to go further.
+            first = max(self.last_tick, current - len(self.slots) + 1)
+            for t in range(first, current + 1):
+                slot = self.slots[t % len(self.slots)]
+                for device_id in list(slot):
+                    if self.deadline[device_id] <= now:
+                        slot.discard(device_id)
+                        del self.deadline[device_id]
+                        expired.append(device_id)
+            self.last_tick = current
+        return expired
+
+    def is_alive(self, device_id):
+        return device_id in self.deadline
+
+    def alive(self):
+        with self.lock:
+            return list(self.deadline)
+
+    def __len__(self):
+        return len(self.deadline)
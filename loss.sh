@@ -2,6 +2,8 @@
 # run_loss.sh
 # Packet loss scenario: 5% loss, single device, PCAP capture, acceptance criteria
 # Count packets and detect sequence gaps/duplicates from client log instead of CSV
+# Loss is applied by netem_proxy.py (no root needed); run i uses seed NETEM_SEED+i,
+# so every run drops the same packets on any host.
 
 set -euo pipefail
 
@@ -12,25 +14,21 @@ cleanup() {
     # Kill background jobs
     jobs -p | xargs -r kill 2>/dev/null || true
     
-    # Reset network
-    sudo tc qdisc del dev lo root 2>/dev/null || true
-    
     # Kill any stray udpsrv.py processes
     # We use || true because pkill might return 1 (no process) or 127 (not found)
     pkill -f udpsrv.py 2>/dev/null || true
+    pkill -f netem_proxy.py 2>/dev/null || true
 }
 trap cleanup EXIT
 
 # Kill any existing server instances before starting
 echo "Killing stale server instances..."
 pkill -f udpsrv.py 2>/dev/null || true
+pkill -f netem_proxy.py 2>/dev/null || true
 
 
 mkdir -p logs
 
-# Reset network
-# sudo tc qdisc del dev lo root 2>/dev/null || true
-
 # Detect Python
 PYTHON=""
 for cmd in python3 python py; do
@@ -62,12 +60,24 @@ echo "Running loss test for devices: ${DEVICE_IDS[*]}"
 echo "Duration=${DURATION}s, Intervals=${INTERVALS}"
 
 
-# Apply 5% packet loss
+# 5% packet loss in both directions, applied by the impairment proxy
 LOSS_PERCENT=5
-sudo tc qdisc add dev lo root netem loss ${LOSS_PERCENT}%
-echo "Applied network conditions:"
+NETEM_SPEC="loss=${LOSS_PERCENT}"
+NETEM_SEED=${NETEM_SEED:-0}
+PROXY_PORT=12003
+echo "Network conditions (netem_proxy.py on port ${PROXY_PORT}):"
 echo " Loss Percent: ${LOSS_PERCENT}%"
 
+# PCAP capture needs tcpdump and root; runs without it still produce CSVs and logs
+CAPTURE=0
+SUDO=""
+[ "$(id -u)" -eq 0 ] || SUDO="sudo"
+if command -v tcpdump >/dev/null 2>&1 && { [ -z "$SUDO" ] || sudo -n true 2>/dev/null; }; then
+    CAPTURE=1
+else
+    echo "tcpdump/sudo unavailable: skipping PCAP capture"
+fi
+
 
 
 for i in {1..5}; do
@@ -84,10 +94,13 @@ for i in {1..5}; do
 
     rm -f logs/iot_device_data.csv logs/loss_run${i}_reordered.csv
 
-    # Start PCAP capture
+    # Start PCAP capture (proxy -> server leg, i.e. after impairment)
     PCAP_FILE="$RUN_DIR/loss_run${i}.pcap"
-    sudo tcpdump -i lo udp port 12001 -w "$PCAP_FILE" &>/dev/null &
-    PCAP_PID=$!
+    PCAP_PID=""
+    if [ "$CAPTURE" -eq 1 ]; then
+        $SUDO tcpdump -i lo udp port 12001 -w "$PCAP_FILE" &>/dev/null &
+        PCAP_PID=$!
+    fi
 
     # Remove previous server CSV to start fresh
     # SERVER_CSV=logs/iot_device_data.csv
@@ -95,8 +108,16 @@ for i in {1..5}; do
 
     # Start server
     SERVER_LOG="$RUN_DIR/server.log"
-    $PYTHON udpsrv.py > "$SERVER_LOG" 2>&1 &
+    # Each run is an independent experiment: do not resume sessions from the previous run
+    ECHOP_CHECKPOINT=0 $PYTHON udpsrv.py > "$SERVER_LOG" 2>&1 &
     SERVER_PID=$!
+
+    # Start impairment proxy between clients and server
+    SEED=$((NETEM_SEED + i))
+    PROXY_LOG="$RUN_DIR/proxy.log"
+    $PYTHON netem_proxy.py --listen "0.0.0.0:${PROXY_PORT}" --server localhost:12001 \
+        --both "$NETEM_SPEC" --seed "$SEED" > "$PROXY_LOG" 2>&1 &
+    PROXY_PID=$!
     sleep 1
 
     # Run client
@@ -107,7 +128,7 @@ for i in {1..5}; do
     for DEVICE_ID in "${DEVICE_IDS[@]}"; do
         CLIENT_LOG="$RUN_DIR/client_device${DEVICE_ID}.log"
         echo "  Starting client for Device $DEVICE_ID..."
-        $PYTHON udpclnt.py "$DEVICE_ID" "$DURATION" "$INTERVALS" > "$CLIENT_LOG" 2>&1 &
+        ECHOP_SERVER="localhost:${PROXY_PORT}" $PYTHON udpclnt.py "$DEVICE_ID" "$DURATION" "$INTERVALS" > "$CLIENT_LOG" 2>&1 &
         CLIENT_PIDS+=($!)
         CLIENT_LOGS+=("$CLIENT_LOG")
     done
@@ -127,15 +148,19 @@ for i in {1..5}; do
         wait "$SERVER_PID" 2>/dev/null || true
     fi
 
+    # Stop impairment proxy (prints its drop counters to the proxy log)
+    if kill -0 "$PROXY_PID" 2>/dev/null; then
+        kill "$PROXY_PID" 2>/dev/null || true
+        wait "$PROXY_PID" 2>/dev/null || true
+    fi
+
     # Stop PCAP capture
-    if kill -0 "$PCAP_PID" 2>/dev/null; then
-        sudo kill "$PCAP_PID" 2>/dev/null || true
+    if [ -n "$PCAP_PID" ] && kill -0 "$PCAP_PID" 2>/dev/null; then
+        $SUDO kill "$PCAP_PID" 2>/dev/null || true
         wait "$PCAP_PID" 2>/dev/null || true
+        echo "PCAP saved: $PCAP_FILE"
     fi
 
-
-echo "PCAP saved: $PCAP_FILE"
-
     # -------------------------
     # Move CSV files to run directory
     # -------------------------
@@ -168,67 +193,20 @@ echo "PCAP saved: $PCAP_FILE"
     # -------------------------
     NETEM_LOG="$RUN_DIR/netem_config.txt"
     {
-        echo "Network configuration for delay test run ${i}:"
-        echo "  sudo tc qdisc add dev lo root netem loss ${LOSS_PERCENT}%"
+        echo "Network configuration for loss test run ${i}:"
+        echo "  netem_proxy.py --both ${NETEM_SPEC} --seed ${SEED}"
         echo "  Loss Percent: ${LOSS_PERCENT}%"
         echo ""
+        tail -n 2 "$PROXY_LOG"
     } > "$NETEM_LOG"
 
-    # ---- Packets per interval and sequence gaps/duplicates from client log ----
-    echo " Device $DEVICE_ID: Packets and sequence info for run $i"
-    awk -v duration="$DURATION" -v intervals="$INTERVALS" '
-    BEGIN {
-        split(intervals, intv_arr, ",")
-        current_interval = -1
-    }
-
-    /Running [0-9]+s interval/ {
-        match($0, /Running ([0-9]+)s interval/, m)
-        current_interval = m[1]
-    }
-
-    /Sent DATA/ && current_interval != -1 {
-        match($0, /seq=([0-9]+)/, s)
-        seq_num = s[1] + 0
-
-        count[current_interval]++
-        seq[current_interval, seq_num]++
-
-        if (last_seq[current_interval] != "" && seq_num != last_seq[current_interval] + 1)
-            gaps[current_interval]++
-
-        last_seq[current_interval] = seq_num
-    }
-
-    END {
-        for (i in intv_arr) {
-            interval = intv_arr[i]
-            expected = int(duration / interval)
-            received = count[interval] + 0
-            perc = (received / expected) * 100
-            status = (perc >= 99 ? "sufficient packets" : "insufficient packets")
-
-            dup_count = 0
-            for (k in seq) {
-                split(k, a, SUBSEP)
-                if (a[1] == interval && seq[k] > 1)
-                    dup_count += seq[k] - 1
-            }
-
-            dup_rate = (dup_count / (received > 0 ? received : 1)) * 100
-            dup_status = (dup_rate <= 1 ? "duplicates ≤ 1%" : "duplicates > 1%")
-            gap_status = (gaps[interval] > 0 ? "sequence gaps detected" : "no sequence gaps")
-
-            printf "Interval %ds: %d/%d packets sent (%.2f%%) %s, %s, %s (dup rate %.2f%%)\n",
-                interval, received, expected, perc, status, gap_status, dup_status, dup_rate
-        }
-    }
-    ' "$CLIENT_LOG"
+    # ---- Packets per interval, sequence gaps and duplicates (see analyze.py) ----
+    $PYTHON analyze.py "$RUN_DIR" --details --report "$RUN_DIR/analysis_loss_run${i}.csv"
 done
 
-# Reset network
-sudo tc qdisc del dev lo root 2>/dev/null || true
 echo ""
+# Consolidated report across all loss runs
+$PYTHON analyze.py logs/loss_run* --report logs/analysis_loss.csv
 echo "========================================"
 echo "Loss test complete!"
 echo "Summary:"
@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Live metrics endpoint for the collector ---
+# A background HTTP server answers /metrics (Prometheus text format) and
+# /metrics.json from an in-memory snapshot callback, so monitoring never
+# touches the files written by the receive loop.
+
+RATE_WINDOW_SECONDS = 10
+
+
+class _RateSampler:
+    """
+    Samples monotonically increasing counters once a second to derive per-second
+    rates. Each counter is read through its own getter, so sampling stays cheap
+    no matter how large the full snapshot grows.
+    """
+
+    def __init__(self, counters, window=RATE_WINDOW_SECONDS):
+        self.names = list(counters)
+        self.getters = [counters[n] for n in self.names]
+        self.samples = deque(maxlen=window + 1)
+        self.lock = threading.Lock()
+
+    def run(self):
+        while True:
+            try:
+                values = [get() for get in self.getters]
+                with self.lock:
+                    self.samples.append((time.monotonic(), values))
+            except Exception as e:
+                print(f"[metrics] sampler error: {e}")
+            time.sleep(1.0)
+
+    def rates(self):
+        with self.lock:
+            if len(self.samples) < 2:
+                return {n: 0.0 for n in self.names}
+            (t0, first), (t1, last) = self.samples[0], self.samples[-1]
+        span = t1 - t0
+        return {n: ((b - a) / span if span > 0 else 0.0) for n, a, b in zip(self.names, first, last)}
+
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+def render_prometheus(snap, prefix="echop"):
+    """Format a snapshot dict in the Prometheus text exposition format."""
+    lines = []
+    for name, value in snap["counters"].items():
+        lines.append(f"# TYPE {prefix}_{name} counter")
+        lines.append(f"{prefix}_{name} {value}")
+    for name, value in snap["gauges"].items():
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        lines.append(f"{prefix}_{name} {value}")
+
+    if snap.get("devices"):
+        fields = sorted({k for d in snap["devices"].values() for k in d})
+        for field in fields:
+            lines.append(f"# TYPE {prefix}_device_{field} gauge")
+            for device_id, info in sorted(snap["devices"].items()):
+                if field in info:
+                    lines.append(f"{prefix}_device_{field}{_label_str({'device': device_id})} {info[field]}")
+
+    if snap.get("stages"):
+        lines.append(f"# TYPE {prefix}_stage_latency_us summary")
+        for stage, st in snap["stages"].items():
+            for q, key in (("0.5", "p50_us"), ("0.9", "p90_us"), ("0.99", "p99_us")):
+                lines.append(f"{prefix}_stage_latency_us{_label_str({'stage': stage, 'quantile': q})} {st[key]}")
+            lines.append(f"{prefix}_stage_latency_us_count{_label_str({'stage': stage})} {st['count']}")
+            lines.append(f"{prefix}_stage_latency_us_sum{_label_str({'stage': stage})} {st['sum_us']}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """
+    Serves live metrics from `snapshot_fn`, which must return a dict with
+    "counters", "gauges" and optionally "devices" / "stages" sections.
+    `rate_counters` maps counter names to getters of their current value; each
+    additionally gets a <name>_per_sec gauge (a trailing "_total" is dropped
+    from the gauge name).
+    """
+
+    def __init__(self, snapshot_fn, host="127.0.0.1", port=9101, rate_counters=None):
+        self.snapshot_fn = snapshot_fn
+        self.host = host
+        self.port = port
+        self.sampler = _RateSampler(rate_counters or {})
+        self.httpd = None
+
+    def snapshot(self):
+        snap = self.snapshot_fn()
+        for name, rate in self.sampler.rates().items():
+            base = name[:-len("_total")] if name.endswith("_total") else name
+            snap["gauges"][f"{base}_per_sec"] = round(rate, 3)
+        return snap
+
+    def _handler(self):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path == "/metrics":
+                    body = render_prometheus(exporter.snapshot()).encode("utf-8")
+                    ctype = "text/plain; version=0.0.4"
+                elif path in ("/metrics.json", "/json"):
+                    body = json.dumps(exporter.snapshot(), sort_keys=True).encode("utf-8")
+                    ctype = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # keep the server console for packet logs
+
+        return Handler
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        threading.Thread(target=self.sampler.run, daemon=True).start()
+        print(f"Metrics endpoint: http://{self.host}:{self.port}/metrics (JSON: /metrics.json)")
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
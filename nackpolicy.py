@@ -0,0 +1,176 @@
+import threading
+
+# --- Adaptive NACK timing ---
+# The hold-off between spotting a gap and NACKing it is derived per device,
+# TCP-RTO style: a smoothed mean/deviation of the one-way delay the server
+# already measures, plus how late reordered packets have turned up. Clean
+# links NACK within tens of milliseconds; jittery links wait long enough
+# for reordered packets to arrive on their own. Token buckets (per device and
+# global) pace the NACKs that are sent; a NACK over budget is deferred, never
+# dropped.
+
+ALPHA = 1 / 8          # srtt gain (RFC 6298)
+BETA = 1 / 4           # rttvar gain
+K = 4                  # deviation multiplier
+REORDER_FACTOR = 1.5   # margin over the latest-observed reordered arrival
+REORDER_DECAY = 1 / 16 # the reorder estimate shrinks this much per clean sample
+MAX_PENDING_GAPS = 1024
+
+
+def _cap(pending):
+    """Drop the oldest entries of an insertion-ordered dict beyond MAX_PENDING_GAPS."""
+    while len(pending) > MAX_PENDING_GAPS:
+        del pending[next(iter(pending))]
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.stamp = None
+
+    def _refill(self, now):
+        if self.stamp is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def available(self, now):
+        self._refill(now)
+        return self.tokens >= 1.0
+
+    def take(self):
+        self.tokens -= 1.0
+
+    def wait_time(self, now):
+        """Seconds until one token is available."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1.0 else (1.0 - self.tokens) / self.rate
+
+
+class DeviceNackState:
+    __slots__ = ("srtt", "rttvar", "reorder", "gap_seen", "nacked", "deferred", "bucket")
+
+    def __init__(self, bucket):
+        self.srtt = None
+        self.rttvar = 0.0
+        self.reorder = 0.0     # seconds a missing packet has been seen to arrive late
+        self.gap_seen = {}     # missing seq -> time the gap was detected
+        self.nacked = {}       # missing seqs a NACK has been sent for (oldest first)
+        self.deferred = {}     # missing seqs whose NACK is waiting for a token (oldest first)
+        self.bucket = bucket
+
+
+class NackPolicy:
+    def __init__(self, initial_holdoff=1.0, min_holdoff=0.05, max_holdoff=2.0,
+                 device_rate=20.0, device_burst=40, global_rate=500.0, global_burst=1000):
+        self.initial_holdoff = initial_holdoff
+        self.min_holdoff = min_holdoff
+        self.max_holdoff = max_holdoff
+        self.device_rate = device_rate
+        self.device_burst = device_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.devices = {}
+        self.lock = threading.Lock()
+        self.sent_total = 0
+        self.deferred_total = 0  # NACKs deferred at least once (each counted once)
+        self.reordered_total = 0
+
+    def _state(self, device_id):
+        state = self.devices.get(device_id)
+        if state is None:
+            state = DeviceNackState(TokenBucket(self.device_rate, self.device_burst))
+            self.devices[device_id] = state
+        return state
+
+    # --- estimators ---
+    def on_delay(self, device_id, delay):
+        """Feed the one-way delay of an in-order DATA packet."""
+        with self.lock:
+            state = self._state(device_id)
+            if state.srtt is None:
+                state.srtt = delay
+                state.rttvar = abs(delay) / 2
+            else:
+                state.rttvar += BETA * (abs(state.srtt - delay) - state.rttvar)
+                state.srtt += ALPHA * (delay - state.srtt)
+            state.reorder -= REORDER_DECAY * state.reorder
+
+    def on_gap(self, device_id, seqs, now):
+        with self.lock:
+            gap_seen = self._state(device_id).gap_seen
+            for seq in seqs:
+                gap_seen.setdefault(seq, now)
+            _cap(gap_seen)
+
+    def on_recovered(self, device_id, seq, now):
+        """A missing packet arrived; if it was never NACKed it was reordered, not lost."""
+        with self.lock:
+            state = self._state(device_id)
+            seen = state.gap_seen.pop(seq, None)
+            state.deferred.pop(seq, None)
+            if seq in state.nacked:
+                del state.nacked[seq]
+            elif seen is not None:
+                self.reordered_total += 1
+                state.reorder = max(state.reorder, now - seen)
+
+    def on_repaired(self, device_id, seq):
+        """A missing packet was rebuilt from FEC parity: neither a NACK nor a reorder sample."""
+        with self.lock:
+            state = self._state(device_id)
+            state.gap_seen.pop(seq, None)
+            state.nacked.pop(seq, None)
+            state.deferred.pop(seq, None)
+
+    def holdoff(self, device_id):
+        """Seconds to wait before NACKing a gap on this device."""
+        with self.lock:
+            state = self.devices.get(device_id)
+            if state is None or state.srtt is None:
+                return self.initial_holdoff
+            wait = max(K * state.rttvar, REORDER_FACTOR * state.reorder)
+            return min(self.max_holdoff, max(self.min_holdoff, wait))
+
+    # --- pacing ---
+    def admit(self, device_id, seq, now):
+        """Consume a token for the NACK of `seq`; returns 0 if it may go now, else seconds to defer it."""
+        with self.lock:
+            state = self._state(device_id)
+            device_ok = state.bucket.available(now)
+            global_ok = self.global_bucket.available(now)
+            if device_ok and global_ok:
+                state.bucket.take()
+                self.global_bucket.take()
+                self.sent_total += 1
+                state.deferred.pop(seq, None)
+                return 0.0
+            if seq not in state.deferred:
+                # Re-checks of an already deferred NACK are not new deferrals
+                state.deferred[seq] = None
+                self.deferred_total += 1
+                _cap(state.deferred)
+            return max(state.bucket.wait_time(now), self.global_bucket.wait_time(now))
+
+    def on_sent(self, device_id, seq):
+        with self.lock:
+            nacked = self._state(device_id).nacked
+            nacked.pop(seq, None)
+            nacked[seq] = None
+            # Seqs the tracker gave up on are never recovered: keep only the newest
+            _cap(nacked)
+
+    def forget(self, device_id):
+        with self.lock:
+            self.devices.pop(device_id, None)
+
+    def snapshot(self, device_id):
+        with self.lock:
+            state = self.devices.get(device_id)
+            if state is None:
+                return {}
+            return {
+                "delay_srtt_ms": round((state.srtt or 0.0) * 1000, 1),
+                "delay_rttvar_ms": round(state.rttvar * 1000, 1),
+                "reorder_ms": round(state.reorder * 1000, 1),
+            }
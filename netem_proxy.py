@@ -0,0 +1,299 @@
+import argparse
+import heapq
+import itertools
+import random
+import select
+import signal
+import socket
+import sys
+import time
+from collections import deque
+
+from protocol import HEADER_SIZE, NACK_MSG
+
+# --- UDP impairment proxy ---
+# A user-space stand-in for `tc qdisc ... netem` on loopback: clients send to
+# the proxy (ECHOP_SERVER=localhost:12003), each client gets its own upstream
+# socket toward the server, and server replies (NACKs) travel back the same
+# way. Both directions are impaired independently from a key=value spec:
+#
+#   loss=5                      Bernoulli loss (%)
+#   ge_p=1,ge_r=25              Gilbert-Elliott: good->bad / bad->good transition (%)
+#   ge_bad=100,ge_good=0        loss (%) while in the bad / good state
+#   delay=100,jitter=10         one-way delay and jitter (ms)
+#   dist=uniform                jitter distribution: uniform, normal or pareto
+#   duplicate=1                 duplication (%)
+#   reorder=25                  packets sent without the delay, overtaking others (%)
+#   rate=512,limit=1000         link rate (kbit/s) and queue limit (packets)
+#
+#   python3 netem_proxy.py --both loss=5 --seed 1
+#   python3 netem_proxy.py --up delay=100,jitter=10 --down delay=100,jitter=10
+#
+# Every random decision is drawn from a generator seeded with (seed, direction,
+# device, message type, packet seq, attempt), so a given transmission of a
+# given packet meets the same fate on every run, however the traffic of other
+# devices, heartbeats and retransmissions interleave with it.
+
+sys.stdout.reconfigure(line_buffering=True)
+
+MAX_DATAGRAM = 65535
+SESSION_IDLE_SECONDS = 300
+STATS_SECONDS = 10
+
+SPEC_DEFAULTS = {
+    "loss": 0.0, "ge_p": 0.0, "ge_r": 100.0, "ge_bad": 100.0, "ge_good": 0.0,
+    "delay": 0.0, "jitter": 0.0, "dist": "uniform", "duplicate": 0.0,
+    "reorder": 0.0, "rate": 0.0, "limit": 1000,
+}
+DISTRIBUTIONS = ("uniform", "normal", "pareto")
+
+
+def parse_addr(text, default_host="0.0.0.0"):
+    host, _, port = text.rpartition(":")
+    return (host or default_host, int(port))
+
+
+def parse_spec(text, base=None):
+    """'loss=5,delay=100' -> settings dict, layered over `base` (or the defaults)."""
+    spec = dict(base or SPEC_DEFAULTS)
+    for part in (p.strip() for p in (text or "").split(",")):
+        if not part:
+            continue
+        key, sep, value = part.partition("=")
+        if not sep or key not in SPEC_DEFAULTS:
+            raise ValueError(f"bad impairment setting {part!r} (keys: {', '.join(SPEC_DEFAULTS)})")
+        spec[key] = value if key == "dist" else type(SPEC_DEFAULTS[key])(value)
+    if spec["dist"] not in DISTRIBUTIONS:
+        raise ValueError(f"unknown jitter distribution {spec['dist']!r} (expected one of {', '.join(DISTRIBUTIONS)})")
+    return spec
+
+
+def describe(spec):
+    changed = [f"{k}={v}" for k, v in spec.items() if v != SPEC_DEFAULTS[k]]
+    return ",".join(changed) or "none"
+
+
+class _Flow:
+    __slots__ = ("chain", "bad", "attempts")
+
+    def __init__(self, seed):
+        self.chain = random.Random(seed)   # drives the Gilbert-Elliott state only
+        self.bad = False
+        self.attempts = {}                 # packet identity -> times seen
+
+
+class Impairment:
+    """One direction of the link: per-packet loss/delay decisions plus a shared rate-limited queue."""
+
+    def __init__(self, name, spec, seed):
+        self.name = name
+        self.spec = spec
+        self.seed = seed
+        self.flows = {}
+        self.queue = deque()   # serialization end times of packets still on the link
+        self.link_free_at = 0.0
+        self.stats = {"in": 0, "lost": 0, "queue_drops": 0, "duplicated": 0, "reordered": 0, "out": 0}
+
+    def _flow(self, key):
+        flow = self.flows.get(key)
+        if flow is None:
+            flow = self.flows[key] = _Flow(f"{self.seed}:{self.name}:{key}")
+        return flow
+
+    def _lost(self, flow, rng, first_attempt):
+        s = self.spec
+        if s["ge_p"] > 0:
+            # The channel moves once per new packet; retransmissions see its current state.
+            if first_attempt:
+                if flow.bad:
+                    flow.bad = flow.chain.random() * 100 >= s["ge_r"]
+                else:
+                    flow.bad = flow.chain.random() * 100 < s["ge_p"]
+            if rng.random() * 100 < (s["ge_bad"] if flow.bad else s["ge_good"]):
+                return True
+        return s["loss"] > 0 and rng.random() * 100 < s["loss"]
+
+    def _delay(self, rng):
+        s = self.spec
+        if s["reorder"] > 0 and rng.random() * 100 < s["reorder"]:
+            self.stats["reordered"] += 1
+            return 0.0
+        delay, jitter = s["delay"], s["jitter"]
+        if jitter > 0:
+            if s["dist"] == "normal":
+                delay = rng.gauss(delay, jitter)
+            elif s["dist"] == "pareto":
+                # Pareto(3) has mean 1.5: centred on `delay`, with a long tail of late packets.
+                delay += jitter * (rng.paretovariate(3.0) - 1.5)
+            else:
+                delay = rng.uniform(delay - jitter, delay + jitter)
+        return max(0.0, delay) / 1000.0
+
+    def schedule(self, key, identity, size, now):
+        """
+        Return the send times (empty if dropped) for a datagram of `size` bytes.
+        `key` names its flow and `identity` the packet within it; the n-th copy
+        of the same packet always gets the same fate.
+        """
+        self.stats["in"] += 1
+        flow = self._flow(key)
+        attempt = flow.attempts.get(identity, 0)
+        flow.attempts[identity] = attempt + 1
+        rng = random.Random(f"{self.seed}:{self.name}:{key}:{identity}:{attempt}")
+        if self._lost(flow, rng, attempt == 0):
+            self.stats["lost"] += 1
+            return []
+        copies = 1
+        if self.spec["duplicate"] > 0 and rng.random() * 100 < self.spec["duplicate"]:
+            self.stats["duplicated"] += 1
+            copies = 2
+        times = []
+        for _ in range(copies):
+            depart = now
+            rate = self.spec["rate"]
+            if rate > 0:
+                while self.queue and self.queue[0] <= now:
+                    self.queue.popleft()
+                if len(self.queue) >= self.spec["limit"]:
+                    self.stats["queue_drops"] += 1
+                    continue
+                self.link_free_at = max(now, self.link_free_at) + size * 8 / (rate * 1000.0)
+                self.queue.append(self.link_free_at)
+                depart = self.link_free_at
+            times.append(depart + self._delay(rng))
+        return times
+
+
+class _Session:
+    __slots__ = ("client", "sock", "key", "last_active")
+
+    def __init__(self, client, sock, key, now):
+        self.client = client
+        self.sock = sock
+        self.key = key
+        self.last_active = now
+
+
+class ImpairmentProxy:
+    def __init__(self, listen, server, up, down):
+        self.server = server
+        self.up = up
+        self.down = down
+        self.sessions = {}    # client addr -> _Session
+        self.by_sock = {}     # upstream socket -> _Session
+        self.pending = []     # heap of (send time, tiebreak, socket, data, dest)
+        self._tiebreak = itertools.count()
+        self.listen_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.listen_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listen_sock.bind(listen)
+        print(f"Impairment proxy on {listen[0]}:{listen[1]} -> {server[0]}:{server[1]}")
+        print(f"  up (client->server):   {describe(up.spec)}")
+        print(f"  down (server->client): {describe(down.spec)}")
+
+    def _session(self, client, data, now):
+        session = self.sessions.get(client)
+        if session is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.connect(self.server)
+            # ECHOP packets carry the device id in the high nibble of byte 0.
+            key = (data[0] >> 4) & 0x0F if data else client
+            session = self.sessions[client] = _Session(client, sock, key, now)
+            self.by_sock[sock] = session
+        session.last_active = now
+        return session
+
+    def _queue(self, direction, session, sock, data, dest, now):
+        if len(data) >= HEADER_SIZE:
+            # One flow per device and version/message type (high nibble of header byte 7).
+            # A packet is identified by its seq, or by its "device:seq" payload for NACKs,
+            # whose own seq is a server-wide counter.
+            kind = data[7] >> 4
+            key = (session.key, kind)
+            identity = data[HEADER_SIZE:] if kind & 0x03 == NACK_MSG else int.from_bytes(data[1:3], "big")
+        else:
+            key, identity = (session.key, None), data
+        for when in direction.schedule(key, identity, len(data), now):
+            heapq.heappush(self.pending, (when, next(self._tiebreak), sock, data, dest))
+
+    def _send_due(self, now):
+        while self.pending and self.pending[0][0] <= now:
+            _, _, sock, data, dest = heapq.heappop(self.pending)
+            try:
+                if dest is None:
+                    sock.send(data)
+                    self.up.stats["out"] += 1
+                else:
+                    sock.sendto(data, dest)
+                    self.down.stats["out"] += 1
+            except OSError:
+                pass   # server not up yet / client gone: the datagram is lost like on a real link
+
+    def _expire_sessions(self, now):
+        for client, session in list(self.sessions.items()):
+            if now - session.last_active > SESSION_IDLE_SECONDS:
+                del self.sessions[client]
+                del self.by_sock[session.sock]
+                session.sock.close()
+
+    def print_stats(self):
+        for direction in (self.up, self.down):
+            print(f"[Proxy] {direction.name}: {direction.stats}")
+
+    def run(self):
+        next_stats = time.monotonic() + STATS_SECONDS
+        while True:
+            now = time.monotonic()
+            timeout = min(max(0.0, self.pending[0][0] - now), 0.5) if self.pending else 0.5
+            readable, _, _ = select.select([self.listen_sock, *self.by_sock], [], [], timeout)
+            now = time.monotonic()
+            for sock in readable:
+                try:
+                    data, addr = sock.recvfrom(MAX_DATAGRAM)
+                except ConnectionRefusedError:
+                    continue
+                if sock is self.listen_sock:
+                    session = self._session(addr, data, now)
+                    self._queue(self.up, session, session.sock, data, None, now)
+                else:
+                    session = self.by_sock[sock]
+                    session.last_active = now
+                    self._queue(self.down, session, self.listen_sock, data, session.client, now)
+            self._send_due(time.monotonic())
+            if now >= next_stats:
+                self.print_stats()
+                self._expire_sessions(now)
+                next_stats = now + STATS_SECONDS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UDP impairment proxy: seeded netem-style loss, delay, "
+                                                 "duplication, reordering and rate limits without root.")
+    parser.add_argument("--listen", default="0.0.0.0:12003", help="address clients send to (host:port)")
+    parser.add_argument("--server", default="localhost:12001", help="server address (host:port)")
+    parser.add_argument("--both", default="", help="impairments for both directions, e.g. loss=5,delay=50")
+    parser.add_argument("--up", default="", help="client->server impairments (override --both)")
+    parser.add_argument("--down", default="", help="server->client impairments (override --both)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed (default 1)")
+    args = parser.parse_args()
+
+    try:
+        both = parse_spec(args.both)
+        up = Impairment("up", parse_spec(args.up, both), args.seed)
+        down = Impairment("down", parse_spec(args.down, both), args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+
+    proxy = ImpairmentProxy(parse_addr(args.listen), parse_addr(args.server, "localhost"), up, down)
+
+    def shutdown(signum, frame):
+        print(f"\n[Proxy] Signal {signum} received, stopped.")
+        proxy.print_stats()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    proxy.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import struct
+
+# --- Minimal pure-Python pcap reader ---
+# Enough of libpcap's classic file format to pull UDP payloads out of the
+# captures that baseline.sh / loss.sh / delay.sh record with tcpdump.
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+_MAGICS = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+ETH_P_8021Q = 0x8100
+IPPROTO_UDP = 17
+
+
+def iter_records(path):
+    """Yield (timestamp_seconds, linktype, frame_bytes) for every record in a pcap file."""
+    with open(path, "rb") as f:
+        magic = f.read(4)
+        if magic not in _MAGICS:
+            if magic == b"\x0a\x0d\x0d\x0a":
+                raise ValueError(f"{path}: pcapng is not supported, convert with `editcap -F pcap`")
+            raise ValueError(f"{path}: not a pcap file")
+        endian, ts_scale = _MAGICS[magic]
+        rest = f.read(20)
+        if len(rest) < 20:
+            return
+        _vmaj, _vmin, _zone, _sigfigs, _snaplen, linktype = struct.unpack(endian + "HHiIII", rest)
+        rec_hdr = struct.Struct(endian + "IIII")
+        while True:
+            hdr = f.read(rec_hdr.size)
+            if len(hdr) < rec_hdr.size:
+                return
+            ts_sec, ts_frac, incl_len, _orig_len = rec_hdr.unpack(hdr)
+            frame = f.read(incl_len)
+            if len(frame) < incl_len:
+                return  # truncated capture (tcpdump killed mid-write)
+            yield ts_sec + ts_frac * ts_scale, linktype & 0x0FFFFFFF, frame
+
+
+def _network_layer(linktype, frame):
+    """Return (ethertype, offset of the IP header) or None for unsupported frames."""
+    if linktype == LINKTYPE_ETHERNET:
+        if len(frame) < 14:
+            return None
+        ethertype = struct.unpack_from("!H", frame, 12)[0]
+        offset = 14
+        while ethertype == ETH_P_8021Q and len(frame) >= offset + 4:
+            ethertype = struct.unpack_from("!H", frame, offset + 2)[0]
+            offset += 4
+        return ethertype, offset
+    if linktype == LINKTYPE_LINUX_SLL:
+        if len(frame) < 16:
+            return None
+        return struct.unpack_from("!H", frame, 14)[0], 16
+    if linktype == LINKTYPE_LINUX_SLL2:
+        if len(frame) < 20:
+            return None
+        return struct.unpack_from("!H", frame, 0)[0], 20
+    if linktype == LINKTYPE_NULL:
+        if len(frame) < 4:
+            return None
+        family = struct.unpack_from("=I", frame, 0)[0]
+        return (ETH_P_IPV6 if family in (10, 24, 28, 30) else ETH_P_IP), 4
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        if not frame:
+            return None
+        return (ETH_P_IPV6 if frame[0] >> 4 == 6 else ETH_P_IP), 0
+    return None
+
+
+def _udp_from_ip(ethertype, frame, offset):
+    """Return (src_ip, dst_ip, udp_offset) for a UDP datagram, else None."""
+    if ethertype == ETH_P_IP:
+        if len(frame) < offset + 20:
+            return None
+        ihl = (frame[offset] & 0x0F) * 4
+        proto = frame[offset + 9]
+        frag = struct.unpack_from("!H", frame, offset + 6)[0]
+        if proto != IPPROTO_UDP or (frag & 0x1FFF):
+            return None
+        src = ".".join(str(b) for b in frame[offset + 12:offset + 16])
+        dst = ".".join(str(b) for b in frame[offset + 16:offset + 20])
+        return src, dst, offset + ihl
+    if ethertype == ETH_P_IPV6:
+        if len(frame) < offset + 40 or frame[offset + 6] != IPPROTO_UDP:
+            return None
+        src = frame[offset + 8:offset + 24].hex()
+        dst = frame[offset + 24:offset + 40].hex()
+        return src, dst, offset + 40
+    return None
+
+
+def iter_udp(path, dst_port=None, src_port=None):
+    """
+    Yield (timestamp, (src_ip, src_port), (dst_ip, dst_port), payload) for UDP
+    datagrams in `path`, optionally filtered on destination/source port.
+    """
+    for ts, linktype, frame in iter_records(path):
+        net = _network_layer(linktype, frame)
+        if net is None:
+            continue
+        udp = _udp_from_ip(net[0], frame, net[1])
+        if udp is None:
+            continue
+        src_ip, dst_ip, off = udp
+        if len(frame) < off + 8:
+            continue
+        sport, dport, length = struct.unpack_from("!HHH", frame, off)
+        if dst_port is not None and dport != dst_port:
+            continue
+        if src_port is not None and sport != src_port:
+            continue
+        payload = frame[off + 8:off + max(length, 8)]
+        yield ts, (src_ip, sport), (dst_ip, dport), payload
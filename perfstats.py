@@ -0,0 +1,178 @@
+import csv
+import os
+import time
+
+# --- Per-stage timing for the server hot path ---
+# Each stage feeds a small HDR-style (log-linear) histogram of nanosecond
+# samples: 16 linear sub-buckets per power of two keeps ~6% precision over
+# the whole range while recording stays a couple of integer operations.
+
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_VALUE_BITS = 40  # ~18 minutes in ns, anything longer lands in the last bucket
+
+
+class Histogram:
+    """Log-linear histogram of non-negative integer samples (ns)."""
+    __slots__ = ("counts", "total", "sum", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * ((MAX_VALUE_BITS - SUB_BUCKET_BITS + 2) * SUB_BUCKETS)
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value):
+        if value < 0:
+            value = 0
+        if value < SUB_BUCKETS:
+            idx = value
+        else:
+            shift = value.bit_length() - SUB_BUCKET_BITS - 1
+            idx = (shift + 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+            if idx >= len(self.counts):
+                idx = len(self.counts) - 1
+        self.counts[idx] += 1
+        self.total += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    @staticmethod
+    def bucket_value(idx):
+        """Lowest value that maps to bucket `idx`."""
+        group, sub = divmod(idx, SUB_BUCKETS)
+        if group == 0:
+            return sub
+        return (sub + SUB_BUCKETS) << (group - 1)
+
+    def percentile(self, pct):
+        if self.total == 0:
+            return 0
+        target = max(1, int(round(self.total * pct / 100.0)))
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.bucket_value(idx), self.max)
+        return self.max
+
+    def mean(self):
+        return self.sum / self.total if self.total else 0.0
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+
+
+STAGE_TIMING_HEADERS = [
+    "stage", "count", "min_us", "p50_us", "p90_us", "p99_us", "p999_us",
+    "max_us", "mean_us", "total_ms", "dumped_at"
+]
+
+
+class StageTimer:
+    """
+    Attributes elapsed time between consecutive `mark()` calls to named stages.
+    Call `start()` at the top of the loop, then `mark(stage)` after each stage.
+    """
+
+    def __init__(self, stages, csv_path, dump_seconds=10):
+        self.stages = list(stages)
+        self.histograms = {name: Histogram() for name in self.stages}
+        self.csv_path = csv_path
+        self.dump_seconds = dump_seconds
+        self._t = time.perf_counter_ns()
+        self._next_dump = time.monotonic() + dump_seconds
+
+    def start(self):
+        self._t = time.perf_counter_ns()
+
+    def mark(self, stage):
+        now = time.perf_counter_ns()
+        self.histograms[stage].record(now - self._t)
+        self._t = now
+
+    def maybe_dump(self):
+        if time.monotonic() >= self._next_dump:
+            self.dump()
+
+    def rows(self):
+        out = []
+        for name in self.stages:
+            h = self.histograms[name]
+            out.append([
+                name,
+                h.total,
+                f"{(h.min or 0) / 1000:.3f}",
+                f"{h.percentile(50) / 1000:.3f}",
+                f"{h.percentile(90) / 1000:.3f}",
+                f"{h.percentile(99) / 1000:.3f}",
+                f"{h.percentile(99.9) / 1000:.3f}",
+                f"{h.max / 1000:.3f}",
+                f"{h.mean() / 1000:.3f}",
+                f"{h.sum / 1e6:.3f}",
+                time.strftime('%Y-%m-%d %H:%M:%S'),
+            ])
+        return out
+
+    def summary(self):
+        """Per-stage percentiles in microseconds, for the live metrics endpoint."""
+        out = {}
+        for name in self.stages:
+            h = self.histograms[name]
+            out[name] = {
+                "count": h.total,
+                "p50_us": h.percentile(50) / 1000,
+                "p90_us": h.percentile(90) / 1000,
+                "p99_us": h.percentile(99) / 1000,
+                "max_us": h.max / 1000,
+                "sum_us": h.sum / 1000,
+            }
+        return out
+
+    def dump(self):
+        """Overwrite the stage timing CSV with the cumulative histograms."""
+        self._next_dump = time.monotonic() + self.dump_seconds
+        tmp_path = self.csv_path + ".tmp"
+        try:
+            with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+                w = csv.writer(f)
+                w.writerow(STAGE_TIMING_HEADERS)
+                w.writerows(self.rows())
+            os.replace(tmp_path, self.csv_path)
+        except Exception as e:
+            print(f"Error writing stage timings: {e}")
+
+
+class NullStageTimer:
+    """Drop-in replacement used when stage timing is disabled."""
+    stages = ()
+    histograms = {}
+
+    def start(self):
+        pass
+
+    def mark(self, stage):
+        pass
+
+    def maybe_dump(self):
+        pass
+
+    def summary(self):
+        return {}
+
+    def dump(self):
+        pass
+
+
+def make_stage_timer(enabled, stages, csv_path, dump_seconds=10):
+    if enabled:
+        return StageTimer(stages, csv_path, dump_seconds)
+    return NullStageTimer()
@@ -0,0 +1,257 @@
+import cProfile
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# --- On-demand profiling ---
+# Signal handlers that profile a live process for a bounded window, so a slow
+# collector can be inspected without restarting it (and losing its state):
+#
+#   kill -USR1 <pid>    cProfile of the main thread (the receive / send loop)
+#                       -> <name>-<pid>-<time>.pstats + .txt (top functions)
+#   kill -USR2 <pid>    stack sampler over every thread
+#                       -> <name>-<pid>-<time>.collapsed (flamegraph.pl input)
+#
+# Sending the same signal again stops the window early. ECHOP_PROFILE_SIGNALS
+# remaps the signals, e.g. "USR1=cprofile,USR2=memory": the memory mode runs
+# tracemalloc over the window and writes the allocation growth by source line
+# (.memory.txt, plus the raw .tracemalloc snapshot) together with the sizes of
+# the structures the program registered (trackers, sent_history, ...).
+# Nothing runs until a signal arrives.
+
+MODES = ("cprofile", "sample", "memory")
+DEFAULT_SIGNALS = "USR1=cprofile,USR2=sample"
+TOP_LINES = 30
+
+
+def _say(text):
+    # Handlers run between the main thread's own prints: write to the fd, not the buffered stream.
+    try:
+        os.write(sys.stdout.fileno(), (text + "\n").encode())
+    except (OSError, ValueError, AttributeError):
+        pass
+
+
+def parse_signals(text):
+    """'USR1=cprofile,USR2=sample' -> {signal number: mode}; signals this platform lacks are skipped."""
+    mapping = {}
+    for part in (p.strip() for p in (text or "").split(",")):
+        if not part:
+            continue
+        name, sep, mode = part.partition("=")
+        if not sep or mode not in MODES:
+            raise ValueError(f"bad profiling signal {part!r} (expected SIGNAL=mode, modes: {', '.join(MODES)})")
+        name = name.strip().upper()
+        signum = getattr(signal, name if name.startswith("SIG") else "SIG" + name, None)
+        if signum is not None:
+            mapping[signum] = mode
+    return mapping
+
+
+class _Window:
+    __slots__ = ("mode", "started", "stop_event", "timer", "thread", "data")
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.started = time.time()
+        self.stop_event = threading.Event()
+        self.timer = None
+        self.thread = None
+        self.data = None
+
+
+class Profiler:
+    """
+    One profiling window per mode at a time, each ended by the same signal or
+    after `seconds`. `watches` maps a name to a callable returning a size
+    (e.g. len(trackers)), reported by the memory mode.
+    """
+
+    def __init__(self, out_dir, name, seconds=30.0, sample_interval=0.005, watches=None, memory_frames=5):
+        self.out_dir = out_dir
+        self.name = name
+        self.seconds = seconds
+        self.sample_interval = sample_interval
+        self.watches = watches or {}
+        self.memory_frames = memory_frames
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def install(self, signals):
+        """Install the handlers for {signal number: mode}; returns the installed names."""
+        installed = []
+        for signum, mode in signals.items():
+            signal.signal(signum, lambda s, f, mode=mode: self.toggle(mode))
+            installed.append(f"{signal.Signals(signum).name}={mode}")
+        if "cprofile" in signals.values() and hasattr(signal, "SIGALRM"):
+            # cProfile must be stopped on the thread it runs on: the window ends with SIGALRM.
+            signal.signal(signal.SIGALRM, lambda s, f: self.stop("cprofile"))
+        return installed
+
+    def _path(self, window, suffix):
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(window.started))
+        return os.path.join(self.out_dir, f"{self.name}-{os.getpid()}-{stamp}{suffix}")
+
+    def toggle(self, mode):
+        if mode in self.windows:
+            self.stop(mode)
+        else:
+            self.start(mode)
+
+    def start(self, mode):
+        with self.lock:
+            if mode in self.windows:
+                return
+            window = self.windows[mode] = _Window(mode)
+        try:
+            getattr(self, f"_start_{mode}")(window)
+        except Exception as e:
+            # e.g. another profiler already owns the interpreter's profiling hook
+            self.windows.pop(mode, None)
+            _say(f"[Profile] {mode} could not start: {e}")
+            return
+        if mode == "cprofile" and hasattr(signal, "setitimer"):
+            signal.setitimer(signal.ITIMER_REAL, self.seconds)
+        elif mode != "sample":   # the sampler thread ends its own window
+            window.timer = threading.Timer(self.seconds, self.stop, (mode,))
+            window.timer.daemon = True
+            window.timer.start()
+        _say(f"[Profile] {mode} started for up to {self.seconds:g}s")
+
+    def stop(self, mode):
+        with self.lock:
+            window = self.windows.pop(mode, None)
+        if window is None:
+            return
+        window.stop_event.set()
+        if window.timer:
+            window.timer.cancel()
+        if window.thread and window.thread is not threading.current_thread():
+            window.thread.join()
+        try:
+            paths = getattr(self, f"_stop_{mode}")(window)
+        except Exception as e:
+            _say(f"[Profile] {mode} failed: {e}")
+            return
+        _say(f"[Profile] {mode} stopped after {time.time() - window.started:.1f}s: {', '.join(paths)}")
+
+    def stop_all(self):
+        for mode in list(self.windows):
+            self.stop(mode)
+
+    # --- cProfile (main thread only: started and stopped from signal handlers) ---
+    def _start_cprofile(self, window):
+        window.data = cProfile.Profile()
+        window.data.enable()
+
+    def _stop_cprofile(self, window):
+        window.data.disable()
+        if hasattr(signal, "setitimer"):
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = self._path(window, ".pstats")
+        window.data.dump_stats(path)
+        with open(self._path(window, ".txt"), "w", encoding="utf-8") as f:
+            stats = pstats.Stats(window.data, stream=f)
+            stats.sort_stats("cumulative").print_stats(TOP_LINES)
+            stats.sort_stats("tottime").print_stats(TOP_LINES)
+        return [path, self._path(window, ".txt")]
+
+    # --- Stack sampler (all threads, from its own thread) ---
+    def _start_sample(self, window):
+        window.data = Counter()
+        window.thread = threading.Thread(target=self._sample, args=(window,), name="profile-sampler", daemon=True)
+        window.thread.start()
+
+    def _sample(self, window):
+        me = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        names = {}
+        while not window.stop_event.wait(self.sample_interval):
+            frames = sys._current_frames()
+            if frames.keys() - names.keys():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                window.data[";".join(reversed(stack))] += 1
+            if time.monotonic() >= deadline:
+                self.stop("sample")
+                return
+
+    def _stop_sample(self, window):
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = self._path(window, ".collapsed")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in window.data.most_common():
+                f.write(f"{stack} {count}\n")
+        return [path]
+
+    # --- tracemalloc growth over the window ---
+    def _watch_sizes(self):
+        sizes = {}
+        for name, size in self.watches.items():
+            try:
+                sizes[name] = size()
+            except Exception:
+                sizes[name] = None
+        return sizes
+
+    def _start_memory(self, window):
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(self.memory_frames)
+        window.data = (started_here, tracemalloc.take_snapshot(), self._watch_sizes())
+
+    def _stop_memory(self, window):
+        started_here, before, sizes_before = window.data
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        after = tracemalloc.take_snapshot().filter_traces(filters)
+        sizes_after = self._watch_sizes()
+        current, peak = tracemalloc.get_traced_memory()
+        if started_here:
+            tracemalloc.stop()
+        os.makedirs(self.out_dir, exist_ok=True)
+        dump = self._path(window, ".tracemalloc")
+        after.dump(dump)
+        path = self._path(window, ".memory.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"{self.name} pid {os.getpid()}: traced {current / 1024:.1f} KiB (peak {peak / 1024:.1f} KiB)\n\n")
+            for name in self.watches:
+                f.write(f"{name}: {sizes_before.get(name)} -> {sizes_after.get(name)}\n")
+            f.write(f"\nTop {TOP_LINES} allocation changes by line:\n")
+            for stat in after.compare_to(before.filter_traces(filters), "lineno")[:TOP_LINES]:
+                f.write(f"{stat}\n")
+            f.write(f"\nTop {TOP_LINES} live allocations by traceback:\n")
+            for stat in after.statistics("traceback")[:TOP_LINES]:
+                f.write(f"{stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+                for line in stat.traceback.format():
+                    f.write(f"  {line}\n")
+        return [path, dump]
+
+
+def install_from_env(out_dir, name, watches=None):
+    """Install the handlers configured by ECHOP_PROFILE_* (ECHOP_PROFILE_SIGNALS="" disables); returns the Profiler."""
+    signals = parse_signals(os.environ.get("ECHOP_PROFILE_SIGNALS", DEFAULT_SIGNALS))
+    if not signals:
+        return None
+    out_dir = os.environ.get("ECHOP_PROFILE_DIR", out_dir)
+    profiler = Profiler(out_dir, name,
+                        seconds=float(os.environ.get("ECHOP_PROFILE_SECONDS", "30")),
+                        sample_interval=float(os.environ.get("ECHOP_PROFILE_SAMPLE_MS", "5")) / 1000.0,
+                        watches=watches,
+                        memory_frames=int(os.environ.get("ECHOP_TRACEMALLOC_FRAMES", "5")))
+    installed = profiler.install(signals)
+    print(f"Profiling on signal: {', '.join(installed)} (pid {os.getpid()}, output in {out_dir})")
+    return profiler
@@ -11,6 +11,29 @@ MSG_DATA = 1
 HEART_BEAT = 2
 NACK_MSG = 3
 
+# Heartbeats: clients send one every HEARTBEAT_INTERVAL_SECONDS (with jitter);
+# the server expires a device after HEARTBEAT_TIMEOUT_SECONDS of silence.
+HEARTBEAT_INTERVAL_SECONDS = 10
+HEARTBEAT_JITTER = 0.2  # +/- fraction of the interval
+HEARTBEAT_TIMEOUT_SECONDS = 3 * HEARTBEAT_INTERVAL_SECONDS
+LIVENESS_BITMAP_SIZE = 2  # one bit per 4-bit device id
+
+# Extension messages use protocol version 2; the msg_type bits then select the
+# extension. A relay batch carries whole device packets, each prefixed with a
+# 1-byte length, from an edge relay (relay.py) to the collector. An FEC parity
+# packet lets the server rebuild one lost DATA packet of a block (fec.py).
+PROTO_VERSION = 1
+EXT_PROTO_VERSION = 2
+EXT_RELAY_BATCH = 0
+EXT_FEC_PARITY = 1
+RELAY_MAX_BYTES = 1400  # envelope size limit (fits a 1500-byte MTU)
+
+# Header flags (byte 8, bits 2-3, "00" unless set). FLAG_SUPPRESSED marks a DATA
+# packet whose decrypted payload starts with a u16 count of reports the device
+# held back under its deadband since its previous DATA (reporting.py).
+FLAG_SUPPRESSED = 0x04
+SUPPRESSED_PREFIX = struct.Struct('!H')
+
 
 
 # Units mapping
@@ -45,9 +68,10 @@ def code_to_unit(code):
     return "unknown"
 
 
-def build_checksum_header(device_id, batch_count, seq_num, msg_type, payload=None):
+def build_checksum_header(device_id, batch_count, seq_num, msg_type, payload=None, proto_version=PROTO_VERSION,
+                          flags=0):
     # 1. Build the base 9-byte header.
-    header = build_header(device_id, batch_count, seq_num, msg_type)
+    header = build_header(device_id, batch_count, seq_num, msg_type, proto_version, flags)
 
     # 2. Combine header and payload for checksum calculation.
     # header is already bytes. If payload is None, use empty bytes.
@@ -74,12 +98,11 @@ def build_checksum_header(device_id, batch_count, seq_num, msg_type, payload=Non
     return checksum_header
 
 
-def build_header(device_id, batch_count, seq_num, msg_type):
+def build_header(device_id, batch_count, seq_num, msg_type, proto_version=PROTO_VERSION, flags=0):
     """
     Build a 9-byte header for the UDP IoT protocol (no custom fields).
     """
     timestamp = int(time.time())
-    proto_version = 1
     ms = int((time.time() * 1000) % 1000)  # 0–999 ms
     ms_high = (ms >> 8) & 0x03
     ms_low = ms & 0xFF
@@ -87,8 +110,8 @@ def build_header(device_id, batch_count, seq_num, msg_type):
     # Byte 1: upper 4 bits device ID, lower 4 bits batch count
     byte1 = ((device_id & 0x0F) << 4) | (batch_count & 0x0F)
 
-    # Byte 8: 2 bits protocol version + 2 bits message type + 00 + 2 bits ms_high
-    byte8 = ((proto_version & 0x03) << 6) | ((msg_type & 0x03) << 4) | (ms_high & 0x03)
+    # Byte 8: 2 bits protocol version + 2 bits message type + 2 bits flags + 2 bits ms_high
+    byte8 = ((proto_version & 0x03) << 6) | ((msg_type & 0x03) << 4) | (flags & 0x0C) | (ms_high & 0x03)
 
     # Pack into 9 bytes
     header = struct.pack('!B H I B B', byte1, seq_num, timestamp, byte8, ms_low)
@@ -108,6 +131,7 @@ def parse_header(data):
     batch_count = byte1 & 0x0F
     proto_version = (byte8 >> 6) & 0x03
     msg_type = (byte8 >> 4) & 0x03
+    flags = byte8 & 0x0C
     ms_high = byte8 & 0x03
     milliseconds = (ms_high << 8) | ms_low
     checksum = (byte10)
@@ -119,11 +143,64 @@ def parse_header(data):
         "timestamp": timestamp,
         "proto_version": proto_version,
         "msg_type": msg_type,
+        "flags": flags,
         "milliseconds": milliseconds,
         "checksum": checksum,
     }
 
 
+def encode_liveness_bitmap(device_ids):
+    """
+    Pack device ids (0-15) into a 2-byte bitmap so one HEARTBEAT can carry
+    the liveness of every device behind a client.
+    """
+    bits = 0
+    for device_id in device_ids:
+        bits |= 1 << (device_id & 0x0F)
+    return struct.pack('!H', bits)
+
+
+def decode_liveness_bitmap(payload):
+    """Return the device ids set in a heartbeat bitmap (empty list if there is no bitmap)."""
+    if len(payload) != LIVENESS_BITMAP_SIZE:
+        return []
+    bits = struct.unpack('!H', payload)[0]
+    return [i for i in range(16) if bits & (1 << i)]
+
+
+def is_relay_batch(data):
+    """True if a datagram is a relay envelope rather than a device packet."""
+    return (len(data) >= HEADER_SIZE and (data[7] >> 6) & 0x03 == EXT_PROTO_VERSION
+            and (data[7] >> 4) & 0x03 == EXT_RELAY_BATCH)
+
+
+def is_fec_parity(data):
+    """True if a datagram is an FEC parity packet."""
+    return (len(data) >= HEADER_SIZE and (data[7] >> 6) & 0x03 == EXT_PROTO_VERSION
+            and (data[7] >> 4) & 0x03 == EXT_FEC_PARITY)
+
+
+def pack_relay_batch(relay_id, seq_num, packets):
+    """Wrap device packets (each at most 255 bytes) in one relay envelope."""
+    body = b"".join(struct.pack('!B', len(p)) + p for p in packets)
+    header = build_checksum_header(relay_id, min(len(packets), 0x0F), seq_num & 0xFFFF,
+                                   EXT_RELAY_BATCH, body, proto_version=EXT_PROTO_VERSION)
+    return header + body
+
+
+def unpack_relay_batch(payload):
+    """Return the device packets carried in a relay envelope's payload."""
+    packets = []
+    i = 0
+    while i < len(payload):
+        n = payload[i]
+        if i + 1 + n > len(payload):
+            raise ValueError("Invalid relay batch: truncated packet")
+        packets.append(payload[i + 1:i + 1 + n])
+        i += 1 + n
+    return packets
+
+
 # --- Simple LCG-based stream cipher helpers ---
 # NOTE: This is a very small/fast stream cipher using an LCG to produce
 # a byte keystream which is XORed with the payload. It provides a
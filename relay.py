@@ -0,0 +1,279 @@
+import argparse
+import select
+import signal
+import socket
+import sys
+import time
+from collections import OrderedDict
+
+from protocol import *
+
+# --- Edge relay ---
+# Sits between a local group of devices and the central collector:
+#   - devices send to the relay exactly as they would to udpsrv.py
+#     (ECHOP_SERVER=<relay host>:<port> python3 udpclnt.py ...)
+#   - gaps are NACKed locally, so retransmissions never cross the WAN
+#   - packets are forwarded upstream in relay envelopes (many device
+#     packets per datagram, flushed when full or every --flush-ms)
+#   - NACKs from the collector are answered from the relay's cache of
+#     forwarded packets; only seq=1 (re-INIT) or uncached seqs reach devices
+#   - device heartbeats are folded into one bitmap heartbeat per period
+#
+#   python3 relay.py --listen 0.0.0.0:12002 --server collector:12001 --relay-id 0
+
+sys.stdout.reconfigure(line_buffering=True)
+
+LOCAL_NACK_DELAY_SECONDS = 0.2  # devices are one LAN hop away
+FORWARD_CACHE_PER_DEVICE = 256  # forwarded packets kept to answer upstream NACKs
+STATS_SECONDS = 10
+
+
+def parse_addr(text, default_host="0.0.0.0"):
+    host, _, port = text.rpartition(":")
+    return (host or default_host, int(port))
+
+
+class DeviceState:
+    __slots__ = ("addr", "highest_seq", "missing", "upstream_wanted", "forwarded", "last_heard")
+
+    def __init__(self, addr):
+        self.addr = addr
+        self.highest_seq = None
+        self.missing = {}            # seq -> time a local NACK is due
+        self.upstream_wanted = set() # seqs the collector asked for that were not cached
+        self.forwarded = OrderedDict()
+        self.last_heard = 0.0
+
+
+class Relay:
+    def __init__(self, listen, server, relay_id=0, flush_ms=500):
+        self.server = server
+        self.relay_id = relay_id
+        self.flush_seconds = flush_ms / 1000.0
+        self.devices = {}
+        self.pending = []
+        self.pending_bytes = HEADER_SIZE
+        self.pending_since = None
+        self.envelope_seq = 1
+        self.nack_seq = 1
+        self.next_heartbeat = time.time() + HEARTBEAT_INTERVAL_SECONDS
+        self.stats = {"device_packets": 0, "envelopes": 0, "local_nacks": 0, "upstream_nacks": 0,
+                      "served_from_cache": 0, "dropped_duplicates": 0, "corrupted": 0,
+                      "upstream_send_errors": 0, "expired_devices": 0}
+
+        self.down = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.down.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.down.bind(listen)
+        self.up = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.up.connect(server)
+        print(f"Relay {relay_id} listening on {listen[0]}:{listen[1]}, forwarding to {server[0]}:{server[1]}")
+
+    # --- upstream ---
+    def _enqueue(self, packet, now):
+        if self.pending_bytes + 1 + len(packet) > RELAY_MAX_BYTES:
+            self.flush()
+        if not self.pending:
+            self.pending_since = now
+        self.pending.append(packet)
+        self.pending_bytes += 1 + len(packet)
+
+    def flush(self):
+        if not self.pending:
+            return
+        try:
+            self.up.send(pack_relay_batch(self.relay_id, self.envelope_seq, self.pending))
+            print(f" [>>] Envelope {self.envelope_seq}: {len(self.pending)} packets, {self.pending_bytes} bytes")
+            self.stats["envelopes"] += 1
+        except OSError as e:
+            # Collector down or unreachable: the envelope is lost like any datagram,
+            # and its packets stay in the forward cache for the collector's NACKs.
+            self.stats["upstream_send_errors"] += 1
+            print(f" [!] Envelope {self.envelope_seq} not sent ({len(self.pending)} packets): {e}")
+        self.envelope_seq = (self.envelope_seq + 1) & 0xFFFF
+        self.pending = []
+        self.pending_bytes = HEADER_SIZE
+        self.pending_since = None
+
+    def _forward(self, device_id, seq, packet, now):
+        state = self.devices[device_id]
+        state.forwarded[seq] = packet
+        state.forwarded.move_to_end(seq)
+        while len(state.forwarded) > FORWARD_CACHE_PER_DEVICE:
+            state.forwarded.popitem(last=False)
+        self._enqueue(packet, now)
+
+    # --- downstream ---
+    def _send_nack(self, device_id, seq):
+        payload = f"{device_id}:{seq}".encode('utf-8')
+        header = build_checksum_header(device_id=self.relay_id, batch_count=1, seq_num=self.nack_seq,
+                                       msg_type=NACK_MSG, payload=payload)
+        self.nack_seq = (self.nack_seq + 1) & 0xFFFF
+        self.down.sendto(header + payload, self.devices[device_id].addr)
+
+    def on_device_packet(self, data, addr, now):
+        try:
+            header = parse_header(data)
+        except ValueError:
+            return
+        if header['checksum'] != calculate_expected_checksum(data[:HEADER_SIZE - 1], data[HEADER_SIZE:]):
+            # Let the gap logic recover it from the device.
+            self.stats["corrupted"] += 1
+            return
+        self.stats["device_packets"] += 1
+        device_id = header['device_id']
+        seq = header['seq']
+        state = self.devices.get(device_id)
+        if state is None:
+            state = self.devices[device_id] = DeviceState(addr)
+        state.addr = addr
+        state.last_heard = now
+
+        if header['proto_version'] == EXT_PROTO_VERSION:
+            # FEC parity: the collector rebuilds from it, the relay only forwards it.
+            self._enqueue(data, now)
+            return
+        msg_type = header['msg_type']
+        if msg_type == HEART_BEAT:
+            for other in decode_liveness_bitmap(data[HEADER_SIZE:]):
+                if other in self.devices:
+                    self.devices[other].last_heard = now
+            return
+        if msg_type == MSG_INIT:
+            state.highest_seq = seq
+            state.missing.clear()
+            state.upstream_wanted.clear()
+            state.forwarded.clear()
+            self._forward(device_id, seq, data, now)
+            return
+        if msg_type != MSG_DATA:
+            return
+
+        if state.highest_seq is None or seq == state.highest_seq + 1:
+            state.highest_seq = seq
+        elif seq > state.highest_seq + 1:
+            for missing_seq in range(state.highest_seq + 1, seq):
+                state.missing.setdefault(missing_seq, now + LOCAL_NACK_DELAY_SECONDS)
+            state.highest_seq = seq
+        elif seq in state.missing:
+            del state.missing[seq]
+            print(f" [+] Recovered locally ID:{device_id}, seq:{seq}")
+        elif seq in state.upstream_wanted:
+            state.upstream_wanted.discard(seq)
+        else:
+            self.stats["dropped_duplicates"] += 1
+            return
+        self._forward(device_id, seq, data, now)
+
+    def on_upstream(self, data, now):
+        try:
+            header = parse_header(data)
+        except ValueError:
+            return
+        if header['msg_type'] != NACK_MSG:
+            return
+        if header['checksum'] != calculate_expected_checksum(data[:HEADER_SIZE - 1], data[HEADER_SIZE:]):
+            return
+        try:
+            device_id, seq = (int(x) for x in data[HEADER_SIZE:].decode('utf-8').split(":"))
+        except ValueError:
+            return
+        self.stats["upstream_nacks"] += 1
+        state = self.devices.get(device_id)
+        if state is None:
+            return
+        cached = state.forwarded.get(seq)
+        if cached is not None and seq != 1:
+            self.stats["served_from_cache"] += 1
+            print(f" [<<] Collector NACK ID:{device_id}, seq:{seq} served from cache")
+            self._enqueue(cached, now)
+            self.flush()
+            return
+        # seq=1 means the collector lost the session: the device must re-INIT.
+        if seq != 1:
+            state.upstream_wanted.add(seq)
+        print(f" [<<] Collector NACK ID:{device_id}, seq:{seq} forwarded to device")
+        self.down.sendto(data, state.addr)
+
+    # --- timers ---
+    def on_tick(self, now):
+        for device_id, state in self.devices.items():
+            if len(state.missing) > FORWARD_CACHE_PER_DEVICE:
+                # Give up on gaps far behind the stream; the collector still tracks them.
+                floor = state.highest_seq - FORWARD_CACHE_PER_DEVICE
+                state.missing = {seq: when for seq, when in state.missing.items() if seq > floor}
+            due = [seq for seq, when in state.missing.items() if when <= now]
+            for seq in due:
+                # One local NACK per gap; the collector covers anything still missing.
+                state.missing[seq] = float("inf")
+                self._send_nack(device_id, seq)
+                self.stats["local_nacks"] += 1
+                print(f" [<<] Local NACK ID:{device_id}, seq:{seq}")
+        if self.pending and now - self.pending_since >= self.flush_seconds:
+            self.flush()
+        if now >= self.next_heartbeat:
+            self.expire_idle(now)
+            alive = list(self.devices)
+            if alive:
+                bitmap = encode_liveness_bitmap(alive)
+                header = build_checksum_header(device_id=alive[0], batch_count=len(alive) & 0x0F, seq_num=0,
+                                               msg_type=HEART_BEAT, payload=bitmap)
+                self._enqueue(header + bitmap, now)
+            self.next_heartbeat = now + HEARTBEAT_INTERVAL_SECONDS
+
+    def expire_idle(self, now):
+        """Drop devices silent for HEARTBEAT_TIMEOUT_SECONDS, with their gaps and forward cache."""
+        # The collector evicts their sessions on the same timeout; a device that
+        # comes back gets fresh state, and the collector's seq=1 NACK re-INITs it.
+        for device_id in [d for d, s in self.devices.items() if now - s.last_heard >= HEARTBEAT_TIMEOUT_SECONDS]:
+            del self.devices[device_id]
+            self.stats["expired_devices"] += 1
+            print(f" [-] Device {device_id} silent for {HEARTBEAT_TIMEOUT_SECONDS}s, dropped from relay")
+
+    def run(self):
+        next_stats = time.time() + STATS_SECONDS
+        while True:
+            readable, _, _ = select.select([self.down, self.up], [], [], 0.05)
+            now = time.time()
+            for sock in readable:
+                try:
+                    data, addr = sock.recvfrom(RELAY_MAX_BYTES)
+                except ConnectionRefusedError:
+                    continue  # collector not up yet (ICMP from an earlier send)
+                if sock is self.down:
+                    self.on_device_packet(data, addr, now)
+                else:
+                    self.on_upstream(data, now)
+            self.on_tick(now)
+            if now >= next_stats:
+                packets, envelopes = self.stats["device_packets"], self.stats["envelopes"]
+                ratio = f"{packets / envelopes:.1f}" if envelopes else "-"
+                print(f"[Relay] {packets} device packets -> {envelopes} envelopes ({ratio} per envelope), "
+                      f"{self.stats['local_nacks']} local NACKs, {self.stats['served_from_cache']} "
+                      f"collector NACKs served from cache, {self.stats['upstream_send_errors']} failed envelopes")
+                next_stats = now + STATS_SECONDS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ECHOP edge relay: aggregate local devices toward the collector.")
+    parser.add_argument("--listen", default="0.0.0.0:12002", help="address devices send to (host:port)")
+    parser.add_argument("--server", default="localhost:12001", help="collector address (host:port)")
+    parser.add_argument("--relay-id", type=int, default=0, help="relay id (0-15) carried in envelope headers")
+    parser.add_argument("--flush-ms", type=int, default=500,
+                        help="longest a packet waits for its envelope to fill (default 500)")
+    args = parser.parse_args()
+
+    relay = Relay(parse_addr(args.listen), parse_addr(args.server, "localhost"),
+                  args.relay_id & 0x0F, args.flush_ms)
+
+    def shutdown(signum, frame):
+        relay.flush()
+        print(f"\n[Relay] Signal {signum} received, stopped. {relay.stats}")
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    relay.run()
+
+
+if __name__ == "__main__":
+    main()
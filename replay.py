@@ -0,0 +1,219 @@
+import argparse
+import contextlib
+import csv
+import glob
+import io
+import os
+import sys
+import tempfile
+import time
+
+from pcapread import iter_udp
+from segments import iter_lines, is_segment
+from protocol import (HEADER_SIZE, MSG_DATA, parse_header, is_fec_parity, encrypt_bytes, decrypt_bytes,
+                      calculate_expected_checksum)
+
+BASE_HEADER_SIZE = 9  # header bytes covered by the checksum
+
+# --- PCAP replay ---
+# Streams the client->server datagrams of a recorded run through the server's
+# own handle_packet() pipeline in-process (parse, checksum, decrypt, decode,
+# tracker, persist, reorder, metrics), reports throughput and diffs the
+# resulting CSV against the one recorded during the run.
+#
+#   python3 replay.py logs/loss_run1/loss_run1.pcap
+#   python3 replay.py logs/delay_run1/delay_run1.pcap --speed 10
+#   python3 replay.py logs/loss_run1/loss_run1.pcap --sink sqlite --repeat 20
+#
+# --sink/--repeat turn it into the storage benchmark: the same pipeline, with
+# rows written to the chosen sink, over as many copies of the capture as asked.
+
+# Columns compared against the recorded CSV. Server/device timestamps, delay and
+# cpu time depend on when (and in which timezone) the run happened.
+DIFF_COLUMNS = ["unit/batch_count", "payload", "duplicate_flag", "gap_flag", "packet_size"]
+
+
+def find_recorded_csv(pcap_path):
+    """Pick the raw reception CSV saved next to a capture (e.g. loss_run1.csv or iot_device_data.csv)."""
+    run_dir = os.path.dirname(os.path.abspath(pcap_path))
+    stem = os.path.splitext(os.path.basename(pcap_path))[0]
+    return find_run_csv(run_dir, stem)
+
+
+def find_run_csv(run_dir, stem=None):
+    """Raw reception CSV of a run directory: <stem>.csv, iot_device_data.csv, else any non-metrics CSV."""
+    stem = stem or os.path.basename(os.path.normpath(run_dir))
+    for name in (f"{stem}.csv", "iot_device_data.csv"):
+        path = os.path.join(run_dir, name)
+        if os.path.exists(path):
+            return path
+    for path in sorted(glob.glob(os.path.join(run_dir, "*.csv"))):
+        base = os.path.basename(path)
+        if not base.startswith("metrics") and "reordered" not in base and not is_segment(path):
+            return path
+    return None
+
+
+def load_rows(path, skip_types=("HEARTBEAT",)):
+    """
+    Map (device_id, sequence_number, message_type, occurrence) -> row dict, across
+    the CSV's segments. DUPLICATE rows are folded into the duplicate_flag of the
+    rows they duplicate, so CSVs flagged in place and appended-to compare alike.
+    """
+    rows = {}
+    seen = {}
+    duplicated = set()
+    for row in csv.DictReader(iter_lines(path)):
+        if row.get("message_type") == "DUPLICATE":
+            duplicated.add((row["device_id"], row["sequence_number"]))
+            continue
+        if row.get("message_type") in skip_types:
+            continue
+        base = (row["device_id"], row["sequence_number"], row["message_type"])
+        n = seen.get(base, 0)
+        seen[base] = n + 1
+        rows[base + (n,)] = row
+    for key, row in rows.items():
+        if key[:2] in duplicated:
+            row["duplicate_flag"] = "1"
+    return rows
+
+
+def diff_csv(expected_path, actual_path, columns=DIFF_COLUMNS, limit=10):
+    """Compare two reception CSVs row by row; returns (matched, mismatches, only_expected, only_actual)."""
+    expected = load_rows(expected_path)
+    actual = load_rows(actual_path)
+    mismatches = []
+    matched = 0
+    for key in expected.keys() & actual.keys():
+        diffs = {c: (expected[key].get(c, "").strip(), actual[key].get(c, "").strip())
+                 for c in columns if expected[key].get(c, "").strip() != actual[key].get(c, "").strip()}
+        if diffs:
+            mismatches.append((key, diffs))
+        else:
+            matched += 1
+    only_expected = sorted(expected.keys() - actual.keys())
+    only_actual = sorted(actual.keys() - expected.keys())
+    mismatches.sort()
+    return matched, mismatches[:limit] + ([("...", {})] if len(mismatches) > limit else []), only_expected, only_actual
+
+
+def _passes(pcap_path, port, repeat):
+    """Yield (ts, src, payload) for `repeat` passes over the capture, relabelling devices per pass."""
+    for n in range(repeat):
+        for ts, src, _dst, payload in iter_udp(pcap_path, dst_port=port):
+            if n and len(payload) >= HEADER_SIZE:
+                if is_fec_parity(payload):
+                    continue  # parity covers the original device's packets; relabelled passes go without
+                payload = _shift_device(payload, n)
+            yield ts, src, payload
+
+
+def _shift_device(packet, n):
+    """Move a packet to device (id + n) % 16, re-encrypting DATA and fixing the checksum."""
+    header = parse_header(packet)
+    body = packet[HEADER_SIZE:]
+    device_id = (header['device_id'] + n) & 0x0F
+    if header['msg_type'] == MSG_DATA and body:
+        body = encrypt_bytes(decrypt_bytes(body, header['device_id'], header['seq']), device_id, header['seq'])
+    base = bytes([(device_id << 4) | (packet[0] & 0x0F)]) + packet[1:BASE_HEADER_SIZE]
+    return base + bytes([calculate_expected_checksum(base, body)]) + body
+
+
+def replay(pcap_path, port=12001, speed=0.0, verbose=False, repeat=1):
+    """
+    Feed every datagram sent to `port` in `pcap_path` to udpsrv.handle_packet.
+    speed=0 replays as fast as possible, otherwise capture time is divided by `speed`.
+    With repeat > 1 the capture is fed again as new devices (ids shifted by the
+    pass number, modulo 16) so later passes are not all duplicates.
+    Returns (packets, bytes, seconds spent inside the pipeline, wall seconds).
+    """
+    import udpsrv
+    udpsrv.init_csv_file()
+
+    packets = 0
+    nbytes = 0
+    busy = 0.0
+    first_ts = None
+    wall_start = time.perf_counter()
+    out = sys.stdout if verbose else io.StringIO()
+    for ts, src, payload in _passes(pcap_path, port, repeat):
+        if speed > 0:
+            if first_ts is None:
+                first_ts = ts
+            due = wall_start + (ts - first_ts) / speed
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(out):
+            udpsrv.handle_packet(payload, src)
+        busy += time.perf_counter() - t0
+        packets += 1
+        nbytes += len(payload)
+        if not verbose:
+            out.seek(0)
+            out.truncate()
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        udpsrv._save_reordered(udpsrv._reorder.flush_all())
+        udpsrv._sink.close()
+        if udpsrv._rollups:
+            udpsrv._rollups.close()
+        udpsrv._stages.dump()
+    busy += time.perf_counter() - t0
+    return packets, nbytes, busy, time.perf_counter() - wall_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a captured run through the ECHOP server pipeline.")
+    parser.add_argument("pcap", help="capture file (logs/<scenario>_runN/*.pcap)")
+    parser.add_argument("--port", type=int, default=12001, help="server UDP port in the capture")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="time scale: 0 = as fast as possible (default), 1 = real time, 10 = 10x faster")
+    parser.add_argument("--out", help="output directory for the replayed CSVs (default: a temp dir)")
+    parser.add_argument("--expected", help="recorded CSV to diff against (default: found next to the pcap)")
+    parser.add_argument("--no-diff", action="store_true", help="skip the CSV comparison")
+    parser.add_argument("--verbose", action="store_true", help="show the server's per-packet console output")
+    parser.add_argument("--sink", choices=("csv", "binary", "sqlite"), default="csv",
+                        help="storage sink to write to (the CSV diff needs csv)")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="feed the capture N times, as different device ids each pass")
+    args = parser.parse_args()
+
+    out_dir = args.out or tempfile.mkdtemp(prefix="echop_replay_")
+    # udpsrv reads its output directory at import time.
+    os.environ["ECHOP_LOG_DIR"] = out_dir
+    # A replay starts from an empty session table, like the recorded run did.
+    os.environ["ECHOP_CHECKPOINT"] = "0"
+    os.environ["ECHOP_SINK"] = args.sink
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    packets, nbytes, busy, wall = replay(args.pcap, args.port, args.speed, args.verbose, args.repeat)
+    print(f"Replayed {packets} packets ({nbytes} bytes) from {args.pcap} into the {args.sink} sink")
+    if packets:
+        print(f"  pipeline time: {busy * 1000:.1f} ms ({busy / packets * 1e6:.1f} us/packet, "
+              f"{packets / busy if busy else 0:.0f} packets/s)")
+        print(f"  wall time:     {wall * 1000:.1f} ms")
+    print(f"  output:        {out_dir}")
+
+    if args.no_diff or args.sink != "csv" or args.repeat > 1:
+        return 0
+    expected = args.expected or find_recorded_csv(args.pcap)
+    if not expected:
+        print("No recorded CSV found to diff against.")
+        return 0
+    actual = os.path.join(out_dir, "iot_device_data.csv")
+    matched, mismatches, only_expected, only_actual = diff_csv(expected, actual)
+    print(f"Diff vs {expected} (heartbeats ignored; columns: {', '.join(DIFF_COLUMNS)})")
+    print(f"  matching rows: {matched}")
+    print(f"  mismatched:    {len([m for m in mismatches if m[0] != '...'])}")
+    for key, diffs in mismatches:
+        print(f"    {key}: {diffs}" if diffs else "    ...")
+    print(f"  only recorded: {len(only_expected)} {only_expected[:10]}")
+    print(f"  only replayed: {len(only_actual)} {only_actual[:10]}")
+    return 0 if not (mismatches or only_expected or only_actual) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
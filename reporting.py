@@ -0,0 +1,92 @@
+from protocol import HEARTBEAT_TIMEOUT_SECONDS
+
+# --- Send-on-delta (deadband) reporting ---
+# With ECHOP_DEADBAND set the client only sends a DATA packet when one of its
+# readings moved more than the deadband away from the last reported reading
+# (the value a sample-and-hold reconstruction on the server would show):
+#
+#   ECHOP_DEADBAND=0.5                       absolute, every unit
+#   ECHOP_DEADBAND=2%                        relative to the last reported value
+#   ECHOP_DEADBAND=celsius=0.2,percent=1%    per unit (others always report)
+#   ECHOP_DEADBAND=celsius=0.2,default=1%    per unit with a fallback
+#
+# A flat sensor still reports once every ECHOP_MAX_SILENCE seconds (default:
+# the server's heartbeat timeout), so its session is kept alive by DATA even
+# when heartbeats are lost. The next DATA packet after a run of suppressed
+# reports carries their count (FLAG_SUPPRESSED), and the server records it as
+# a SUPPRESSED row ahead of that packet.
+
+DEFAULT_MAX_SILENCE = HEARTBEAT_TIMEOUT_SECONDS
+
+
+def parse_deadband(text):
+    """'celsius=0.2,percent=1%' -> {unit: (band, relative)}; a bare value is the default."""
+    bands = {}
+    for part in (p.strip() for p in (text or "").split(",")):
+        if not part:
+            continue
+        unit, sep, value = part.rpartition("=")
+        unit = unit.strip().lower() if sep else "default"
+        value = value.strip()
+        relative = value.endswith("%")
+        try:
+            band = float(value.rstrip("%"))
+        except ValueError:
+            raise ValueError(f"bad deadband {part!r} (expected [unit=]value or [unit=]value%)")
+        if band < 0:
+            raise ValueError(f"bad deadband {part!r}: must not be negative")
+        bands[unit] = (band / 100.0 if relative else band, relative)
+    return bands
+
+
+def deadband_for(unit, bands):
+    """(band, relative) for a unit, or None if it reports every interval."""
+    band = bands.get(unit.lower(), bands.get("default"))
+    if band is None or band[0] == 0:
+        return None
+    return band
+
+
+class DeadbandPolicy:
+    """Decides, chunk by chunk, whether a reading moved enough to be sent."""
+
+    def __init__(self, band, relative=False, max_silence=DEFAULT_MAX_SILENCE):
+        self.band = band
+        self.relative = relative
+        self.max_silence = max_silence
+        self.reference = None      # last reported reading
+        self.last_sent = None
+        self.suppressed = 0        # reports held back since the last DATA
+        self.suppressed_total = 0
+        self.forced_total = 0
+
+    def _moved(self, values):
+        ref = self.reference
+        limit = self.band * abs(ref) if self.relative else self.band
+        return any(abs(v - ref) > limit for v in values)
+
+    def should_send(self, values, now):
+        """True if this chunk must be sent; otherwise it is counted as suppressed."""
+        if not values or self.reference is None or self._moved(values):
+            return True
+        if now - self.last_sent >= self.max_silence:
+            self.forced_total += 1
+            return True
+        self.suppressed += 1
+        self.suppressed_total += 1
+        return False
+
+    def sent(self, values, now):
+        """Record a sent chunk; returns the suppressed count it has to carry."""
+        suppressed = self.suppressed
+        self.suppressed = 0
+        if values:
+            self.reference = values[-1]
+        self.last_sent = now
+        return suppressed
+
+    def reset(self):
+        """Start over (the device re-INITs: the server holds nothing to compare against)."""
+        self.reference = None
+        self.last_sent = None
+        self.suppressed = 0
@@ -0,0 +1,184 @@
+import csv
+import math
+import os
+import threading
+from array import array
+
+from timefmt import format_seconds
+
+# --- Ingest-time rollups ---
+# Every decoded DATA reading is folded into per-device, per-unit tumbling
+# windows (10 s / 1 min / 1 h by default, aligned to the device clock). Each
+# window is five doubles - count, min, max, sum, sum of squares - in one flat
+# array per device and unit, and becomes one row of rollups.csv when it closes.
+
+ROLLUP_HEADERS = [
+    "window_seconds", "window_start", "window_start_ms", "device_id", "unit",
+    "count", "min", "max", "mean", "stddev", "sum", "sum_sq", "partial"
+]
+COUNT, MIN, MAX, SUM, SUM_SQ = range(5)
+FIELDS = 5
+
+
+class _Series:
+    __slots__ = ("starts", "closed_until", "stats", "clock_offset_ms")
+
+    def __init__(self, n_windows):
+        # Two slots per window length (alternating by window index), so the
+        # previous window keeps taking NACK retransmissions during the grace period.
+        self.starts = array("q", [-1] * (2 * n_windows))   # window start (ms), -1 = empty
+        # Per window length: end (ms) of the latest window written out. Readings
+        # before it belong to a closed window and must not reopen its slot.
+        self.closed_until = array("q", [-1] * n_windows)
+        self.stats = array("d", [0.0] * (FIELDS * 2 * n_windows))
+        self.clock_offset_ms = 0  # server arrival - device timestamp of the latest reading
+
+
+class RollupWindows:
+    """
+    Tumbling-window aggregates keyed by (device_id, unit). A window closes once
+    the device clock has passed its end plus grace_seconds: on a newer reading,
+    or from expire() for devices that went quiet (the device clock is then
+    estimated from the last arrival). Readings for an already closed window
+    are dropped and counted in late_total.
+    """
+
+    def __init__(self, path, windows=(10, 60, 3600), grace_seconds=5):
+        self.path = path
+        self.windows_ms = [int(w * 1000) for w in windows]
+        self.grace_ms = int(grace_seconds * 1000)
+        self.series = {}  # (device_id, unit) -> _Series
+        self.lock = threading.Lock()
+        self.rows_total = 0
+        self.late_total = 0  # readings for a window that was already closed
+        self._file = None
+        self._writer = None
+
+    def open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(ROLLUP_HEADERS)
+        self._file.flush()
+
+    def add(self, device_id, unit, ts_ms, values, arrival_ms):
+        """Fold the readings of one DATA packet (device timestamp ts_ms) into every window."""
+        if not values:
+            return
+        n = len(values)
+        lo = min(values)
+        hi = max(values)
+        total = sum(values)
+        total_sq = sum([v * v for v in values])
+        key = (device_id, unit)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = _Series(len(self.windows_ms))
+            series.clock_offset_ms = arrival_ms - ts_ms
+            closed = self._close_due(key, series, ts_ms)
+            starts = series.starts
+            stats = series.stats
+            for i, width in enumerate(self.windows_ms):
+                start = ts_ms - ts_ms % width
+                slot = 2 * i + (start // width) % 2
+                current = starts[slot]
+                if start < current or start < series.closed_until[i]:
+                    self.late_total += 1
+                    continue
+                base = slot * FIELDS
+                if start > current:
+                    if current >= 0:
+                        self._close(key, slot, series)
+                        closed = True
+                    starts[slot] = start
+                    stats[base + COUNT] = 0.0
+                    stats[base + MIN] = math.inf
+                    stats[base + MAX] = -math.inf
+                    stats[base + SUM] = 0.0
+                    stats[base + SUM_SQ] = 0.0
+                stats[base + COUNT] += n
+                if lo < stats[base + MIN]:
+                    stats[base + MIN] = lo
+                if hi > stats[base + MAX]:
+                    stats[base + MAX] = hi
+                stats[base + SUM] += total
+                stats[base + SUM_SQ] += total_sq
+            if closed:
+                self._file.flush()
+
+    def expire(self, now_ms):
+        """
+        Close windows whose end (plus grace) has passed for devices that went quiet,
+        and forget series that have had no open window for a further longest window.
+        """
+        idle_ms = max(self.windows_ms) + self.grace_ms
+        with self.lock:
+            closed = False
+            idle = []
+            for key, series in self.series.items():
+                device_now_ms = now_ms - series.clock_offset_ms
+                closed |= self._close_due(key, series, device_now_ms)
+                # Dropping a series loses its closed_until watermark, so a reading that
+                # still turns up would reopen a written window: wait well past the last one.
+                if max(series.starts) < 0 and device_now_ms - max(series.closed_until) >= idle_ms:
+                    idle.append(key)
+            for key in idle:
+                del self.series[key]
+            if closed:
+                self._file.flush()
+
+    def _close_due(self, key, series, device_now_ms):
+        closed = False
+        for slot, start in enumerate(series.starts):
+            if start >= 0 and start + self.windows_ms[slot // 2] + self.grace_ms <= device_now_ms:
+                self._close(key, slot, series)
+                series.starts[slot] = -1
+                closed = True
+        return closed
+
+    def _close(self, key, slot, series):
+        self._emit(key, slot, series, partial=False)
+        i = slot // 2
+        end = series.starts[slot] + self.windows_ms[i]
+        if end > series.closed_until[i]:
+            series.closed_until[i] = end
+
+    def close(self):
+        """Write the still-open windows (marked partial) and close the file."""
+        with self.lock:
+            if self._file is None:
+                return
+            for key, series in self.series.items():
+                for slot, start in enumerate(series.starts):
+                    if start >= 0:
+                        self._emit(key, slot, series, partial=True)
+                        series.starts[slot] = -1
+            self._file.close()
+            self._file = None
+
+    def open_windows(self):
+        with self.lock:
+            return sum(1 for s in self.series.values() for start in s.starts if start >= 0)
+
+    def _emit(self, key, slot, series, partial):
+        base = slot * FIELDS
+        stats = series.stats
+        count = stats[base + COUNT]
+        if count <= 0 or self._writer is None:
+            return
+        mean = stats[base + SUM] / count
+        variance = max(0.0, stats[base + SUM_SQ] / count - mean * mean)
+        start = series.starts[slot]
+        self._writer.writerow([
+            self.windows_ms[slot // 2] // 1000, f" {format_seconds(start)}", start, key[0], key[1],
+            int(count), f"{stats[base + MIN]:.6f}", f"{stats[base + MAX]:.6f}", f"{mean:.6f}",
+            f"{math.sqrt(variance):.6f}", f"{stats[base + SUM]:.6f}", f"{stats[base + SUM_SQ]:.6f}",
+            1 if partial else 0,
+        ])
+        self.rows_total += 1
+
+
+def parse_windows(text):
+    """'10,60,3600' -> (10, 60, 3600); '' or '0' -> () (rollups off)."""
+    return tuple(int(w) for w in text.replace(" ", "").split(",") if w and int(w) > 0)
@@ -0,0 +1,359 @@
+import csv
+import glob
+import gzip
+import json
+import lzma
+import os
+import queue
+import re
+import threading
+import time
+
+from timefmt import now_ms, parse_millis
+
+# --- Segmented CSV output ---
+# The active file keeps its usual name (iot_device_data.csv). It rolls into a
+# numbered segment (iot_device_data.000001.csv) when it reaches
+# SegmentPolicy.max_bytes or crosses a max_seconds wall-clock boundary, and a
+# file left by a previous run is rolled the same way at startup instead of
+# being truncated. A background thread compresses closed segments (gzip or
+# lzma) and records each one in <stem>.manifest.json: its rows plus the
+# device timestamp range of every device in it, so readers can skip segments.
+#
+#   for row in csv.DictReader(iter_lines("logs/iot_device_data.csv")): ...
+#   iter_lines(path, device_id=3, start_ms=t0)   # only segments that can match
+
+COMPRESSION = {"gzip": ".gz", "lzma": ".xz", "none": ""}
+# Device timestamp column of the sink CSVs (see sinks.CSV_HEADERS)
+DEVICE_ID_COLUMN = 1
+DEVICE_TS_COLUMN = 4
+
+
+class SegmentPolicy:
+    """When to roll (0 = never on that criterion) and how to store closed segments."""
+
+    def __init__(self, max_bytes=0, max_seconds=0, compression="gzip"):
+        if compression not in COMPRESSION:
+            raise ValueError(f"unknown segment compression {compression!r} "
+                             f"(expected one of {', '.join(COMPRESSION)})")
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.compression = compression
+
+
+_SEGMENT_NAME_RE = re.compile(r"\.\d{6}\.[^.]+(\.gz|\.xz)?$")
+
+
+def manifest_path(path):
+    return os.path.splitext(path)[0] + ".manifest.json"
+
+
+def is_segment(path):
+    """True for a closed segment file (name.000001.csv[.gz]); readers reach those through the active file."""
+    return bool(_SEGMENT_NAME_RE.search(path))
+
+
+def _open_text(path, mode="rt"):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, newline='', encoding='utf-8')
+    if path.endswith(".xz"):
+        return lzma.open(path, mode, newline='', encoding='utf-8')
+    return open(path, mode, newline='', encoding='utf-8')
+
+
+class Manifest:
+    """The segment list of one output file, rewritten atomically on every change."""
+
+    def __init__(self, path, active_path):
+        self.path = path
+        self.dir = os.path.dirname(path) or "."
+        self.active = os.path.basename(active_path)
+        self.segments = []
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self.segments = json.load(f).get("segments", [])
+            except FileNotFoundError:
+                self.segments = []
+        return self
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({"active": self.active, "segments": self.segments}, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def next_name(self):
+        """Next free segment name; stray segment files not in the manifest are never overwritten."""
+        stem, ext = os.path.splitext(self.active)
+        pattern = re.compile(re.escape(stem) + r"\.(\d+)" + re.escape(ext))
+        taken = [entry["seq"] for entry in self.segments]
+        for path in glob.glob(os.path.join(glob.escape(self.dir), f"{glob.escape(stem)}.*{ext}*")):
+            m = pattern.match(os.path.basename(path))
+            if m:
+                taken.append(int(m.group(1)))
+        seq = max(taken, default=0) + 1
+        return seq, f"{stem}.{seq:06d}{ext}"
+
+    def add(self, seq, name):
+        entry = {"seq": seq, "file": name, "compression": "none", "rolled_ms": now_ms()}
+        with self.lock:
+            self.segments.append(entry)
+            self._save()
+        return entry
+
+    def update(self, entry, **fields):
+        with self.lock:
+            entry.update(fields)
+            self._save()
+
+    def pending(self):
+        """Segments rolled but not yet summarised (e.g. the server stopped mid-compression)."""
+        with self.lock:
+            return [entry for entry in self.segments if "rows" not in entry]
+
+
+class _SegmentStats:
+    __slots__ = ("rows", "first_ms", "last_ms", "devices")
+
+    def __init__(self):
+        self.rows = 0
+        self.first_ms = None
+        self.last_ms = None
+        self.devices = {}   # device id -> [rows, first_ms, last_ms]
+
+    def add(self, row):
+        self.rows += 1
+        if len(row) <= DEVICE_TS_COLUMN:
+            return
+        try:
+            ts = parse_millis(row[DEVICE_TS_COLUMN])
+        except ValueError:
+            return
+        device = self.devices.get(row[DEVICE_ID_COLUMN])
+        if device is None:
+            self.devices[row[DEVICE_ID_COLUMN]] = [1, ts, ts]
+        else:
+            device[0] += 1
+            device[1] = min(device[1], ts)
+            device[2] = max(device[2], ts)
+        self.first_ms = ts if self.first_ms is None else min(self.first_ms, ts)
+        self.last_ms = ts if self.last_ms is None else max(self.last_ms, ts)
+
+    def as_fields(self):
+        return {
+            "rows": self.rows, "first_ms": self.first_ms, "last_ms": self.last_ms,
+            "devices": {d: {"rows": n, "first_ms": lo, "last_ms": hi} for d, (n, lo, hi) in self.devices.items()},
+        }
+
+
+def _tee(lines, out):
+    for line in lines:
+        out.write(line)
+        yield line
+
+
+def compress_segment(manifest, entry, compression):
+    """Summarise a closed segment and, unless compression is "none", replace it by its compressed copy."""
+    src = os.path.join(manifest.dir, entry["file"])
+    if not os.path.exists(src):
+        return
+    dst = src + COMPRESSION[compression]
+    stats = _SegmentStats()
+    raw_bytes = os.path.getsize(src)
+    with open(src, newline='', encoding='utf-8') as f:
+        if dst == src:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                stats.add(row)
+        else:
+            tmp = f"{src}.tmp{COMPRESSION[compression]}"   # keeps the suffix _open_text goes by
+            with _open_text(tmp, "wt") as out:
+                reader = csv.reader(_tee(f, out))
+                next(reader, None)
+                for row in reader:
+                    stats.add(row)
+            os.replace(tmp, dst)
+    manifest.update(entry, file=os.path.basename(dst), compression=compression, bytes=raw_bytes,
+                    stored_bytes=os.path.getsize(dst), **stats.as_fields())
+    if dst != src:
+        os.remove(src)
+
+
+class _Compressor:
+    """One daemon thread per process compressing closed segments in roll order."""
+
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, manifest, entry, compression):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="segment-compressor", daemon=True)
+                self.thread.start()
+        self.jobs.put((manifest, entry, compression))
+
+    def drain(self):
+        """Wait for queued segments (shutdown)."""
+        if self.thread is not None:
+            self.jobs.join()
+
+    def _run(self):
+        while True:
+            manifest, entry, compression = self.jobs.get()
+            try:
+                compress_segment(manifest, entry, compression)
+            except Exception as e:
+                print(f"Segment compression failed for {entry['file']}: {e}")
+            finally:
+                self.jobs.task_done()
+
+
+_compressor = _Compressor()
+
+
+class SegmentedWriter:
+    """Append-only CSV at `path` with `headers` that rolls into segments per `policy`."""
+
+    def __init__(self, path, headers, policy=None):
+        self.path = path
+        self.headers = headers
+        self.policy = policy or SegmentPolicy()
+        self.manifest = Manifest(manifest_path(path), path)
+        self.lock = threading.Lock()
+        self._file = None
+        self._writer = None
+        self._roll_at = None
+
+    def open(self):
+        """
+        Start an empty active file. Returns the segment name a non-empty file
+        left by a previous run was rolled into, or None.
+        """
+        with self.lock:
+            self.manifest.load()
+            for entry in self.manifest.pending():
+                _compressor.submit(self.manifest, entry, self.policy.compression)
+            rolled = self._roll() if self._has_rows() else None
+            self._start()
+            return rolled
+
+    def _has_rows(self):
+        try:
+            with open(self.path, newline='', encoding='utf-8') as f:
+                f.readline()
+                return bool(f.readline())
+        except FileNotFoundError:
+            return False
+
+    def _start(self):
+        self._file = open(self.path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.headers)
+        self._file.flush()
+        seconds = self.policy.max_seconds
+        self._roll_at = (time.time() // seconds + 1) * seconds if seconds else None
+
+    def _roll(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+        seq, name = self.manifest.next_name()
+        os.replace(self.path, os.path.join(self.manifest.dir, name))
+        entry = self.manifest.add(seq, name)
+        _compressor.submit(self.manifest, entry, self.policy.compression)
+        return name
+
+    def _roll_due(self):
+        if self._roll_at is not None and time.time() >= self._roll_at:
+            return True
+        return bool(self.policy.max_bytes) and self._file.tell() >= self.policy.max_bytes
+
+    def write_rows(self, rows):
+        with self.lock:
+            if self._file is None:
+                raise ValueError(f"{self.path} is closed")
+            self._writer.writerows(rows)
+            self._file.flush()
+            if self._roll_due():
+                self._roll()
+                self._start()
+
+    def maybe_roll(self):
+        """Roll on a time boundary even when no row arrives to trigger it."""
+        with self.lock:
+            if self._file and self._roll_at is not None and time.time() >= self._roll_at:
+                self._roll()
+                self._start()
+
+    def flush(self):
+        with self.lock:
+            if self._file:
+                self._file.flush()
+
+    def close(self):
+        """Close the active file (it is rolled by the next open()) and finish pending compression."""
+        with self.lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+        _compressor.drain()
+
+
+def _overlaps(entry, device_id, start_ms, end_ms):
+    if "rows" not in entry:
+        return True     # not summarised yet
+    span = entry
+    if device_id is not None:
+        span = entry.get("devices", {}).get(str(device_id))
+        if span is None:
+            return False
+    if span.get("first_ms") is None:
+        return span.get("rows", 0) > 0
+    if start_ms is not None and span["last_ms"] < start_ms:
+        return False
+    if end_ms is not None and span["first_ms"] > end_ms:
+        return False
+    return True
+
+
+def segment_files(path, device_id=None, start_ms=None, end_ms=None):
+    """
+    Files holding `path`'s rows, oldest first: the manifest's segments whose
+    device time range can match the filters, then the active file itself.
+    """
+    manifest = Manifest(manifest_path(path), path).load()
+    files = [os.path.join(manifest.dir, entry["file"]) for entry in manifest.segments
+             if _overlaps(entry, device_id, start_ms, end_ms)]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def iter_lines(path, device_id=None, start_ms=None, end_ms=None):
+    """
+    Stream the CSV lines of every segment of `path` (see segment_files) as one
+    file: the header once, then each segment's rows. Filters only skip whole
+    segments; rows still have to be checked by the caller.
+    """
+    header_sent = False
+    for name in segment_files(path, device_id, start_ms, end_ms):
+        candidates = [name] + [name + ext for ext in COMPRESSION.values() if ext]
+        for candidate in candidates:
+            try:
+                f = _open_text(candidate)
+            except FileNotFoundError:
+                continue     # compressed (and renamed) since the manifest was read
+            with f:
+                header = f.readline()
+                if not header_sent:
+                    header_sent = True
+                    yield header
+                yield from f
+            break
@@ -0,0 +1,122 @@
+import sys
+import threading
+from collections import OrderedDict, deque
+
+# --- Device session table ---
+# Replaces the plain `trackers` dict: slotted tracker records, LRU order,
+# eviction of devices that went silent and a rough memory estimate, so the
+# collector's footprint follows the active fleet rather than its history.
+
+MAX_MISSING_PER_DEVICE = 1024  # older unrecovered seqs are given up on
+
+
+class DeviceTracker:
+    __slots__ = ("highest_seq", "missing_set", "missing_order", "last_seen", "last_data_ts_ms", "unit")
+
+    def __init__(self):
+        self.highest_seq = 0
+        self.missing_set = set()
+        # Missing seqs oldest first, so the cap evicts in O(1). Seqs removed from
+        # missing_set stay here until they reach the front or the deque is compacted.
+        self.missing_order = deque()
+        self.last_seen = 0.0        # wall-clock time of the last accepted packet
+        self.last_data_ts_ms = None  # device timestamp of the last valid DATA packet
+        self.unit = None             # unit announced by the device's INIT
+
+    def add_missing(self, seq):
+        self.missing_set.add(seq)
+        self.missing_order.append(seq)
+        if len(self.missing_set) > MAX_MISSING_PER_DEVICE:
+            while True:
+                oldest = self.missing_order.popleft()
+                if oldest in self.missing_set:
+                    self.missing_set.discard(oldest)
+                    break
+        if len(self.missing_order) > 2 * MAX_MISSING_PER_DEVICE:
+            self.missing_order = deque(s for s in self.missing_order if s in self.missing_set)
+
+    def clear_missing(self):
+        self.missing_set.clear()
+        self.missing_order.clear()
+
+    def size_bytes(self):
+        # The tracker itself, its set and the small ints stored in it.
+        return (sys.getsizeof(self) + sys.getsizeof(self.missing_set)
+                + sys.getsizeof(self.missing_order) + 28 * len(self.missing_set))
+
+
+class SessionTable:
+    """Device id -> DeviceTracker, least recently used first."""
+
+    def __init__(self, max_sessions=4096, on_evict=None):
+        self.max_sessions = max_sessions
+        self.on_evict = on_evict  # called with the device id of every evicted session
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.created_total = 0
+        self.evicted_total = 0
+
+    def __contains__(self, device_id):
+        return device_id in self.sessions
+
+    def __getitem__(self, device_id):
+        return self.sessions[device_id]
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, device_id):
+        """Return the tracker (marking it most recently used) or None."""
+        with self.lock:
+            tracker = self.sessions.get(device_id)
+            if tracker is not None:
+                self.sessions.move_to_end(device_id)
+            return tracker
+
+    def peek(self, device_id):
+        """Return the tracker without touching its LRU position (for background threads)."""
+        return self.sessions.get(device_id)
+
+    def create(self, device_id):
+        """Start a fresh session, evicting the least recently used one if the table is full."""
+        evicted = []
+        with self.lock:
+            tracker = DeviceTracker()
+            self.sessions[device_id] = tracker
+            self.sessions.move_to_end(device_id)
+            self.created_total += 1
+            while len(self.sessions) > self.max_sessions:
+                old_id, _ = self.sessions.popitem(last=False)
+                self.evicted_total += 1
+                evicted.append(old_id)
+        for old_id in evicted:
+            print(f" [-] Session table full, evicted Device {old_id}")
+            if self.on_evict:
+                self.on_evict(old_id)
+        return tracker
+
+    def evict(self, device_id):
+        with self.lock:
+            tracker = self.sessions.pop(device_id, None)
+            if tracker is not None:
+                self.evicted_total += 1
+        if tracker is not None and self.on_evict:
+            self.on_evict(device_id)
+        return tracker
+
+    def items(self):
+        with self.lock:
+            return list(self.sessions.items())
+
+    def values(self):
+        with self.lock:
+            return list(self.sessions.values())
+
+    def stats(self):
+        trackers = self.values()
+        return {
+            "live_sessions": len(trackers),
+            "session_bytes": sys.getsizeof(self.sessions) + sum(t.size_bytes() for t in trackers),
+            "sessions_created_total": self.created_total,
+            "sessions_evicted_total": self.evicted_total,
+        }
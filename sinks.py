@@ -0,0 +1,368 @@
+import base64
+import os
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from protocol import MSG_INIT, MSG_DATA, HEART_BEAT, code_to_unit
+from timefmt import format_seconds, format_millis
+from segments import SegmentedWriter
+
+# --- Storage sinks ---
+# The server pipeline hands every row (a dict with integer epoch-ms times,
+# see udpsrv.handle_packet) to one sink, selected with ECHOP_SINK:
+#   csv     iot_device_data.csv + iot_device_data_reordered.csv (default),
+#           rolled into compressed segments (see segments.py)
+#   binary  iot_device_data.bin + iot_device_data_reordered.bin, fixed headers
+#           plus length-prefixed strings; duplicates of the newest
+#           BIN_DUP_INDEX_SEQS seqs per device are flagged in place
+#   sqlite  iot_device_data.db in WAL mode, batched inserts, indexed
+#           duplicate UPDATEs; readable with sqlite3 while the server runs
+# Each sink implements write(row), mark_duplicate(row of the duplicate) -> rows
+# flagged, write_reordered([(row, dup, gap)]), maybe_flush(), flush(), close().
+
+CSV_HEADERS = [
+    "server_timestamp", "device_id", "unit/batch_count", "sequence_number",
+    "device_timestamp", "message_type", "payload",
+    "client_address", "delay_seconds", "duplicate_flag", "gap_flag",
+    "packet_size", "cpu_time_ms"
+]
+
+# Row-only message type (the wire's msg_type has 2 bits): a SUPPRESSED row is
+# stored just ahead of a DATA packet that follows deadband-suppressed reports.
+# Its payload is their count; the readings held the last reported values.
+MSG_SUPPRESSED = 4
+# Row-only message type: the csv sink appends one per duplicate packet instead of
+# rewriting the stored row. This changed the CSV format: the DATA row keeps
+# duplicate_flag=0 and the DUPLICATE row (duplicate_flag=1, empty unit/batch_count
+# and payload, same device_id and sequence_number) carries the flag; readers fold
+# it back onto the row it duplicates (see replay.load_rows).
+MSG_DUPLICATE = 5
+
+
+def msg_type_name(msg_type):
+    if msg_type == MSG_INIT:
+        return "INIT"
+    if msg_type == MSG_DATA:
+        return "DATA"
+    if msg_type == HEART_BEAT:
+        return "HEARTBEAT"
+    if msg_type == MSG_SUPPRESSED:
+        return "SUPPRESSED"
+    if msg_type == MSG_DUPLICATE:
+        return "DUPLICATE"
+    return f"UNKNOWN({msg_type})"
+
+
+def unit_or_batch(d):
+    """The CSV's unit/batch_count column: unit name for INIT, batch count for DATA."""
+    if d['msg_type'] == MSG_INIT:
+        return code_to_unit(d['batch_count'])
+    return d['batch_count'] if d['msg_type'] == MSG_DATA else ""
+
+
+def payload_text(payload):
+    # DATA payloads arrive decoded; raw bytes are kept readable as Base64.
+    if isinstance(payload, bytes):
+        return base64.b64encode(payload).decode('ascii')
+    return str(payload)
+
+
+def csv_row(d, dup=None, gap=None):
+    return [
+        f" {format_seconds(d['server_ts_ms'])}",
+        str(d['device_id']),
+        unit_or_batch(d),
+        str(d['seq']),
+        f" {format_millis(d['device_ts_ms'])}",
+        msg_type_name(d['msg_type']),
+        payload_text(d['payload']),
+        d['client_address'],
+        str(d['delay_ms'] / 1000),
+        str(d['duplicate_flag'] if dup is None else int(dup)),
+        str(d['gap_flag'] if gap is None else int(gap)),
+        str(d['packet_size']),
+        f"{d['cpu_time_ms']:.4f}",
+    ]
+
+
+class CsvSink:
+    """
+    The original CSV files: one appended row per packet. A duplicate appends a
+    DUPLICATE row (duplicate_flag=1) rather than editing the stored row, which
+    may already sit in a closed, compressed segment. Both files roll into
+    segments under `segments` (a SegmentPolicy).
+    """
+
+    name = "csv"
+
+    def __init__(self, log_dir, segments=None):
+        self.path = os.path.join(log_dir, "iot_device_data.csv")
+        self.reorder_path = os.path.join(log_dir, "iot_device_data_reordered.csv")
+        self._data = SegmentedWriter(self.path, CSV_HEADERS, segments)
+        self._reordered = SegmentedWriter(self.reorder_path, CSV_HEADERS, segments)
+
+    def open(self):
+        """Start both files; returns the segments the previous run's files were rolled into."""
+        return [name for name in (self._data.open(), self._reordered.open()) if name]
+
+    def write(self, d):
+        self._data.write_rows([csv_row(d)])
+
+    def mark_duplicate(self, d):
+        self._data.write_rows([csv_row(dict(d, msg_type=MSG_DUPLICATE, payload="", duplicate_flag=1))])
+        return 1
+
+    def write_reordered(self, items):
+        self._reordered.write_rows([csv_row(d, dup, gap) for d, dup, gap in items])
+
+    def maybe_flush(self):
+        self._data.maybe_roll()
+        self._reordered.maybe_roll()
+
+    def flush(self):
+        self._data.flush()
+        self._reordered.flush()
+
+    def close(self):
+        self._data.close()
+        self._reordered.close()
+
+
+# Binary record: fixed header, then client address and payload as u16-length-prefixed UTF-8.
+BIN_MAGIC = b"ECHOPBN1"
+BIN_RECORD = struct.Struct("<qqqBBHIBBHf")
+BIN_DUP_OFFSET = 8 + 8 + 8 + 1 + 1 + 2 + 4  # offset of duplicate_flag inside a record
+BIN_DUP_INDEX_SEQS = 4096  # per device; covers the NACK window (sessions.MAX_MISSING_PER_DEVICE)
+BIN_FIELDS = ("server_ts_ms", "device_ts_ms", "delay_ms", "device_id", "msg_type",
+              "batch_count", "seq", "duplicate_flag", "gap_flag", "packet_size", "cpu_time_ms")
+
+
+def _pack_str(text):
+    raw = text.encode('utf-8')[:0xFFFF]
+    return struct.pack("<H", len(raw)) + raw
+
+
+def pack_record(d, dup=None, gap=None):
+    head = BIN_RECORD.pack(
+        d['server_ts_ms'], d['device_ts_ms'], d['delay_ms'], d['device_id'], d['msg_type'],
+        d['batch_count'], d['seq'],
+        d['duplicate_flag'] if dup is None else int(dup),
+        d['gap_flag'] if gap is None else int(gap),
+        d['packet_size'], d['cpu_time_ms'],
+    )
+    return head + _pack_str(d['client_address']) + _pack_str(payload_text(d['payload']))
+
+
+def iter_binary(path):
+    """Yield row dicts (same keys as the pipeline's) from a binary sink file."""
+    with open(path, 'rb') as f:
+        if f.read(len(BIN_MAGIC)) != BIN_MAGIC:
+            raise ValueError(f"{path}: not an ECHOP binary log")
+        while True:
+            head = f.read(BIN_RECORD.size)
+            if len(head) < BIN_RECORD.size:
+                return
+            d = dict(zip(BIN_FIELDS, BIN_RECORD.unpack(head)))
+            for key in ("client_address", "payload"):
+                (n,) = struct.unpack("<H", f.read(2))
+                d[key] = f.read(n).decode('utf-8')
+            yield d
+
+
+class BinarySink:
+    name = "binary"
+
+    def __init__(self, log_dir):
+        self.path = os.path.join(log_dir, "iot_device_data.bin")
+        self.reorder_path = os.path.join(log_dir, "iot_device_data_reordered.bin")
+        self._file = None
+        self._reorder_file = None
+        self.offsets = {}  # device_id -> OrderedDict(seq -> record offsets), newest seqs last
+
+    def open(self):
+        self._file = open(self.path, 'wb')
+        self._file.write(BIN_MAGIC)
+        self._reorder_file = open(self.reorder_path, 'wb')
+        self._reorder_file.write(BIN_MAGIC)
+        self.offsets.clear()
+
+    def write(self, d):
+        index = self.offsets.get(d['device_id'])
+        if index is None:
+            index = self.offsets[d['device_id']] = OrderedDict()
+        offsets = index.get(d['seq'])
+        if offsets is None:
+            index[d['seq']] = [self._file.tell()]
+            if len(index) > BIN_DUP_INDEX_SEQS:
+                index.popitem(last=False)
+        else:
+            offsets.append(self._file.tell())
+        self._file.write(pack_record(d))
+
+    def mark_duplicate(self, d):
+        offsets = self.offsets.get(d['device_id'], {}).get(d['seq'], ())
+        if offsets:
+            self._file.flush()
+            for offset in offsets:
+                os.pwrite(self._file.fileno(), b"\x01", offset + BIN_DUP_OFFSET)
+        return len(offsets)
+
+    def write_reordered(self, items):
+        for d, dup, gap in items:
+            self._reorder_file.write(pack_record(d, dup, gap))
+
+    def maybe_flush(self):
+        self.flush()
+
+    def flush(self):
+        for f in (self._file, self._reorder_file):
+            if f:
+                f.flush()
+
+    def close(self):
+        for f in (self._file, self._reorder_file):
+            if f:
+                f.close()
+        self._file = self._reorder_file = None
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY,
+    server_ts_ms INTEGER NOT NULL,
+    device_id INTEGER NOT NULL,
+    unit TEXT,
+    batch_count INTEGER,
+    seq INTEGER NOT NULL,
+    device_ts_ms INTEGER NOT NULL,
+    message_type TEXT NOT NULL,
+    payload TEXT,
+    client_address TEXT,
+    delay_ms INTEGER,
+    duplicate_flag INTEGER NOT NULL DEFAULT 0,
+    gap_flag INTEGER NOT NULL DEFAULT 0,
+    packet_size INTEGER,
+    cpu_time_ms REAL
+);
+CREATE INDEX IF NOT EXISTS {table}_device_seq ON {table} (device_id, seq);
+CREATE INDEX IF NOT EXISTS {table}_device_ts ON {table} (device_id, device_ts_ms);
+"""
+SQLITE_COLUMNS = ("server_ts_ms", "device_id", "unit", "batch_count", "seq", "device_ts_ms",
+                  "message_type", "payload", "client_address", "delay_ms", "duplicate_flag",
+                  "gap_flag", "packet_size", "cpu_time_ms")
+
+
+def sqlite_row(d, dup=None, gap=None):
+    is_init = d['msg_type'] == MSG_INIT
+    return (
+        d['server_ts_ms'], d['device_id'],
+        code_to_unit(d['batch_count']) if is_init else None,
+        None if is_init else d['batch_count'],
+        d['seq'], d['device_ts_ms'], msg_type_name(d['msg_type']),
+        payload_text(d['payload']), d['client_address'], d['delay_ms'],
+        d['duplicate_flag'] if dup is None else int(dup),
+        d['gap_flag'] if gap is None else int(gap),
+        d['packet_size'], d['cpu_time_ms'],
+    )
+
+
+class SqliteSink:
+    """
+    Rows are buffered and inserted with executemany() in one transaction per
+    batch (batch_size rows or flush_seconds, whichever comes first).
+    """
+
+    name = "sqlite"
+
+    def __init__(self, log_dir, batch_size=256, flush_seconds=0.5):
+        self.path = os.path.join(log_dir, "iot_device_data.db")
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self.conn = None
+        self.pending = []
+        self.pending_reordered = []
+        self.first_pending = None
+        placeholders = ", ".join("?" for _ in SQLITE_COLUMNS)
+        columns = ", ".join(SQLITE_COLUMNS)
+        self.insert_sql = f"INSERT INTO readings ({columns}) VALUES ({placeholders})"
+        self.insert_reordered_sql = f"INSERT INTO readings_reordered ({columns}) VALUES ({placeholders})"
+
+    def open(self):
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(self.path + suffix)
+            except FileNotFoundError:
+                pass
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQLITE_SCHEMA.format(table="readings")
+                                + SQLITE_SCHEMA.format(table="readings_reordered"))
+
+    def write(self, d):
+        with self.lock:
+            if not self.pending:
+                self.first_pending = time.monotonic()
+            self.pending.append(sqlite_row(d))
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+
+    def mark_duplicate(self, d):
+        with self.lock:
+            self._flush()
+            cur = self.conn.execute(
+                "UPDATE readings SET duplicate_flag = 1 WHERE device_id = ? AND seq = ?", (d['device_id'], d['seq']))
+            return cur.rowcount
+
+    def write_reordered(self, items):
+        with self.lock:
+            if not (self.pending or self.pending_reordered):
+                self.first_pending = time.monotonic()
+            self.pending_reordered.extend(sqlite_row(d, dup, gap) for d, dup, gap in items)
+
+    def maybe_flush(self):
+        with self.lock:
+            if self.first_pending is not None and time.monotonic() - self.first_pending >= self.flush_seconds:
+                self._flush()
+
+    def _flush(self):
+        if not (self.pending or self.pending_reordered):
+            return
+        with self.conn:
+            self.conn.execute("BEGIN")
+            if self.pending:
+                self.conn.executemany(self.insert_sql, self.pending)
+            if self.pending_reordered:
+                self.conn.executemany(self.insert_reordered_sql, self.pending_reordered)
+        self.pending.clear()
+        self.pending_reordered.clear()
+        self.first_pending = None
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            if self.conn is None:
+                return
+            self._flush()
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.conn.close()
+            self.conn = None
+
+
+SINKS = {"csv": CsvSink, "binary": BinarySink, "sqlite": SqliteSink}
+
+
+def make_sink(kind, log_dir, segments=None):
+    """`segments` (a segments.SegmentPolicy) applies to the csv sink; the others keep one file."""
+    try:
+        sink = SINKS[kind]
+    except KeyError:
+        raise ValueError(f"unknown sink {kind!r} (expected one of {', '.join(SINKS)})") from None
+    return sink(log_dir, segments) if sink is CsvSink else sink(log_dir)
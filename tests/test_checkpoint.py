@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+import unittest
+
+from checkpoint import SessionCheckpoint
+from sessions import SessionTable
+
+
+class CheckpointLoadTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "sessions.ckpt")
+        self.checkpoint = SessionCheckpoint(self.path)
+        self.trackers = SessionTable()
+
+    def tearDown(self):
+        self.checkpoint.close()
+        self.dir.cleanup()
+
+    def track(self, device_id, highest_seq, missing=()):
+        tracker = self.trackers.get(device_id) or self.trackers.create(device_id)
+        tracker.highest_seq = highest_seq
+        for seq in missing:
+            tracker.add_missing(seq)
+        return tracker
+
+    def test_replays_snapshot_prev_journal_and_journal(self):
+        self.track(1, 5, missing=[3])
+        self.checkpoint.snapshot(self.trackers)
+        # Changes after the snapshot, then a journal switch whose snapshot never
+        # landed (the server stopped mid-snapshot): they sit in <journal>.prev.
+        tracker = self.track(1, 9, missing=[7])
+        self.checkpoint.record(1, tracker, added=[7])
+        with self.checkpoint.lock:
+            self.checkpoint._rotate_journal()
+        tracker.missing_set.discard(3)
+        self.checkpoint.record(1, tracker, removed=[3])
+        self.checkpoint.record(2, self.track(2, 4, missing=[2]), added=[2])
+        self.checkpoint.flush()
+        self.assertTrue(os.path.exists(self.checkpoint.prev_journal_path))
+
+        sessions = SessionCheckpoint(self.path).load()
+        self.assertEqual(sessions[1]["h"], 9)
+        self.assertEqual(sessions[1]["m"], {7})
+        self.assertEqual(sessions[2]["h"], 4)
+        self.assertEqual(sessions[2]["m"], {2})
+
+    def test_skips_torn_last_journal_line(self):
+        self.track(1, 5)
+        self.checkpoint.snapshot(self.trackers)
+        self.checkpoint.record(1, self.track(1, 6))
+        self.checkpoint.flush()
+        with open(self.checkpoint.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"d": 1, "h": 7})[:-4])   # crash mid-write
+        self.assertEqual(SessionCheckpoint(self.path).load()[1]["h"], 6)
+
+    def test_eviction_and_init_entries(self):
+        self.checkpoint.record(1, self.track(1, 8, missing=[4]), added=[4])
+        self.checkpoint.record(2, self.track(2, 3))
+        self.checkpoint.record_eviction(2)
+        self.checkpoint.record(1, self.track(1, 1), reset=True)
+        self.checkpoint.flush()
+        sessions = SessionCheckpoint(self.path).load()
+        self.assertEqual(set(sessions), {1})
+        self.assertEqual(sessions[1]["h"], 1)
+        self.assertEqual(sessions[1]["m"], set())
+
+    def test_ignores_checkpoint_older_than_max_age(self):
+        self.track(1, 5)
+        self.checkpoint.snapshot(self.trackers)
+        self.assertEqual(set(SessionCheckpoint(self.path).load(max_age=30)), {1})
+        old = os.path.getmtime(self.path) - 60
+        for path in (self.path, self.checkpoint.journal_path):
+            os.utime(path, (old, old))
+        self.assertEqual(SessionCheckpoint(self.path).load(max_age=30), {})
+        self.assertEqual(set(SessionCheckpoint(self.path).load()), {1})
+
+
+if __name__ == "__main__":
+    unittest.main()
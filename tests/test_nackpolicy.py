@@ -0,0 +1,75 @@
+import unittest
+
+from nackpolicy import MAX_PENDING_GAPS, NackPolicy, TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_refill(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        for _ in range(2):
+            self.assertTrue(bucket.available(0.0))
+            bucket.take()
+        self.assertFalse(bucket.available(0.0))
+        self.assertAlmostEqual(bucket.wait_time(0.0), 0.1)
+        self.assertTrue(bucket.available(0.1))
+
+
+class NackPacingTest(unittest.TestCase):
+    def test_deferral_is_counted_once_per_nack(self):
+        policy = NackPolicy(device_rate=1, device_burst=1)
+        self.assertEqual(policy.admit(1, 5, 0.0), 0.0)
+        wait = policy.admit(1, 6, 0.0)
+        self.assertGreater(wait, 0.0)
+        self.assertGreater(policy.admit(1, 6, 0.5), 0.0)   # re-check of the same NACK
+        self.assertEqual(policy.deferred_total, 1)
+        self.assertEqual(policy.admit(1, 6, wait), 0.0)
+        self.assertEqual(policy.sent_total, 2)
+
+    def test_global_bucket_defers_across_devices(self):
+        policy = NackPolicy(global_rate=1, global_burst=1)
+        self.assertEqual(policy.admit(1, 5, 0.0), 0.0)
+        self.assertGreater(policy.admit(2, 5, 0.0), 0.0)
+
+
+class HoldoffTest(unittest.TestCase):
+    def test_initial_until_measured(self):
+        policy = NackPolicy(initial_holdoff=1.0)
+        self.assertEqual(policy.holdoff(1), 1.0)
+
+    def test_clamped_to_min_on_a_clean_link(self):
+        policy = NackPolicy(min_holdoff=0.05, max_holdoff=2.0)
+        for _ in range(20):
+            policy.on_delay(1, 0.010)
+        self.assertEqual(policy.holdoff(1), 0.05)
+
+    def test_clamped_to_max_on_a_jittery_link(self):
+        policy = NackPolicy(min_holdoff=0.05, max_holdoff=2.0)
+        for delay in (0.0, 5.0) * 10:
+            policy.on_delay(1, delay)
+        self.assertEqual(policy.holdoff(1), 2.0)
+
+    def test_reorder_lateness_raises_holdoff(self):
+        policy = NackPolicy(min_holdoff=0.05, max_holdoff=2.0)
+        policy.on_delay(1, 0.010)
+        policy.on_gap(1, [7], now=10.0)
+        policy.on_recovered(1, 7, now=10.4)   # never NACKed: reordered, 0.4 s late
+        self.assertEqual(policy.reordered_total, 1)
+        self.assertAlmostEqual(policy.holdoff(1), 0.6)
+
+
+class NackedBoundTest(unittest.TestCase):
+    def test_nacked_seqs_are_capped(self):
+        policy = NackPolicy()
+        for seq in range(MAX_PENDING_GAPS + 10):
+            policy.on_sent(1, seq)
+        nacked = policy.devices[1].nacked
+        self.assertEqual(len(nacked), MAX_PENDING_GAPS)
+        self.assertNotIn(0, nacked)
+        # A seq that aged out is a reorder sample again when it turns up
+        policy.on_gap(1, [0], now=1.0)
+        policy.on_recovered(1, 0, now=1.2)
+        self.assertEqual(policy.reordered_total, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
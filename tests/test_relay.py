@@ -0,0 +1,40 @@
+import unittest
+
+from protocol import HEARTBEAT_TIMEOUT_SECONDS, MSG_DATA, MSG_INIT, build_checksum_header
+from relay import Relay
+
+
+def packet(device_id, seq, msg_type=MSG_DATA, payload=b"x"):
+    return build_checksum_header(device_id=device_id, batch_count=1, seq_num=seq,
+                                 msg_type=msg_type, payload=payload) + payload
+
+
+class RelayIdleDeviceTest(unittest.TestCase):
+    def setUp(self):
+        self.relay = Relay(("127.0.0.1", 0), ("127.0.0.1", 9))
+        self.addr = ("127.0.0.1", 40000)
+
+    def tearDown(self):
+        self.relay.down.close()
+        self.relay.up.close()
+
+    def test_silent_device_is_dropped_with_its_cache(self):
+        self.relay.on_device_packet(packet(1, 1, MSG_INIT), self.addr, 100.0)
+        self.relay.on_device_packet(packet(1, 2), self.addr, 100.0)
+        self.relay.on_device_packet(packet(2, 1, MSG_INIT), self.addr, 100.0 + HEARTBEAT_TIMEOUT_SECONDS)
+        self.assertEqual(len(self.relay.devices[1].forwarded), 2)
+        self.relay.expire_idle(100.0 + HEARTBEAT_TIMEOUT_SECONDS)
+        self.assertEqual(set(self.relay.devices), {2})
+        self.assertEqual(self.relay.stats["expired_devices"], 1)
+
+    def test_returning_device_starts_fresh(self):
+        self.relay.on_device_packet(packet(1, 1, MSG_INIT), self.addr, 100.0)
+        self.relay.expire_idle(100.0 + HEARTBEAT_TIMEOUT_SECONDS)
+        self.relay.on_device_packet(packet(1, 7), self.addr, 200.0)
+        state = self.relay.devices[1]
+        self.assertEqual(state.highest_seq, 7)
+        self.assertEqual(state.missing, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
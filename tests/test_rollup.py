@@ -0,0 +1,74 @@
+import csv
+import os
+import tempfile
+import unittest
+
+from rollup import RollupWindows
+
+
+class RollupLateReadingTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "rollups.csv")
+        self.rollups = RollupWindows(self.path, windows=(10,), grace_seconds=5)
+        self.rollups.open()
+
+    def tearDown(self):
+        self.rollups.close()
+        self.dir.cleanup()
+
+    def add(self, ts_ms, value=1.0):
+        self.rollups.add(1, "celsius", ts_ms, [value], arrival_ms=ts_ms)
+
+    def rows(self):
+        self.rollups.close()
+        with open(self.path, newline="", encoding="utf-8") as f:
+            return list(csv.DictReader(f))
+
+    def test_reading_after_window_closed_is_late(self):
+        self.add(1000)
+        self.add(2000)
+        self.add(16000)   # past window 0's end plus grace: closes it
+        self.add(3000)    # NACK retransmission for window 0, too late
+        self.assertEqual(self.rollups.late_total, 1)
+        rows = [r for r in self.rows() if r["window_start_ms"] == "0"]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["count"], "2")
+        self.assertEqual(rows[0]["partial"], "0")
+
+    def test_reading_after_expire_is_late(self):
+        self.add(1000)
+        self.rollups.expire(20000)   # device went quiet; window 0 closed by the server clock
+        self.add(4000)
+        self.assertEqual(self.rollups.late_total, 1)
+        self.assertEqual(self.rollups.open_windows(), 0)
+        self.assertEqual([r["window_start_ms"] for r in self.rows()], ["0"])
+
+    def test_reading_within_grace_is_counted(self):
+        self.add(1000)
+        self.add(12000)   # next window opens, window 0 still within grace
+        self.add(3000)
+        self.assertEqual(self.rollups.late_total, 0)
+        counts = {r["window_start_ms"]: r["count"] for r in self.rows()}
+        self.assertEqual(counts, {"0": "2", "10000": "1"})
+
+    def test_idle_series_is_dropped_after_a_further_window(self):
+        self.add(1000)
+        self.rollups.expire(15000)   # window 0 closes, the series stays for late readings
+        self.assertIn((1, "celsius"), self.rollups.series)
+        self.rollups.expire(24999)
+        self.assertIn((1, "celsius"), self.rollups.series)
+        self.rollups.expire(25000)   # idle for the longest window plus grace past its end
+        self.assertEqual(self.rollups.series, {})
+        self.assertEqual([r["window_start_ms"] for r in self.rows()], ["0"])
+
+    def test_series_with_open_window_is_kept(self):
+        self.add(1000)
+        self.add(30000, value=2.0)
+        self.rollups.expire(31000)
+        self.assertIn((1, "celsius"), self.rollups.series)
+        self.assertEqual(self.rollups.open_windows(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
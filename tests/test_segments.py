@@ -0,0 +1,91 @@
+import csv
+import os
+import tempfile
+import unittest
+
+from segments import Manifest, SegmentPolicy, SegmentedWriter, iter_lines, manifest_path
+from timefmt import format_millis
+
+HEADERS = ["server_timestamp", "device_id", "unit/batch_count", "sequence_number", "device_timestamp"]
+T0 = 1_700_000_000_000
+
+
+def row(device_id, seq):
+    return ["", str(device_id), "1", str(seq), f" {format_millis(T0 + seq * 1000)}"]
+
+
+class SegmentedWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "data.csv")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def writer(self, **policy):
+        writer = SegmentedWriter(self.path, HEADERS, SegmentPolicy(**policy))
+        writer.open()
+        return writer
+
+    def segments(self):
+        return Manifest(manifest_path(self.path), self.path).load().segments
+
+    def seqs(self, **filters):
+        return [int(r["sequence_number"]) for r in csv.DictReader(iter_lines(self.path, **filters))]
+
+    def test_rolls_at_max_bytes(self):
+        writer = self.writer(max_bytes=200, compression="none")
+        for seq in range(1, 11):
+            writer.write_rows([row(1, seq)])
+        writer.close()
+        segments = self.segments()
+        self.assertGreater(len(segments), 1)
+        self.assertEqual([s["file"] for s in segments[:2]], ["data.000001.csv", "data.000002.csv"])
+        self.assertTrue(all(s["bytes"] >= 200 for s in segments))
+        with open(self.path, newline="", encoding="utf-8") as f:
+            active_rows = len(list(csv.reader(f))) - 1
+        self.assertEqual(sum(s["rows"] for s in segments) + active_rows, 10)
+        self.assertEqual(self.seqs(), list(range(1, 11)))
+
+    def test_write_after_close_raises(self):
+        writer = self.writer()
+        writer.write_rows([row(1, 1)])
+        writer.close()
+        with self.assertRaises(ValueError):
+            writer.write_rows([row(1, 2)])
+
+    def test_reopen_rolls_previous_file(self):
+        writer = self.writer(compression="none")
+        writer.write_rows([row(1, 1), row(1, 2)])
+        writer.close()
+        self.assertEqual(self.segments(), [])
+        writer = self.writer(compression="none")
+        writer.write_rows([row(1, 3)])
+        writer.close()
+        self.assertEqual([(s["file"], s["rows"]) for s in self.segments()], [("data.000001.csv", 2)])
+        self.assertEqual(self.seqs(), [1, 2, 3])
+
+    def test_iter_lines_across_gzip_and_lzma_segments(self):
+        writer = self.writer(max_bytes=150, compression="gzip")
+        for seq in range(1, 5):
+            writer.write_rows([row(1, seq)])
+        writer.close()
+        writer = self.writer(max_bytes=150, compression="lzma")
+        for seq in range(5, 9):
+            writer.write_rows([row(2, seq)])
+        writer.close()
+        files = [s["file"] for s in self.segments()]
+        self.assertTrue(any(f.endswith(".csv.gz") for f in files))
+        self.assertTrue(any(f.endswith(".csv.xz") for f in files))
+        self.assertFalse(any(f.endswith(".csv") for f in files))
+        lines = list(iter_lines(self.path))
+        self.assertEqual(sum(1 for line in lines if line.startswith("server_timestamp")), 1)
+        self.assertEqual(self.seqs(), list(range(1, 9)))
+        # Segments without rows of the device (or time range) are skipped.
+        self.assertEqual([s for s in self.seqs(device_id=2) if s < 5], [])
+        self.assertEqual(self.seqs(device_id=1)[:4], [1, 2, 3, 4])
+        self.assertNotIn(1, self.seqs(start_ms=T0 + 5000))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import functools
+import time
+
+# --- Deferred timestamp formatting ---
+# The server pipeline carries integer epoch milliseconds; text is only
+# produced when a row is written. strftime/localtime run at most once per
+# distinct second, the millisecond suffix is plain integer formatting.
+
+
+class SecondFormatter:
+    """Formats epoch seconds with `fmt` in local time, caching recent seconds."""
+
+    def __init__(self, fmt, max_entries=256):
+        self.fmt = fmt
+        self.max_entries = max_entries
+        self.cache = {}
+
+    def __call__(self, epoch_s):
+        text = self.cache.get(epoch_s)
+        if text is None:
+            if len(self.cache) >= self.max_entries:
+                self.cache.clear()
+            text = time.strftime(self.fmt, time.localtime(epoch_s))
+            self.cache[epoch_s] = text
+        return text
+
+
+_csv_seconds = SecondFormatter('%d/%m/%Y %H:%M:%S')
+_iso_seconds = SecondFormatter('%Y-%m-%d %H:%M:%S')
+
+
+def now_ms():
+    return time.time_ns() // 1_000_000
+
+
+def format_seconds(ms):
+    """'19/10/2026 00:56:33' style (CSV server_timestamp, second precision)."""
+    return _csv_seconds(ms // 1000)
+
+
+def format_millis(ms):
+    """'19/10/2026 00:56:33.864' style (CSV device_timestamp)."""
+    seconds, millis = divmod(ms, 1000)
+    return f"{_csv_seconds(seconds)}.{millis:03d}"
+
+
+def format_iso_seconds(ms):
+    """'2026-10-19 00:56:33' style (metrics.csv finished_at)."""
+    return _iso_seconds(ms // 1000)
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_seconds(text):
+    return int(time.mktime(time.strptime(text, '%d/%m/%Y %H:%M:%S')))
+
+
+def parse_millis(text):
+    """Inverse of format_millis: ' 19/10/2026 00:56:33.864' -> epoch ms (local time)."""
+    seconds, _, millis = text.strip().partition(".")
+    return _parse_seconds(seconds) * 1000 + int(millis or 0)
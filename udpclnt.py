@@ -6,20 +6,27 @@ import sys
 import struct
 import random
 from protocol import *
+from datasource import open_data_source, EncodedChunkCache
+from fec import FecEncoder
+from reporting import DeadbandPolicy, parse_deadband, deadband_for, DEFAULT_MAX_SILENCE
+from profiling import install_from_env
 
 SERVER_PORT = 12001
 DEFAULT_INTERVAL_DURATION = 20
 DEFAULT_INTERVALS = [1, 5, 30]
 
 if len(sys.argv) < 2:
-    print("Usage: python udpclnt.py <device_id> [interval_duration] [intervals_csv]")
+    print("Usage: python udpclnt.py <device_id>[,<device_id>...] [interval_duration] [intervals_csv]")
     sys.exit(1)
 
+# Several comma-separated ids run one sensor each behind this client; they share
+# its socket and are reported alive together in one heartbeat bitmap.
 try:
-    MY_DEVICE_ID = int(sys.argv[1])
+    MY_DEVICE_IDS = list(dict.fromkeys(int(x) for x in sys.argv[1].split(",")))
 except ValueError:
-    print("device_id must be an integer")
+    print("device_id must be an integer (or a comma-separated list of them)")
     sys.exit(1)
+MY_DEVICE_ID = MY_DEVICE_IDS[0]
 
 if len(sys.argv) > 2:
     try:
@@ -37,7 +44,9 @@ if len(sys.argv) > 3:
 else:
     intervals = DEFAULT_INTERVALS
 
-SERVER_ADDR = ('localhost', SERVER_PORT)
+# ECHOP_SERVER=host:port points the client at another collector or an edge relay (relay.py)
+_server_host, _, _server_port = os.environ.get("ECHOP_SERVER", f"localhost:{SERVER_PORT}").rpartition(":")
+SERVER_ADDR = (_server_host or 'localhost', int(_server_port))
 client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
 running = True
@@ -59,11 +68,18 @@ def load_device_config(path):
                 did = int(parts[0])
             except ValueError: continue
             unit = parts[1]
-            batch_file = parts[2]
+            batch_file = ",".join(parts[2:])  # synthetic specs carry their own commas
             config[did] = (unit, batch_file)
     return config
 
 device_config = load_device_config(CONFIG_FILE)
+# Encoded chunks kept per device (0 disables the cache)
+PAYLOAD_CACHE_ENTRIES = int(os.environ.get("ECHOP_PAYLOAD_CACHE", "4096"))
+# One XOR parity packet per FEC_K DATA packets (0 disables FEC, max 15; see fec.py)
+FEC_K = int(os.environ.get("ECHOP_FEC_K", "0"))
+# Send-on-delta: per-unit deadband and the longest a flat sensor stays quiet (see reporting.py)
+DEADBANDS = parse_deadband(os.environ.get("ECHOP_DEADBAND", ""))
+MAX_SILENCE = float(os.environ.get("ECHOP_MAX_SILENCE", str(DEFAULT_MAX_SILENCE)))
 
 def compress_data(values):
     compressed_values = []
@@ -78,14 +94,29 @@ def compress_data(values):
             flag_batches.append(i)
     return compressed_values, flag_batches
 
+def encode_chunk(values):
+    compressed_data, flag_batches = compress_data(values)
+    return encode_smart_payload(compressed_data, flag_batches)
+
 def send_heartbeat():
+    """
+    One heartbeat per period carrying a liveness bitmap for every sensor.
+    A random phase offset and per-period jitter keep clients that were started
+    together from heartbeating in lockstep.
+    """
     global running
+    time.sleep(random.uniform(0, HEARTBEAT_INTERVAL_SECONDS))
     while running:
-        time.sleep(10)
-        for sensor in sensors:
-            header = build_checksum_header(device_id=sensor['device_id'], batch_count=0, seq_num=0, msg_type=HEART_BEAT)
-            client_socket.sendto(header, SERVER_ADDR)
-            print(f"Sent HEARTBEAT for Device {sensor['device_id']}")
+        if sensors:
+            device_ids = [sensor['device_id'] for sensor in sensors]
+            bitmap = encode_liveness_bitmap(device_ids)
+            header = build_checksum_header(device_id=device_ids[0], batch_count=len(device_ids) & 0x0F, seq_num=0, msg_type=HEART_BEAT, payload=bitmap)
+            client_socket.sendto(header + bitmap, SERVER_ADDR)
+            held = sum(sensor['reporting'].suppressed for sensor in sensors if sensor['reporting'])
+            print(f"Sent HEARTBEAT for Device {', '.join(str(d) for d in device_ids)}"
+                  + (f" ({held} reports held under deadband)" if held else ""))
+        jitter = random.uniform(-HEARTBEAT_JITTER, HEARTBEAT_JITTER) * HEARTBEAT_INTERVAL_SECONDS
+        time.sleep(HEARTBEAT_INTERVAL_SECONDS + jitter)
 
 def receive_nacks():
     global running
@@ -125,9 +156,9 @@ def receive_nacks():
                 else:
                     print(f" [x] Cannot retransmit seq={missing_seq}")
 
-                if missing_seq == 1 and sensors and sensors[0]["device_id"] == nack_device_id:
+                sensor = next((s for s in sensors if s["device_id"] == nack_device_id), None)
+                if missing_seq == 1 and sensor is not None:
                     print(f" [^] Server requested re-INIT for Device {nack_device_id}.")
-                    sensor = sensors[0]
                     init_header = build_checksum_header(
                         device_id=sensor["device_id"],
                         batch_count=sensor["unit_code"],
@@ -137,7 +168,12 @@ def receive_nacks():
                     client_socket.sendto(init_header, SERVER_ADDR)
                     sensor["seq_num"] = 2
                     sensor["stream_index"] = 0 # RESET STREAM INDEX
-                    sent_history.clear()
+                    if sensor["fec"]:
+                        sensor["fec"].reset()
+                    if sensor["reporting"]:
+                        sensor["reporting"].reset()
+                    for key in [k for k in sent_history if k[0] == nack_device_id]:
+                        del sent_history[key]
                     sent_history[(sensor["device_id"], 1)] = init_header
                     print(f" [>>] Sent re-INIT (seq=1)")
 
@@ -151,111 +187,137 @@ def receive_nacks():
 
 threading.Thread(target=receive_nacks, daemon=True).start()
 
-# --- NEW: LOAD ALL DATA INTO ONE BIG LIST ---
-def load_all_data(batch_file):
-    if not os.path.exists(batch_file):
-        return []
-
-    all_data = []
-    with open(batch_file, "r") as f:
-        for raw in f:
-            line = raw.strip()
-            if not line or line.startswith("#"): continue
-            tokens = [t.strip() for t in line.split(",") if t.strip()]
-            for t in tokens:
-                try:
-                    all_data.append(float(t))
-                except:
-                    pass
-    return all_data
-
-if MY_DEVICE_ID not in device_config:
-    print(f"this id is not configured: {MY_DEVICE_ID}")
-    running = False
-else:
-    unit, batch_filename = device_config[MY_DEVICE_ID]
-    unit_code = unit_to_code(unit)
-    # Load everything into a flat list
-    full_data_stream = load_all_data(batch_filename)
-
-    if not full_data_stream:
-        print(f"No valid data found in {batch_filename} for device {MY_DEVICE_ID}")
-        running = False
+# SIGUSR1 profiles the send loop, SIGUSR2 samples every thread (see profiling.py)
+profiler = install_from_env("logs", f"udpclnt-dev{'-'.join(str(d) for d in MY_DEVICE_IDS)}", watches={
+    "sent_history": lambda: len(sent_history),
+    "payload_cache": lambda: sum(len(s["payloads"].entries) for s in sensors),
+})
 
-if running:
-    sensors.clear()
-    sensor = {
-        "device_id": MY_DEVICE_ID,
+# --- Data source: mmapped float64 cache (default), lazy text reader or synthetic ---
+# ECHOP_DATA_SOURCE=text reads the batch file directly; a batch_file entry of
+# "synthetic:sine,base=20,amp=5" generates readings instead (see datasource.py).
+def load_data_source(batch_file):
+    try:
+        return open_data_source(batch_file)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Cannot open data source: {e}")
+        return None
+
+def make_sensor(device_id):
+    """The send state of one configured device, or None if it cannot run."""
+    if device_id not in device_config:
+        print(f"this id is not configured: {device_id}")
+        return None
+    unit, batch_filename = device_config[device_id]
+    data_source = load_data_source(batch_filename)
+    if data_source is None:
+        print(f"No valid data found in {batch_filename} for device {device_id}")
+        return None
+    deadband = deadband_for(unit, DEADBANDS)
+    return {
+        "device_id": device_id,
         "unit": unit,
-        "unit_code": unit_code,
-        "data": full_data_stream, # The flat list
-        "stream_index": 0,         # Points to current position in list
+        "unit_code": unit_to_code(unit),
+        "data": data_source,
+        "stream_index": 0,         # Points to current position in the stream
+        "payloads": EncodedChunkCache(data_source, encode_chunk, PAYLOAD_CACHE_ENTRIES),
+        "fec": FecEncoder(device_id, FEC_K) if FEC_K > 0 else None,
+        "reporting": DeadbandPolicy(*deadband, max_silence=MAX_SILENCE) if deadband else None,
         "seq_num": 1
     }
-    sensors.append(sensor)
-
-    # Send INIT 
-    init_packet = build_checksum_header(
-        device_id=sensor["device_id"],
-        batch_count=sensor["unit_code"],
-        seq_num=sensor["seq_num"],
-        msg_type=MSG_INIT
-    )
-    client_socket.sendto(init_packet, SERVER_ADDR)
-    sent_history[(sensor["device_id"], sensor["seq_num"])] = init_packet
-    print(f"Sent INIT (Device={sensor['device_id']}, seq={sensor['seq_num']})")
-    sensor["seq_num"] += 1
+
+def send_chunk(sensor, loop_start):
+    """Send the sensor's next chunk of readings (unless its deadband holds it back)."""
+    # --- GRAB NEXT 10 NUMBERS ---
+    chunk_size = 10
+    current_idx = sensor["stream_index"]
+
+    # --- DEADBAND: hold back readings that did not move (no seq is used) ---
+    reporting = sensor["reporting"]
+    send = True
+    suppressed = 0
+    values = None
+    if reporting:
+        values = sensor["data"].read(current_idx, chunk_size)
+        send = reporting.should_send(values, loop_start)
+        if send:
+            suppressed = min(reporting.sent(values, loop_start), 0xFFFF)
+        else:
+            print(f"Suppressed DATA (ID={sensor['device_id']}, within deadband, "
+                  f"{reporting.suppressed} since seq={sensor['seq_num'] - 1})")
+
+    if send:
+        # Smart wrapping: if we hit the end, wrap around immediately to fill the packet.
+        # The encoded chunk comes from the cache once the stream has wrapped.
+        batch_count, raw_payload = sensor["payloads"].get(current_idx, chunk_size, values)
+        flags = 0
+        if suppressed:
+            flags = FLAG_SUPPRESSED
+            raw_payload = SUPPRESSED_PREFIX.pack(suppressed) + raw_payload
+
+        # --- PREPARE PACKET ---
+        payload = encrypt_bytes(raw_payload, sensor["device_id"], sensor["seq_num"])
+
+        header = build_checksum_header(
+            device_id=sensor["device_id"],
+            batch_count=batch_count,
+            seq_num=sensor["seq_num"],
+            msg_type=MSG_DATA,
+            payload=payload,
+            flags=flags
+        )
+
+        packet = header + payload
+        sent_history[(sensor["device_id"], sensor["seq_num"])] = packet
+
+        client_socket.sendto(packet, SERVER_ADDR)
+        print(f"Sent DATA (ID={sensor['device_id']}, seq={sensor['seq_num']}, count={batch_count})")
+
+        if sensor["fec"]:
+            parity = sensor["fec"].add(sensor["seq_num"], packet)
+            if parity:
+                client_socket.sendto(parity, SERVER_ADDR)
+                print(f"Sent FEC parity (ID={sensor['device_id']}, block ending seq={sensor['seq_num']})")
+
+        sensor["seq_num"] += 1
+
+    # Update index for next time
+    sensor["stream_index"] = sensor["data"].next_position(current_idx, chunk_size)
+
+sensors.clear()
+for device_id in MY_DEVICE_IDS:
+    sensor = make_sensor(device_id)
+    if sensor is not None:
+        sensors.append(sensor)
+running = bool(sensors)
+
+if running:
+    device_list = ", ".join(str(s["device_id"]) for s in sensors)
+    for sensor in sensors:
+        # Send INIT 
+        init_packet = build_checksum_header(
+            device_id=sensor["device_id"],
+            batch_count=sensor["unit_code"],
+            seq_num=sensor["seq_num"],
+            msg_type=MSG_INIT
+        )
+        client_socket.sendto(init_packet, SERVER_ADDR)
+        sent_history[(sensor["device_id"], sensor["seq_num"])] = init_packet
+        print(f"Sent INIT (Device={sensor['device_id']}, seq={sensor['seq_num']})")
+        sensor["seq_num"] += 1
 
     threading.Thread(target=send_heartbeat, daemon=True).start()
 
-    print(f"Starting test for Device {MY_DEVICE_ID} with intervals {intervals} ({Interval_Duration}s each)...")
+    print(f"Starting test for Device {device_list} with intervals {intervals} ({Interval_Duration}s each)...")
 
     for interval in intervals:
-        print(f"\n--- Device {MY_DEVICE_ID}: Running {interval}s interval for {Interval_Duration} seconds ---")
+        print(f"\n--- Device {device_list}: Running {interval}s interval for {Interval_Duration} seconds ---")
         start_interval = time.time()
 
         while time.time() - start_interval < Interval_Duration:
             loop_start = time.time()
-
-            # --- GRAB NEXT 10 NUMBERS ---
-            chunk_size = 10
-            current_idx = sensor["stream_index"]
-            data_len = len(sensor["data"])
-            
-            chunk_values = []
-            
-            # Smart wrapping: if we hit the end, wrap around immediately to fill the packet
-            for i in range(chunk_size):
-                val = sensor["data"][(current_idx + i) % data_len]
-                # Optional: Add noise so it doesn't look identical every loop
-                # val += random.uniform(-0.1, 0.1) 
-                chunk_values.append(val)
-            
-            # Update index for next time
-            sensor["stream_index"] = (current_idx + chunk_size) % data_len
-
-            # --- PREPARE PACKET ---
-            compressed_data, flag_batches = compress_data(chunk_values)
-            raw_payload = encode_smart_payload(compressed_data, flag_batches)
-            payload = encrypt_bytes(raw_payload, sensor["device_id"], sensor["seq_num"])
-            
-            batch_count = len(chunk_values) 
-
-            header = build_checksum_header(
-                device_id=sensor["device_id"],
-                batch_count=batch_count,
-                seq_num=sensor["seq_num"],
-                msg_type=MSG_DATA,
-                payload=payload
-            )
-
-            packet = header + payload
-            sent_history[(sensor["device_id"], sensor["seq_num"])] = packet
-
-            client_socket.sendto(packet, SERVER_ADDR)
-            print(f"Sent DATA (ID={sensor['device_id']}, seq={sensor['seq_num']}, count={batch_count})")
-            
-            sensor["seq_num"] += 1
+            for sensor in sensors:
+                send_chunk(sensor, loop_start)
 
             # Sleep to maintain interval
             elapsed = time.time() - loop_start
@@ -263,6 +325,22 @@ if running:
                 time.sleep(interval - elapsed)
 
 print("Test finished. Closing client...")
+for sensor in sensors:
+    prefix = f"Device {sensor['device_id']} " if len(sensors) > 1 else ""
+    cache = sensor["payloads"]
+    print(f"{prefix}Payload cache: {cache.hits} hits, {cache.misses} misses")
+    fec = sensor["fec"]
+    if fec:
+        parity = fec.flush()
+        if parity:
+            client_socket.sendto(parity, SERVER_ADDR)
+        print(f"{prefix}FEC: {fec.parity_total} parity packets (k={fec.k})")
+    reporting = sensor["reporting"]
+    if reporting:
+        print(f"{prefix}Deadband: {reporting.suppressed_total} reports suppressed, "
+              f"{reporting.forced_total} sent after {MAX_SILENCE:g}s of silence")
+if profiler:
+    profiler.stop_all()
 running = False
 client_socket.close()
 print("Client finished.")
\ No newline at end of file
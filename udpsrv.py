@@ -1,50 +1,144 @@
 import socket
+import select
 import time
 import csv
 import os
 import sys
-from datetime import datetime
 import struct
 import threading
 from protocol import *
-import base64
 import signal
+from perfstats import make_stage_timer
+from metrics_export import MetricsExporter
+from batchrecv import BatchReceiver, set_rcvbuf, read_udp_drops
+from liveness import LivenessWheel
+from sessions import SessionTable
+from checkpoint import SessionCheckpoint
+from nackpolicy import NackPolicy
+from timefmt import now_ms, format_iso_seconds
+from sinks import make_sink, MSG_SUPPRESSED
+from segments import SegmentPolicy
+from rollup import RollupWindows, parse_windows
+from fec import FecReceiver
+from profiling import install_from_env
 # --- Real-time logging ---
 sys.stdout.reconfigure(line_buffering=True)
 SERVER_ID = 1
 
 # --- Server setup ---
+# The socket is opened by main(); importing this module (e.g. from replay.py)
+# only sets up the packet pipeline.
 SERVER_PORT = 12001
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-server_socket.bind(('', SERVER_PORT))
-print(f"UDP Server running on port {SERVER_PORT} (max {MAX_BYTES} bytes)")
+server_socket = None
+# Device packets are at most MAX_BYTES; relay envelopes (relay.py) carry many.
+RECV_BYTES = max(MAX_BYTES, RELAY_MAX_BYTES)
+
+# --- High-throughput receive (opt-in: ECHOP_BATCH_RECV=1) ---
+# ECHOP_RCVBUF enlarges the kernel receive buffer so fleet-wide bursts are queued, not dropped.
+BATCH_RECV = os.environ.get("ECHOP_BATCH_RECV", "0") == "1"
+RECV_SLOTS = int(os.environ.get("ECHOP_RECV_SLOTS", "64"))
+RCVBUF_BYTES = int(os.environ.get("ECHOP_RCVBUF", "0"))
+_receiver = None
 
 NACK_DELAY_SECONDS = 1
 nack_lock = threading.Lock()
 delayed_nack_requests = []
 
-# --- CSV Configuration ---
-LOG_DIR = "logs"
-os.makedirs(LOG_DIR, exist_ok=True)
-CSV_FILENAME = os.path.join(LOG_DIR, "iot_device_data.csv")
-CSV_HEADERS = [
-    "server_timestamp", "device_id", "unit/batch_count", "sequence_number",
-    "device_timestamp", "message_type", "payload",
-    "client_address", "delay_seconds", "duplicate_flag", "gap_flag",
-    "packet_size", "cpu_time_ms"
+# --- Adaptive NACK timing (ECHOP_ADAPTIVE_NACK=0 restores the fixed delay) ---
+# NACK_DELAY_SECONDS is only the hold-off used until a device's delay has been
+# measured; NACK output is paced per device and globally (deferred, not dropped).
+ADAPTIVE_NACK = os.environ.get("ECHOP_ADAPTIVE_NACK", "1") == "1"
+NACK_MIN_HOLDOFF = float(os.environ.get("ECHOP_NACK_MIN_HOLDOFF", "0.05"))
+NACK_MAX_HOLDOFF = float(os.environ.get("ECHOP_NACK_MAX_HOLDOFF", "2.0"))
+NACK_DEVICE_RATE = float(os.environ.get("ECHOP_NACK_DEVICE_RATE", "20"))
+NACK_GLOBAL_RATE = float(os.environ.get("ECHOP_NACK_RATE", "500"))
+_nack_policy = NackPolicy(
+    initial_holdoff=NACK_DELAY_SECONDS,
+    min_holdoff=NACK_MIN_HOLDOFF if ADAPTIVE_NACK else NACK_DELAY_SECONDS,
+    max_holdoff=NACK_MAX_HOLDOFF if ADAPTIVE_NACK else NACK_DELAY_SECONDS,
+    device_rate=NACK_DEVICE_RATE, device_burst=2 * NACK_DEVICE_RATE,
+    global_rate=NACK_GLOBAL_RATE, global_burst=2 * NACK_GLOBAL_RATE,
+)
+
+# --- FEC parity (sent by clients started with ECHOP_FEC_K) ---
+# A NACK for a seq whose block parity is due within FEC_MAX_WAIT seconds is
+# held until then; the parity usually rebuilds the packet and the NACK is
+# dropped. Parity due later than that would be slower than the NACK itself.
+FEC_MAX_WAIT = float(os.environ.get("ECHOP_FEC_MAX_WAIT", str(NACK_DELAY_SECONDS)))
+_fec = FecReceiver(ring_size=64, max_wait=FEC_MAX_WAIT)
+
+# --- Liveness ---
+# Heartbeats only refresh the in-memory liveness wheel; set ECHOP_HEARTBEAT_CSV=1
+# to also write one CSV row per heartbeat as before.
+HEARTBEAT_CSV = os.environ.get("ECHOP_HEARTBEAT_CSV", "0") == "1"
+_liveness = LivenessWheel(HEARTBEAT_TIMEOUT_SECONDS)
+# Sessions of devices that stay silent past the heartbeat timeout are evicted;
+# a returning device is re-INITed through the usual seq=1 NACK.
+MAX_SESSIONS = int(os.environ.get("ECHOP_MAX_SESSIONS", "4096"))
+
+# --- Storage ---
+# ECHOP_SINK selects where rows go: csv (default), binary or sqlite (see sinks.py).
+LOG_DIR = os.environ.get("ECHOP_LOG_DIR", "logs")
+SINK = os.environ.get("ECHOP_SINK", "csv")
+# The csv sink's files roll into segments at ECHOP_SEGMENT_MB or on an
+# ECHOP_SEGMENT_SECONDS boundary (0 = off) and are compressed in the background.
+SEGMENT_MB = float(os.environ.get("ECHOP_SEGMENT_MB", "64"))
+SEGMENT_SECONDS = int(os.environ.get("ECHOP_SEGMENT_SECONDS", "0"))
+SEGMENT_COMPRESSION = os.environ.get("ECHOP_SEGMENT_COMPRESSION", "gzip")
+_sink = make_sink(SINK, LOG_DIR, SegmentPolicy(int(SEGMENT_MB * 1024 * 1024), SEGMENT_SECONDS, SEGMENT_COMPRESSION))
+
+# --- Ingest-time rollups (ECHOP_ROLLUPS="" disables) ---
+# Decoded readings are aggregated per device and unit into tumbling windows of
+# the listed lengths (seconds); each closed window is one row of rollups.csv.
+ROLLUP_WINDOWS = parse_windows(os.environ.get("ECHOP_ROLLUPS", "10,60,3600"))
+ROLLUP_PATH = os.path.join(LOG_DIR, "rollups.csv")
+_rollups = RollupWindows(ROLLUP_PATH, ROLLUP_WINDOWS) if ROLLUP_WINDOWS else None
+
+# --- Hot-path stage timing (opt-in: ECHOP_STAGE_TIMING=1) ---
+# Histograms are dumped to stage_timing.csv every STAGE_DUMP_SECONDS and on shutdown.
+# "recv" is the receive call itself: the clock starts once the socket is readable.
+STAGE_TIMING = os.environ.get("ECHOP_STAGE_TIMING", "0") == "1"
+STAGE_DUMP_SECONDS = 10
+STAGE_TIMING_CSV = os.path.join(LOG_DIR, "stage_timing.csv")
+PIPELINE_STAGES = [
+    "recv", "parse", "checksum", "decrypt", "decode",
+    "tracker", "persist", "reorder", "rollup", "metrics", "log"
 ]
+_stages = make_stage_timer(STAGE_TIMING, PIPELINE_STAGES, STAGE_TIMING_CSV, STAGE_DUMP_SECONDS)
+
+# --- Session checkpoints (ECHOP_CHECKPOINT=0 disables) ---
+# Tracker state is journaled as it changes and snapshotted every
+# CHECKPOINT_SECONDS, then reloaded at startup so a restarted server resumes
+# every session instead of NACKing each device back to INIT.
+CHECKPOINT = os.environ.get("ECHOP_CHECKPOINT", "1") == "1"
+CHECKPOINT_SECONDS = float(os.environ.get("ECHOP_CHECKPOINT_SECONDS", "5"))
+CHECKPOINT_PATH = os.path.join(LOG_DIR, "sessions.ckpt")
+# A checkpoint older than this is from an earlier, unrelated run: its devices
+# would have been evicted as silent by now, so it is not resumed.
+CHECKPOINT_MAX_AGE = float(os.environ.get("ECHOP_CHECKPOINT_MAX_AGE", str(HEARTBEAT_TIMEOUT_SECONDS)))
+_checkpoint = SessionCheckpoint(CHECKPOINT_PATH, CHECKPOINT_SECONDS) if CHECKPOINT else None
+
+# --- Live metrics endpoint (opt-in: ECHOP_METRICS_PORT=9101) ---
+METRICS_HOST = os.environ.get("ECHOP_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("ECHOP_METRICS_PORT", "0"))
+
+# --- On-demand profiling (SIGUSR1 cProfile, SIGUSR2 stack samples; see profiling.py) ---
+# Installed by main(); ECHOP_PROFILE_SIGNALS="" leaves the signals alone.
+_profiler = None
 
 def init_csv_file():
     """
-    Initialize the CSV file by truncating it and writing only the header.
-    This ensures each run starts with a fresh CSV instead of preserving rows
-    from previous runs.
+    Open the storage sink. The csv sink rolls files left by a previous run
+    into segments; the other sinks truncate theirs so each run starts fresh.
     """
-    with open(CSV_FILENAME, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(CSV_HEADERS)
-    print(f"CSV initialized (truncated) at: {CSV_FILENAME}")
+    os.makedirs(LOG_DIR, exist_ok=True)
+    rolled = _sink.open()
+    if rolled:
+        print(f"Previous {SINK} output kept as segments: {', '.join(rolled)}")
+    print(f"{SINK} sink initialized ({'segmented' if SINK == 'csv' else 'truncated'}) at: {_sink.path}")
+    if _rollups:
+        _rollups.open()
+        print(f"Rollups {'/'.join(f'{w}s' for w in ROLLUP_WINDOWS)} initialized (truncated) at: {ROLLUP_PATH}")
 
     # Initialize/Truncate metrics.csv as well
     MET_CSV = os.path.join(LOG_DIR, "metrics.csv")
@@ -59,87 +153,46 @@ def init_csv_file():
     print(f"Metrics CSV initialized (truncated) at: {MET_CSV}")
 
 
-def save_to_csv(data_dict, is_update=False):
-    """Save data to CSV; update duplicate_flag if needed."""
-    seq = str(data_dict['seq'])
-    device_id = str(data_dict['device_id'])
-
-    msg_type = data_dict['msg_type']
-    if msg_type == MSG_INIT:
-        msg_type_str = "INIT"
-    elif msg_type == MSG_DATA:
-        msg_type_str = "DATA"
-    elif msg_type == HEART_BEAT:
-        msg_type_str = "HEARTBEAT"
-    else:
-        msg_type_str = f"UNKNOWN({msg_type})"
-
-    # --- FIX START: Do not Base64 encode if it's already a string ---
-    payload = data_dict['payload']
-    
-    # If payload is bytes, we might want to Base64 encode it to be safe.
-    # If it is a string (which your DATA packets are now), save it directly.
-    if isinstance(payload, bytes):
-        final_payload = base64.b64encode(payload).decode('ascii')
-    else:
-        # It's already a string (e.g., "12.50,30.00"), just use it
-        final_payload = str(payload)
-    # --- FIX END ---
-
-    new_row = [
-        data_dict['server_timestamp'],
-        device_id,
-        code_to_unit(data_dict['batch_count']) if msg_type == MSG_INIT else (data_dict['batch_count'] if msg_type == MSG_DATA else ""),
-        seq,
-        data_dict['timestamp'],
-        msg_type_str,
-        final_payload,  # Use the fixed variable here
-        data_dict['client_address'],
-        str(data_dict['delay_seconds']),
-        str(data_dict['duplicate_flag']),
-        str(data_dict['gap_flag']),
-        str(data_dict['packet_size']),
-        f"{data_dict['cpu_time_ms']:.4f}"
-    ]
-
+def persist_row(data_dict, is_update=False):
+    """Hand a row to the storage sink; is_update records it as a duplicate of the stored copies instead."""
+    device_id = data_dict['device_id']
+    seq = data_dict['seq']
     try:
         if is_update:
-            rows = []
-            row_found = False
-            # Read all rows into memory
-            if os.path.exists(CSV_FILENAME):
-                with open(CSV_FILENAME, 'r', newline='', encoding='utf-8') as csvfile:
-                    reader = csv.reader(csvfile)
-                    try:
-                        headers = next(reader)
-                        rows.append(headers)
-                    except StopIteration:
-                        pass # Empty file
-                    
-                    for row in reader:
-                        # Row indices: 1=device_id, 3=seq
-                        if len(row) > 3 and row[1] == device_id and row[3] == seq:
-                            # Update duplicate flag (index 9 based on your structure)
-                            row[9] = '1'
-                            print(f" [!] Updated CSV row for duplicate packet (Device:{device_id}, Seq:{seq})")
-                            row_found = True
-                        rows.append(row)
-
-            if row_found:
-                with open(CSV_FILENAME, 'w', newline='', encoding='utf-8') as csvfile:
-                    writer = csv.writer(csvfile)
-                    writer.writerows(rows)
+            if _sink.mark_duplicate(data_dict):
+                print(f" [!] Flagged duplicate packet in {SINK} sink (Device:{device_id}, Seq:{seq})")
             else:
-                # Fallback if not found (though logic suggests it should be there)
-                pass 
+                print(f" [!] Stored row for duplicate packet not found, left unflagged (Device:{device_id}, Seq:{seq})")
         else:
-            # --- APPEND LOGIC for new packets ---
-            with open(CSV_FILENAME, 'a', newline='', encoding='utf-8') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(new_row)
+            _sink.write(data_dict)
             print(f" Data saved (ID:{device_id}, seq={seq})")
     except Exception as e:
-        print(f" Error writing/rewriting to CSV: {e}")
+        print(f" Error writing to {SINK} sink: {e}")
+
+
+def sink_flusher():
+    """
+    Commit rows a batching sink is holding when traffic is too slow to fill a
+    batch, close rollup windows of devices that stopped sending, and push the
+    session journal and snapshots to disk.
+    """
+    while True:
+        time.sleep(0.25)
+        try:
+            _sink.maybe_flush()
+        except Exception as e:
+            print(f" Error flushing {SINK} sink: {e}")
+        if _checkpoint:
+            try:
+                _checkpoint.flush()
+                _checkpoint.maybe_snapshot(trackers)
+            except Exception as e:
+                print(f" Error writing session checkpoint: {e}")
+        if _rollups:
+            try:
+                _rollups.expire(now_ms())
+            except Exception as e:
+                print(f" Error writing rollups: {e}")
 
 
 # --- NACK Handling ---
@@ -147,13 +200,14 @@ server_seq = 1
 
 def schedule_NACK(device_id, addr, missing_seq):
     unique_key = (device_id, missing_seq)
-    nack_time = time.time() + NACK_DELAY_SECONDS
+    holdoff = _nack_policy.holdoff(device_id) + _fec.parity_wait(device_id, missing_seq)
+    nack_time = time.time() + holdoff
     request = {'device_id': device_id, 'missing_seq': missing_seq, 'addr': addr, 'nack_time': nack_time}
 
     with nack_lock:
         if not any((req['device_id'], req['missing_seq']) == unique_key for req in delayed_nack_requests):
             delayed_nack_requests.append(request)
-            print(f" [~] Scheduled NACK for ID:{device_id}, seq: {missing_seq} at T + {NACK_DELAY_SECONDS}s")
+            print(f" [~] Scheduled NACK for ID:{device_id}, seq: {missing_seq} at T + {holdoff:.3g}s")
         else:
             print(f" [X] Ignoring duplicate schedule request for ID:{device_id}, seq: {missing_seq}")
 
@@ -177,19 +231,57 @@ def nack_scheduler():
         with nack_lock:
             requests_to_send = [req for req in delayed_nack_requests if req['nack_time'] <= now]
             delayed_nack_requests = [req for req in delayed_nack_requests if req['nack_time'] > now]
+        deferred = []
         for req in requests_to_send:
             device_id = req['device_id']
             missing_seq = req['missing_seq']
-            if (device_id in trackers and missing_seq in trackers[device_id].missing_set) or (missing_seq == 1 and device_id not in trackers):
+            tracker = trackers.peek(device_id)
+            if (tracker is not None and missing_seq in tracker.missing_set) or (missing_seq == 1 and tracker is None):
+                wait = _nack_policy.admit(device_id, missing_seq, now)
+                if wait:
+                    req['nack_time'] = now + wait
+                    deferred.append(req)
+                    continue
                 send_NACK_now(device_id=device_id, addr=req['addr'], missing_seq=missing_seq)
-        time.sleep(0.1)
+                _nack_policy.on_sent(device_id, missing_seq)
+        if deferred:
+            with nack_lock:
+                delayed_nack_requests.extend(deferred)
+        time.sleep(0.02 if ADAPTIVE_NACK else 0.1)
+
+
+def _drop_pending_nacks(device_id, seq=None):
+    """Unschedule a device's NACKs (only the one for `seq` if given)."""
+    global delayed_nack_requests
+    with nack_lock:
+        delayed_nack_requests = [req for req in delayed_nack_requests
+                                 if req['device_id'] != device_id
+                                 or (seq is not None and req['missing_seq'] != seq)]
 
 
-# --- Device State Tracking ---
-class DeviceTracker:
-    def __init__(self):
-        self.highest_seq = 0
-        self.missing_set = set()
+def liveness_monitor():
+    """Evict the sessions of devices that stopped sending heartbeats and data."""
+    while True:
+        for device_id in _liveness.expire(time.time()):
+            if trackers.evict(device_id) is not None:
+                _drop_pending_nacks(device_id)
+            print(f" [-] Device {device_id} silent for {HEARTBEAT_TIMEOUT_SECONDS}s, session evicted")
+        time.sleep(1.0)
+
+
+def _record_heartbeat(header, payload_bytes, addr):
+    """Refresh liveness for every device named in a (possibly multi-device) heartbeat."""
+    now = time.time()
+    devices = decode_liveness_bitmap(payload_bytes) or [header['device_id']]
+    for device_id in devices:
+        _liveness.touch(device_id, now)
+        tracker = trackers.get(device_id)
+        if tracker is not None:
+            tracker.last_seen = now
+        else:
+            print(f" [!] Heartbeat from unknown Device {device_id}, requesting INIT")
+            schedule_NACK(device_id=device_id, addr=addr, missing_seq=1)
+    print(f" -> HEARTBEAT from Device {', '.join(str(d) for d in devices)}")
 
 
 
@@ -197,18 +289,7 @@ class DeviceTracker:
 # ADDED: timestamp reordering + metrics (CSV)
 # ----------------------------------------------
 import heapq  # ADDED
-# ADDED: second CSV in timestamp order (analysis only; original CSV unchanged)
-REORDER_CSV = os.path.join(LOG_DIR, "iot_device_data_reordered.csv")
-_REORDER_INIT = False
-def _init_reorder_csv():  # ADDED
-    """Create (or reset) the reordered CSV with the same headers as the main CSV."""
-    global _REORDER_INIT
-    if _REORDER_INIT:
-        return
-    with open(REORDER_CSV, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(CSV_HEADERS)  # same columns for easy comparison
-    _REORDER_INIT = True
+# ADDED: second output in timestamp order (analysis only; original rows unchanged)
 class _Pkt:  # ADDED
     __slots__ = ("ts_key_ms", "csv_dict", "dup", "gap")
     def __init__(self, ts_key_ms, csv_dict, dup, gap):
@@ -257,43 +338,24 @@ class _ReorderBuffer:  # ADDED
         out.sort(key=lambda p: p.ts_key_ms)
         return out
 def _save_reordered(pkt_list):
-    """Append flushed packets to the reordered CSV with normal payload (no base64)."""
+    """Hand packets released by the reorder buffer to the sink's timestamp-ordered output."""
     if not pkt_list:
         return
-    _init_reorder_csv()
-    with open(REORDER_CSV, 'a', newline='') as f:
-        writer = csv.writer(f)
-        for p in pkt_list:
-            d = p.csv_dict
-            msg_type = d['msg_type']
-            if msg_type == MSG_INIT:
-                msg_type_str = "INIT"
-            elif msg_type == MSG_DATA:
-                msg_type_str = "DATA"
-            elif msg_type == HEART_BEAT:
-                msg_type_str = "HEARTBEAT"
-            else:
-                msg_type_str = f"UNKNOWN({msg_type})"
-
-            payload = d['payload']
-            if isinstance(payload, bytes):
-                payload = payload.decode('utf-8', errors='ignore')
-
-            writer.writerow([
-                d['server_timestamp'],
-                d['device_id'],
-                code_to_unit(d['batch_count']) if msg_type == MSG_INIT else (d['batch_count'] if msg_type == MSG_DATA else ""),
-                d['seq'],
-                d['timestamp'],
-                msg_type_str,
-                payload,  # <-- normal payload
-                d['client_address'],
-                d['delay_seconds'],
-                1 if p.dup else 0,
-                1 if p.gap else 0,
-                d['packet_size'],
-                f"{d['cpu_time_ms']:.4f}",
-            ])
+    _sink.write_reordered([(p.csv_dict, p.dup, p.gap) for p in pkt_list])
+
+
+def _persist_suppressed(csv_data, count):
+    """
+    Store a SUPPRESSED row for the `count` reports a device held back under its
+    deadband, just ahead of the DATA row that announced them (also in the
+    timestamp-ordered output), so readers hold the last reported values.
+    """
+    global metrics_suppressed_total
+    marker = dict(csv_data, msg_type=MSG_SUPPRESSED, payload=str(count), packet_size=0, cpu_time_ms=0.0)
+    persist_row(marker)
+    _reorder.push(_Pkt(ts_key_ms=marker['device_ts_ms'] - 1, csv_dict=marker, dup=False, gap=False),
+                  marker['device_ts_ms'])
+    metrics_suppressed_total += count
 
 
 def graceful_shutdown(signum, frame):
@@ -301,12 +363,23 @@ def graceful_shutdown(signum, frame):
 
     remaining = _reorder.flush_all()
     _save_reordered(remaining)
+    _stages.dump()
+    if _checkpoint:
+        _checkpoint.snapshot(trackers)
+        print(f"[Shutdown] Session checkpoint saved: {CHECKPOINT_PATH}")
+    drops = read_udp_drops(server_socket)
+    if drops is not None:
+        print(f"[Shutdown] Kernel receive drops: {drops}")
     server_socket.close()
-    print(f"[Shutdown] Reordered CSV finalized: {REORDER_CSV}")
+    _sink.close()
+    print(f"[Shutdown] Reordered output finalized: {_sink.reorder_path}")
+    if _profiler:
+        _profiler.stop_all()
+    if _rollups:
+        _rollups.close()
+        print(f"[Shutdown] Rollups finalized ({_rollups.rows_total} windows): {ROLLUP_PATH}")
     sys.exit(0)
 
-signal.signal(signal.SIGTERM, graceful_shutdown)  # kill PID
-signal.signal(signal.SIGINT, graceful_shutdown)   # Ctrl+C
 
 
 # ADDED: metrics accumulators (aggregate for metrics.csv)
@@ -315,12 +388,14 @@ metrics_bytes = 0
 metrics_cpu_ms = 0.0
 metrics_dup_total = 0
 metrics_gap_total = 0
+metrics_suppressed_total = 0  # reports held back by device deadbands
+rx_packets = 0   # every datagram read from the socket
+rx_bytes = 0
+relay_batches = 0  # relay envelopes unpacked
+relay_packets = 0  # device packets that arrived inside them
 _reorder = _ReorderBuffer(guard_ms=10000, max_buffer_ms=10000)  # ADDED
-def _now_ms():  # ADDED
-    return int(time.time() * 1000)
 
-# PATCH: reporting interval tracking (per device)
-last_data_ts_ms = {}        # device_id -> last valid DATA device timestamp in ms
+# PATCH: reporting interval tracking (last DATA timestamp lives on each device's tracker)
 report_intervals_ms = []    # collected intervals across the run
 
 
@@ -345,7 +420,7 @@ def update_metrics():
         int(metrics_gap_total),
         (metrics_cpu_ms / metrics_packets) if metrics_packets else 0.0,
         reporting_interval_ms,
-        time.strftime('%Y-%m-%d %H:%M:%S')
+        format_iso_seconds(now_ms())
     ]
     
     MET_CSV = os.path.join(LOG_DIR, "metrics.csv")
@@ -361,202 +436,482 @@ def update_metrics():
     except Exception as e:
         print(f"Error updating metrics.csv: {e}")
 
-# --- Initialize ---
-init_csv_file()
-trackers = {}
+def _metrics_snapshot():
+    """In-memory view of the running server for the metrics endpoint (no file I/O)."""
+    devices = {}
+    outstanding = 0
+    for device_id, t in trackers.items():
+        missing = len(t.missing_set)
+        outstanding += missing
+        devices[str(device_id)] = {
+            "last_seen_seconds": round(t.last_seen, 3),
+            "highest_seq": t.highest_seq,
+            "missing": missing,
+            "nack_holdoff_ms": round(_nack_policy.holdoff(device_id) * 1000, 1),
+            **_nack_policy.snapshot(device_id),
+        }
+    return {
+        "counters": {
+            "rx_packets_total": rx_packets,
+            "rx_bytes_total": rx_bytes,
+            "data_packets_total": metrics_packets,
+            "duplicates_total": metrics_dup_total,
+            "gaps_total": metrics_gap_total,
+            "suppressed_reports_total": metrics_suppressed_total,
+            "corrupted_total": corruption_count,
+            "relay_batches_total": relay_batches,
+            "relay_packets_total": relay_packets,
+            "nacks_sent_total": _nack_policy.sent_total,
+            "nacks_deferred_total": _nack_policy.deferred_total,
+            "reordered_total": _nack_policy.reordered_total,
+            "fec_parity_total": _fec.parity_total,
+            "fec_repaired_total": _fec.repaired_total,
+            "fec_unrecoverable_total": _fec.unrecoverable_total,
+            "rollup_windows_total": _rollups.rows_total if _rollups else 0,
+            "rollup_late_total": _rollups.late_total if _rollups else 0,
+        },
+        "gauges": {
+            "duplicate_rate": (metrics_dup_total / metrics_packets) if metrics_packets else 0.0,
+            "outstanding_nacks": outstanding,
+            "scheduled_nacks": len(delayed_nack_requests),
+            "reorder_buffer_depth": len(_reorder.heap),
+            "devices": len(devices),
+            "live_devices": len(_liveness),
+            "rollup_open_windows": _rollups.open_windows() if _rollups else 0,
+            **trackers.stats(),
+            "kernel_drops": (read_udp_drops(server_socket) or 0) if server_socket is not None else 0,
+            "max_recv_batch": _receiver.max_batch if _receiver is not None else 1,
+        },
+        "devices": devices,
+        "stages": _stages.summary(),
+    }
+
+def _on_session_evicted(device_id):
+    _nack_policy.forget(device_id)
+    _fec.forget(device_id)
+    if _checkpoint:
+        _checkpoint.record_eviction(device_id)
+
+
+trackers = SessionTable(MAX_SESSIONS, on_evict=_on_session_evicted)
 received_count = 0
 corruption_count = 0
-# --- FORCE reordered CSV creation at startup ---
-_init_reorder_csv()
-print(f"Reordered CSV initialized: {REORDER_CSV}")
 
 
-threading.Thread(target=nack_scheduler, daemon=True).start()
+# --- Per-packet pipeline ---
+def handle_packet(data, addr):
+    """Run one datagram (a device packet or a relay envelope of them) through the pipeline."""
+    global rx_packets, rx_bytes
+    rx_packets += 1
+    rx_bytes += len(data)
+    if is_relay_batch(data):
+        _handle_relay_batch(data, addr)
+    else:
+        _handle_device_packet(data, addr)
 
 
-# --- Main Server Loop ---
-try:
-    while True:
-        data, addr = server_socket.recvfrom(MAX_BYTES)
+def _handle_relay_batch(data, addr):
+    """Unpack a relay envelope; NACKs for its devices go back to the relay at `addr`."""
+    global corruption_count, relay_batches, relay_packets
+    header = parse_header(data)
+    body = data[HEADER_SIZE:]
+    if header['checksum'] != calculate_expected_checksum(data[:HEADER_SIZE - 1], body):
+        corruption_count += 1
+        print(f"⚠️ Relay envelope checksum mismatch (relay {header['device_id']}, seq {header['seq']})")
+        return
+    try:
+        packets = unpack_relay_batch(body)
+    except ValueError as e:
+        corruption_count += 1
+        print(f"Relay envelope error: {e}")
+        return
+    relay_batches += 1
+    relay_packets += len(packets)
+    _stages.mark("parse")
+    for packet in packets:
+        _handle_device_packet(packet, addr)
+
+
+def _handle_fec_parity(data, addr):
+    """Rebuild the one lost DATA packet of a parity block, if any, and run it through the pipeline."""
+    global corruption_count
+    header = parse_header(data)
+    payload = data[HEADER_SIZE:]
+    if header['checksum'] != calculate_expected_checksum(data[:HEADER_SIZE - 1], payload):
+        corruption_count += 1
+        print(f"⚠️ FEC parity checksum mismatch (ID:{header['device_id']}, block {header['seq']})")
+        return
+    device_id = header['device_id']
+    tracker = trackers.peek(device_id)
+    if tracker is None:
+        return
 
-        start_cpu = time.perf_counter()
-        server_receive_time = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
-        try:
-            header = parse_header(data)
-        except ValueError as e:
-            print("Header error:", e)
-            continue
-
-        payload_bytes = data[HEADER_SIZE:]
-        BASE_HEADER_SIZE = 9
-        base_header_bytes = data[:BASE_HEADER_SIZE]
-        calculated_checksum = calculate_expected_checksum(base_header_bytes, payload_bytes)
-
-        if header['msg_type'] == MSG_DATA:
-            num = header['batch_count']  # Total number of batches
-            if len(payload_bytes) > 0 and num > 0:
-                try:
-                    # Decrypt the entire payload
-                    dec = decrypt_bytes(payload_bytes, header['device_id'], header['seq'])
-                    
-                    # Parse using smart structure
-                    values = decode_smart_payload(dec, num)
-                    
-                    payload = ",".join(f"{v:.6f}" for v in values)
-                except Exception as e:
-                    print(f"Error parsing smart payload: {e}")
-                    # Fallback to text
-                    payload = payload_bytes.decode('utf-8', errors='ignore')
-            else:
+    def wanted(seq):
+        return seq in tracker.missing_set or seq > tracker.highest_seq
+
+    try:
+        repaired = _fec.repair(device_id, header, payload, wanted)
+    except ValueError as e:
+        corruption_count += 1
+        print(f"FEC parity error: {e}")
+        return
+    if repaired is None:
+        return
+    seq, packet = repaired
+    print(f" [F] Rebuilt packet ID:{device_id}, seq:{seq} from FEC parity (block {header['seq']})")
+    _handle_device_packet(packet, addr, repaired=True)
+
+
+def _handle_device_packet(data, addr, repaired=False):
+    """
+    Run one device packet through parse, checksum, decrypt, decode, tracker,
+    persist, reorder and metrics. `repaired` marks a packet rebuilt from FEC parity.
+    """
+    global received_count, corruption_count
+    global metrics_packets, metrics_bytes, metrics_cpu_ms, metrics_dup_total, metrics_gap_total
+
+    if is_fec_parity(data):
+        _handle_fec_parity(data, addr)
+        return
+    start_cpu = time.perf_counter()
+    server_ms = now_ms()
+    try:
+        header = parse_header(data)
+    except ValueError as e:
+        print("Header error:", e)
+        return
+
+    payload_bytes = data[HEADER_SIZE:]
+    BASE_HEADER_SIZE = 9
+    base_header_bytes = data[:BASE_HEADER_SIZE]
+    _stages.mark("parse")
+    calculated_checksum = calculate_expected_checksum(base_header_bytes, payload_bytes)
+    _stages.mark("checksum")
+
+    values = None
+    suppressed = 0
+    if header['msg_type'] == MSG_DATA:
+        num = header['batch_count']  # Total number of batches
+        if len(payload_bytes) > 0 and num > 0:
+            try:
+                # Decrypt the entire payload
+                dec = decrypt_bytes(payload_bytes, header['device_id'], header['seq'])
+                _stages.mark("decrypt")
+                if header['flags'] & FLAG_SUPPRESSED:
+                    # Reports the device held back under its deadband before this one
+                    (suppressed,) = SUPPRESSED_PREFIX.unpack_from(dec)
+                    dec = dec[SUPPRESSED_PREFIX.size:]
+
+                # Parse using smart structure
+                values = decode_smart_payload(dec, num)
+
+                payload = ",".join(f"{v:.6f}" for v in values)
+                _stages.mark("decode")
+            except Exception as e:
+                _stages.mark("decode")
+                print(f"Error parsing smart payload: {e}")
+                # Fallback to text
                 payload = payload_bytes.decode('utf-8', errors='ignore')
-        else:  
-            # INIT or HEARTBEAT: treat payload as text (usually empty)
+        else:
             payload = payload_bytes.decode('utf-8', errors='ignore')
+    else:  
+        # INIT or HEARTBEAT: treat payload as text (usually empty)
+        payload = payload_bytes.decode('utf-8', errors='ignore')
 
-        device_id = header['device_id']
-        seq = header['seq']
+    device_id = header['device_id']
+    seq = header['seq']
 
-        if device_id not in trackers:
-            if header['msg_type'] == MSG_INIT:
-                trackers[device_id] = DeviceTracker()
-                trackers[device_id].highest_seq = seq - 1
-            else:
-                print(f" [!] Gap Detected! ID:{device_id}, Missing packets: 1")
-                schedule_NACK(device_id=device_id, addr=addr, missing_seq=1)
-                continue
-
-        tracker = trackers[device_id]
-        duplicate_flag = 0
-        gap_flag = 0
-        received_checksum = header['checksum']
-        checksum_valid = (received_checksum == calculated_checksum)
-        if not checksum_valid:
+    if header['msg_type'] == HEART_BEAT:
+        if header['checksum'] != calculated_checksum:
             corruption_count += 1
-            print(f"⚠️ Checksum mismatch: received={received_checksum}, calculated={calculated_checksum}")
-            continue
-
-        diff = seq - tracker.highest_seq
-        if seq == 0:
-            print("Heartbeat Received")
-        elif diff == 1:
-            tracker.highest_seq = seq
-        elif diff > 1:
-            metrics_gap_total+=1
-            gap_flag = 1
-            for missing_seq in range(tracker.highest_seq + 1, seq):
-                tracker.missing_set.add(missing_seq)
-                schedule_NACK(device_id=device_id, addr=addr, missing_seq=missing_seq)
-            tracker.highest_seq = seq
-        elif diff <= 0:
-            if seq in tracker.missing_set:
-                tracker.missing_set.remove(seq)
-                print(f" [+] Recovered packet ID:{device_id}, seq:{seq} (was missing).")
-            else:
-                duplicate_flag = 1
-                metrics_dup_total += 1
-                received_count -= 1
-                print(f" [D] Duplicate detected: ID:{device_id}, seq:{seq}. Content ignored.")
-
-        delay = round(time.time() - header['timestamp'], 3)
-        received_count += 1
-        end_cpu = time.perf_counter()
-        cpu_time_ms = (end_cpu - start_cpu) * 1000
-
-        csv_data = {
-            'server_timestamp': f" {server_receive_time}",
-            'device_id': device_id,
-            'batch_count': header['batch_count'],
-            'seq': seq,
-            'timestamp': f" {time.strftime('%d/%m/%Y %H:%M:%S', time.localtime(header['timestamp']))}.{header['milliseconds']:03d}",
-            'msg_type': header['msg_type'],
-            'payload': payload,
-            'client_address': f"{addr[0]}:{addr[1]}",
-            'delay_seconds': delay,
-            'duplicate_flag': duplicate_flag,
-            'gap_flag': gap_flag,
-            'packet_size': len(data),
-            'cpu_time_ms': cpu_time_ms
-        }
+            print(f"⚠️ Checksum mismatch: received={header['checksum']}, calculated={calculated_checksum}")
+            return
+        _record_heartbeat(header, payload_bytes, addr)
+        if not HEARTBEAT_CSV:
+            _stages.mark("tracker")
+            return
+
+    tracker = trackers.get(device_id)
+    if tracker is None:
+        if header['msg_type'] == MSG_INIT:
+            tracker = trackers.create(device_id)
+            tracker.highest_seq = seq - 1
+        else:
+            print(f" [!] Gap Detected! ID:{device_id}, Missing packets: 1")
+            schedule_NACK(device_id=device_id, addr=addr, missing_seq=1)
+            return
+
+    duplicate_flag = 0
+    gap_flag = 0
+    added_missing = []
+    recovered = ()
+    received_checksum = header['checksum']
+    checksum_valid = (received_checksum == calculated_checksum)
+    if not checksum_valid:
+        corruption_count += 1
+        print(f"⚠️ Checksum mismatch: received={received_checksum}, calculated={calculated_checksum}")
+        return
 
-        if header['msg_type'] == MSG_DATA:
-            if duplicate_flag:
-                save_to_csv(csv_data, True)
+    # Epoch-ms timestamps are carried through the pipeline and only formatted on write
+    device_ts_ms = header['timestamp'] * 1000 + header['milliseconds']
+    delay_ms = server_ms - device_ts_ms
+    tracker.last_seen = server_ms / 1000.0
+    _liveness.touch(device_id, tracker.last_seen)
+    if header['msg_type'] == MSG_DATA:
+        _fec.record(device_id, seq, data, tracker.last_seen)
+    elif (header['msg_type'] == MSG_INIT and seq <= tracker.highest_seq
+          and (tracker.last_data_ts_ms is None or device_ts_ms > tracker.last_data_ts_ms)):
+        # A device that restarted (or whose session was resumed from a checkpoint)
+        # begins a new session: its INIT is not a duplicate of the old one's seq 1.
+        print(f" [~] Device {device_id} re-INIT, resetting session (was at seq {tracker.highest_seq})")
+        tracker.highest_seq = seq - 1
+        tracker.clear_missing()
+        tracker.last_data_ts_ms = None
+    diff = seq - tracker.highest_seq
+    if header['msg_type'] == MSG_DATA and diff >= 1:
+        _nack_policy.on_delay(device_id, delay_ms / 1000.0)
+    if seq == 0:
+        print("Heartbeat Received")
+    elif diff == 1:
+        tracker.highest_seq = seq
+    elif diff > 1:
+        metrics_gap_total+=1
+        gap_flag = 1
+        for missing_seq in range(tracker.highest_seq + 1, seq):
+            tracker.add_missing(missing_seq)
+            added_missing.append(missing_seq)
+            schedule_NACK(device_id=device_id, addr=addr, missing_seq=missing_seq)
+        _nack_policy.on_gap(device_id, added_missing, tracker.last_seen)
+        tracker.highest_seq = seq
+    elif diff <= 0:
+        if seq in tracker.missing_set:
+            tracker.missing_set.remove(seq)
+            recovered = (seq,)
+            if repaired:
+                _nack_policy.on_repaired(device_id, seq)
+                _drop_pending_nacks(device_id, seq)
             else:
-                save_to_csv(csv_data)
-                 # ---------- REORDER BUFFER (ALWAYS ACTIVE) ----------
-                ts_ms = int(header['timestamp'] * 1000) + int(header['milliseconds'])
-
-                pkt = _Pkt(
-                    ts_key_ms=ts_ms,
-                    csv_dict=csv_data,
-                    dup=bool(duplicate_flag),
-                    gap=bool(gap_flag)
-                )
-
-                _reorder.push(pkt, ts_ms)
-
-                ready = _reorder.flush_ready(ts_ms)
-                _save_reordered(ready)
-
-                metrics_packets += 1
-                metrics_bytes += len(data)          # total bytes on the wire for this reading
-                metrics_cpu_ms += cpu_time_ms 
-
-                ts_ms = int(header['timestamp'] * 1000) + int(header['milliseconds'])
-                prev = last_data_ts_ms.get(device_id)
-                if prev is not None and ts_ms > prev:
-                    report_intervals_ms.append(ts_ms - prev)
-                last_data_ts_ms[device_id] = ts_ms
-                
-                # Continuously save metrics
-                update_metrics()
-
-            if gap_flag:
-                print(f" -> DATA received (ID:{device_id}, seq={seq}) with GAP.")
-            elif duplicate_flag:
-                print(f" -> DATA received (ID:{device_id}, seq={seq}) DUPLICATE (Ignored).")
-            else:
-                print(f" -> DATA received (ID:{device_id}, seq={seq})")
-        elif header['msg_type'] == MSG_INIT:
-            unit = code_to_unit(header['batch_count'])
-            print(f" -> INIT message from Device {device_id} (unit={unit})")
-            save_to_csv(csv_data)
-            # Also include INIT messages in the timestamp-reordered CSV
-            try:
-                ts_ms = int(header['timestamp'] * 1000) + int(header['milliseconds'])
-            except Exception:
-                ts_ms = _now_ms()
-
+                _nack_policy.on_recovered(device_id, seq, tracker.last_seen)
+            print(f" [+] Recovered packet ID:{device_id}, seq:{seq} (was missing).")
+        else:
+            duplicate_flag = 1
+            metrics_dup_total += 1
+            received_count -= 1
+            print(f" [D] Duplicate detected: ID:{device_id}, seq:{seq}. Content ignored.")
+
+    received_count += 1
+    end_cpu = time.perf_counter()
+    cpu_time_ms = (end_cpu - start_cpu) * 1000
+    _stages.mark("tracker")
+
+    csv_data = {
+        'server_ts_ms': server_ms,
+        'device_id': device_id,
+        'batch_count': header['batch_count'],
+        'seq': seq,
+        'device_ts_ms': device_ts_ms,
+        'msg_type': header['msg_type'],
+        'payload': payload,
+        'client_address': f"{addr[0]}:{addr[1]}",
+        'delay_ms': delay_ms,
+        'duplicate_flag': duplicate_flag,
+        'gap_flag': gap_flag,
+        'packet_size': len(data),
+        'cpu_time_ms': cpu_time_ms
+    }
+
+    if header['msg_type'] == MSG_DATA:
+        if duplicate_flag:
+            persist_row(csv_data, True)
+            _stages.mark("persist")
+        else:
+            if suppressed:
+                _persist_suppressed(csv_data, suppressed)
+            persist_row(csv_data)
+            _stages.mark("persist")
+             # ---------- REORDER BUFFER (ALWAYS ACTIVE) ----------
             pkt = _Pkt(
-                ts_key_ms=ts_ms,
+                ts_key_ms=device_ts_ms,
                 csv_dict=csv_data,
                 dup=bool(duplicate_flag),
                 gap=bool(gap_flag)
             )
 
-            _reorder.push(pkt, ts_ms)
-            ready = _reorder.flush_ready(ts_ms)
-            _save_reordered(ready)
+            _reorder.push(pkt, device_ts_ms)
 
-            trackers[device_id].highest_seq = seq
-            trackers[device_id].missing_set.clear()
-        elif header['msg_type'] == HEART_BEAT:
-            print(f" -> HEARTBEAT from Device {device_id}")
-            save_to_csv(csv_data)
+            ready = _reorder.flush_ready(device_ts_ms)
+            _save_reordered(ready)
+            _stages.mark("reorder")
+
+            if _rollups and values:
+                _rollups.add(device_id, tracker.unit or "unknown", device_ts_ms, values, server_ms)
+                _stages.mark("rollup")
+
+            metrics_packets += 1
+            metrics_bytes += len(data)          # total bytes on the wire for this reading
+            metrics_cpu_ms += cpu_time_ms 
+
+            prev = tracker.last_data_ts_ms
+            if prev is not None and device_ts_ms > prev:
+                # Suppressed reports were due in between: one gap spans suppressed + 1 intervals
+                report_intervals_ms.append((device_ts_ms - prev) / (suppressed + 1))
+            tracker.last_data_ts_ms = device_ts_ms
+            if _checkpoint:
+                _checkpoint.record(device_id, tracker, added_missing, recovered)
+
+            # Continuously save metrics
+            update_metrics()
+            _stages.mark("metrics")
+
+        if gap_flag:
+            print(f" -> DATA received (ID:{device_id}, seq={seq}) with GAP.")
+        elif duplicate_flag:
+            print(f" -> DATA received (ID:{device_id}, seq={seq}) DUPLICATE (Ignored).")
         else:
-            print("Unknown message type.")
+            print(f" -> DATA received (ID:{device_id}, seq={seq})")
+        _stages.mark("log")
+    elif header['msg_type'] == MSG_INIT:
+        unit = code_to_unit(header['batch_count'])
+        print(f" -> INIT message from Device {device_id} (unit={unit})")
+        _stages.mark("log")
+        persist_row(csv_data)
+        _stages.mark("persist")
+        # Also include INIT messages in the timestamp-reordered CSV
+        pkt = _Pkt(
+            ts_key_ms=device_ts_ms,
+            csv_dict=csv_data,
+            dup=bool(duplicate_flag),
+            gap=bool(gap_flag)
+        )
+
+        _reorder.push(pkt, device_ts_ms)
+        ready = _reorder.flush_ready(device_ts_ms)
+        _save_reordered(ready)
+        _stages.mark("reorder")
+
+        tracker.highest_seq = seq
+        tracker.clear_missing()
+        tracker.unit = unit
+        _fec.reset(device_id)
+        if _checkpoint:
+            _checkpoint.record(device_id, tracker, reset=True)
+    elif header['msg_type'] == HEART_BEAT:
+        _stages.mark("log")
+        persist_row(csv_data)
+        _stages.mark("persist")
+    else:
+        print("Unknown message type.")
+
+    _stages.maybe_dump()
+
+
+def restore_sessions():
+    """Rebuild the session table from the last checkpoint; returns the number of devices restored."""
+    now = time.time()
+    sessions = _checkpoint.load(CHECKPOINT_MAX_AGE)
+    for device_id, state in sessions.items():
+        tracker = trackers.create(device_id)
+        tracker.highest_seq = state["h"]
+        tracker.last_data_ts_ms = state["t"]
+        tracker.unit = state["u"]
+        tracker.last_seen = now
+        for missing_seq in sorted(state["m"]):
+            tracker.add_missing(missing_seq)
+        # Restored devices get a full heartbeat timeout to show up again.
+        _liveness.touch(device_id, now)
+    # Fold the replayed journal into a fresh snapshot.
+    _checkpoint.snapshot(trackers)
+    return len(sessions)
 
-except KeyboardInterrupt:
-    print("\nServer interrupted. Generating summary...")
 
-    remaining = _reorder.flush_all()
-    _save_reordered(remaining)
+# --- Main Server Loop ---
+def open_server_socket():
+    global server_socket, _receiver
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind(('', SERVER_PORT))
+    print(f"UDP Server running on port {SERVER_PORT} (max {MAX_BYTES} bytes, relay envelopes up to {RECV_BYTES})")
+    rcvbuf = set_rcvbuf(server_socket, RCVBUF_BYTES)
+    if BATCH_RECV:
+        _receiver = BatchReceiver(server_socket, RECV_SLOTS, RECV_BYTES)
+        print(f"Batched receive: {RECV_SLOTS} slots via {_receiver.mode}, SO_RCVBUF={rcvbuf}")
+
+
+def main():
+    global _profiler
+    open_server_socket()
+    signal.signal(signal.SIGTERM, graceful_shutdown)  # kill PID
+    signal.signal(signal.SIGINT, graceful_shutdown)   # Ctrl+C
+    _profiler = install_from_env(LOG_DIR, "udpsrv", watches={
+        "trackers": lambda: len(trackers),
+        "missing_seqs": lambda: sum(len(t.missing_set) for t in trackers.values()),
+        "scheduled_nacks": lambda: len(delayed_nack_requests),
+        "reorder_heap": lambda: len(_reorder.heap),
+        "fec_ring_packets": lambda: sum(len(d.ring) for d in list(_fec.devices.values())),
+        "rollup_open_windows": lambda: _rollups.open_windows() if _rollups else 0,
+    })
+
+    # --- Initialize ---
+    init_csv_file()
+    print(f"Reordered output initialized: {_sink.reorder_path}")
+    if _checkpoint:
+        t0 = time.perf_counter()
+        restored = restore_sessions()
+        print(f"Restored {restored} device sessions from {CHECKPOINT_PATH} "
+              f"in {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    threading.Thread(target=nack_scheduler, daemon=True).start()
+    threading.Thread(target=liveness_monitor, daemon=True).start()
+    threading.Thread(target=sink_flusher, daemon=True).start()
+
+    if METRICS_PORT:
+        MetricsExporter(_metrics_snapshot, METRICS_HOST, METRICS_PORT,
+                        rate_counters={"rx_packets_total": lambda: rx_packets,
+                                       "rx_bytes_total": lambda: rx_bytes}).start()
 
-    total_expected = sum(t.highest_seq for t in trackers.values())
-    missing_count = total_expected - received_count
-    delivery_rate = (received_count / total_expected) * 100 if total_expected else 0
-    print("\n=== Baseline Test Summary ===")
-    print(f"Total received: {received_count}")
-    print(f"Missing packets: {missing_count}")
-    print(f"Duplicate packets: {metrics_dup_total}")
-    print(f"Delivery rate: {delivery_rate:.2f}%")
+    try:
+        if BATCH_RECV:
+            # Drain everything the kernel has queued on each wakeup into preallocated slots
+            while True:
+                _receiver.wait()
+                _stages.start()
+                batch = _receiver.drain()
+                _stages.mark("recv")
+                for data, addr in batch:
+                    # A packet dropped mid-pipeline must not charge its rest to the next one
+                    _stages.start()
+                    handle_packet(data, addr)
+        else:
+            while True:
+                if STAGE_TIMING:
+                    select.select([server_socket], [], [])
+                _stages.start()
+                data, addr = server_socket.recvfrom(RECV_BYTES)
+                _stages.mark("recv")
+                handle_packet(data, addr)
+
+    except KeyboardInterrupt:
+        print("\nServer interrupted. Generating summary...")
+
+        remaining = _reorder.flush_all()
+        _save_reordered(remaining)
+        _sink.close()
+        if _rollups:
+            _rollups.close()
+        _stages.dump()
+
+        total_expected = sum(t.highest_seq for t in trackers.values())
+        missing_count = total_expected - received_count
+        delivery_rate = (received_count / total_expected) * 100 if total_expected else 0
+        print("\n=== Baseline Test Summary ===")
+        print(f"Total received: {received_count}")
+        print(f"Missing packets: {missing_count}")
+        print(f"Duplicate packets: {metrics_dup_total}")
+        print(f"Delivery rate: {delivery_rate:.2f}%")
+        drops = read_udp_drops(server_socket)
+        if drops is not None:
+            print(f"Kernel receive drops: {drops}")
+
+
+if __name__ == "__main__":
+    main()